@@ -1,29 +1,71 @@
 from __future__ import annotations
+import inspect
 from abc import ABC, abstractmethod
-from typing import Dict, Type
+from enum import Enum
+from typing import AsyncIterator, Callable, Dict, Type
 from threading import Lock
 from functools import wraps
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
+from perry.agents.cache import AnswerCache
 from perry.db.models import Agent as DBAgent
 from perry.db.operations.agents import read_agent, update_agent
 
 
 def busy_toggle(func):
+    """Keep the agent busy while the wrapped method, sync or async, runs.
+
+    Calls are counted, so overlapping calls keep the agent busy until the last one
+    ends. Async generators keep the agent busy until they are exhausted or closed.
+    """
+    if inspect.isasyncgenfunction(func):
+
+        @wraps(func)
+        async def async_gen_wrapper(self, *args, **kwargs):
+            self.pin()
+            try:
+                async for item in func(self, *args, **kwargs):
+                    yield item
+            finally:
+                self.unpin()
+
+        return async_gen_wrapper
+
+    if inspect.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def async_wrapper(self, *args, **kwargs):
+            self.pin()
+            try:
+                return await func(self, *args, **kwargs)
+            finally:
+                self.unpin()
+
+        return async_wrapper
+
     @wraps(func)
     def wrapper(self, *args, **kwargs):
-        with self._busy_lock:
-            self.busy = True
+        self.pin()
         try:
-            result = func(self, *args, **kwargs)
+            return func(self, *args, **kwargs)
         finally:
-            with self._busy_lock:
-                self.busy = False
-        return result
+            self.unpin()
 
     return wrapper
 
 
+class AgentEventType(str, Enum):
+    progress = "progress"
+    token = "token"
+
+
+class AgentEvent(BaseModel):
+    """Part of a streamed answer: a progress note or the next tokens of the answer."""
+
+    type: AgentEventType
+    content: str
+
+
 class BaseAgentConfig(BaseModel):
     name: str = Field(
         type="string",
@@ -32,29 +74,113 @@ class BaseAgentConfig(BaseModel):
 
 
 class BaseAgent(ABC):
-    def __init__(self, db_session: Session, config: dict, agent_id: int):
+    def __init__(
+        self,
+        db_session: Session,
+        config: dict,
+        agent_id: int,
+        progress_callback: Callable[[float], None] | None = None,
+    ):
         self.config = self._get_config_instance(config)
         self.id = agent_id
-        self.busy = False
+        self._busy_count = 0
         self._busy_lock = Lock()
         self._db_session = db_session
+        self._progress_callback = progress_callback
         self._agent_data = self._load_agent_data(db_session, agent_id)
         self._setup()
 
+    @property
+    def busy(self) -> bool:
+        """Whether the agent is in use, which keeps it from being unloaded."""
+        return self._busy_count > 0
+
+    def pin(self):
+        """Mark the agent as in use until a matching call to unpin."""
+        with self._busy_lock:
+            self._busy_count += 1
+
+    def unpin(self):
+        with self._busy_lock:
+            self._busy_count -= 1
+
     @abstractmethod
     def _setup(self):
         """Agent specific setup logic."""
 
+    def _report_progress(self, progress: float):
+        """Report the fraction of the setup that is done."""
+        if self._progress_callback is not None:
+            self._progress_callback(progress)
+
+    def get_memory_footprint(self) -> int:
+        """Return the approximate number of bytes held in memory by the agent."""
+        return 0
+
     @abstractmethod
     async def _on_query(self, query: str) -> str:
         """Query the agent and get a response."""
 
+    def _get_answer_cache_key(self) -> str | None:
+        """Return the key of the cached answers this agent may reuse.
+
+        The key must change whenever anything besides the query changes the answer.
+        Agents opt in to the answer cache by returning a key and implementing
+        _embed_query. Returns None by default, which disables the cache.
+        """
+        return None
+
+    async def _embed_query(self, query: str) -> list[float]:
+        """Embed a query to match it with the queries of cached answers."""
+        raise NotImplementedError
+
     @busy_toggle
     async def query(self, query: str) -> str:
         """Query the agent and get a response."""
-        response = await self._on_query(query)
+        cache_key = self._get_answer_cache_key()
+        if cache_key is None:
+            return await self._on_query(query)
+        query_embedding = await self._embed_query(query)
+        response = AnswerCache().get(cache_key, query_embedding)
+        if response is None:
+            response = await self._on_query(query)
+            AnswerCache().put(cache_key, query_embedding, response)
         return response
 
+    async def _on_query_stream(self, query: str) -> AsyncIterator[AgentEvent]:
+        """Query the agent and stream the response.
+
+        Agents that cannot stream send the whole response as a single token event.
+        """
+        yield AgentEvent(type=AgentEventType.token, content=await self._on_query(query))
+
+    @busy_toggle
+    async def query_stream(self, query: str) -> AsyncIterator[AgentEvent]:
+        """Query the agent and get the response as a stream of events.
+
+        Joining the contents of the token events gives the response.
+        """
+        cache_key = self._get_answer_cache_key()
+        if cache_key is None:
+            async for event in self._on_query_stream(query):
+                yield event
+            return
+        query_embedding = await self._embed_query(query)
+        response = AnswerCache().get(cache_key, query_embedding)
+        if response is not None:
+            yield AgentEvent(type=AgentEventType.token, content=response)
+            return
+        tokens = []
+        async for event in self._on_query_stream(query):
+            if event.type == AgentEventType.token:
+                tokens.append(event.content)
+            yield event
+        AnswerCache().put(cache_key, query_embedding, "".join(tokens))
+
+    def close(self):
+        """Release the database session of the agent once it is unloaded."""
+        self._db_session.close()
+
     @abstractmethod
     def _on_save(self):
         """Agent specific save logic."""
@@ -77,6 +203,14 @@ class BaseAgent(ABC):
     ) -> BaseAgent:
         """Agent specific loading logic."""
 
+    @classmethod
+    def index_document(cls, db_session: Session, document_id: int):
+        """Prepare a newly uploaded document for use by this agent type.
+
+        Called from a background job, so agents can move expensive work such as
+        embedding off the conversation setup. Does nothing by default.
+        """
+
     @classmethod
     def load(cls, db_session: Session, agent_id: int) -> BaseAgent:
         """Load the agent state and return an instance of the agent."""
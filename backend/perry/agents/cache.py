@@ -0,0 +1,103 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from itertools import count
+from threading import Lock
+import numpy as np
+from perry.settings import get_settings
+
+
+@dataclass
+class CachedAnswer:
+    key: str
+    embedding: np.ndarray
+    answer: str
+    expires_at: float
+
+
+class AnswerCache:
+    """Cache of agent answers matched by the similarity of the query embeddings.
+
+    Answers are grouped by a key naming everything the answer depends on besides the
+    query, such as the documents and the model. A query is answered from the cache
+    if an answer with the same key was given to a query whose embedding has at least
+    the configured cosine similarity. Answers expire after a time to live, and the
+    least recently used answers are evicted once the cache is full.
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(AnswerCache, cls).__new__(cls)
+            cls.reset()
+        return cls._instance
+
+    @classmethod
+    def reset(cls):
+        settings = get_settings()
+        cls._similarity_threshold = settings.answer_cache_similarity
+        cls._ttl = settings.answer_cache_ttl_seconds
+        cls._max_entries = settings.answer_cache_max_entries
+        cls._entries: OrderedDict[int, CachedAnswer] = OrderedDict()
+        cls._entry_ids_by_key: dict[str, list[int]] = {}
+        cls._entry_ids = count()
+        cls._lock = Lock()
+        cls.hits = 0
+        cls.misses = 0
+
+    def get(self, key: str, query_embedding: list[float]) -> str | None:
+        """Return the answer to the most similar cached query, if similar enough."""
+        with self._lock:
+            self._remove_expired(key)
+            entry_ids = self._entry_ids_by_key.get(key, [])
+            if entry_ids:
+                embeddings = np.stack([self._entries[i].embedding for i in entry_ids])
+                similarities = embeddings @ self._normalize(query_embedding)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self._similarity_threshold:
+                    self._entries.move_to_end(entry_ids[best])
+                    self.__class__.hits += 1
+                    return self._entries[entry_ids[best]].answer
+            self.__class__.misses += 1
+            return None
+
+    def put(self, key: str, query_embedding: list[float], answer: str):
+        with self._lock:
+            entry_id = next(self._entry_ids)
+            self._entries[entry_id] = CachedAnswer(
+                key=key,
+                embedding=self._normalize(query_embedding),
+                answer=answer,
+                expires_at=time.monotonic() + self._ttl,
+            )
+            self._entry_ids_by_key.setdefault(key, []).append(entry_id)
+            while len(self._entries) > self._max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def get_stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+            }
+
+    def _remove_expired(self, key: str):
+        now = time.monotonic()
+        for entry_id in list(self._entry_ids_by_key.get(key, [])):
+            if self._entries[entry_id].expires_at <= now:
+                self._remove(entry_id)
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        entry_ids = self._entry_ids_by_key[entry.key]
+        entry_ids.remove(entry_id)
+        if not entry_ids:
+            del self._entry_ids_by_key[entry.key]
+
+    @staticmethod
+    def _normalize(embedding: list[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -1,4 +1,5 @@
-from perry.agents.base import BaseAgent, BaseAgentConfig
+from typing import AsyncIterator
+from perry.agents.base import BaseAgent, BaseAgentConfig, AgentEvent, AgentEventType
 from sqlalchemy.orm import Session
 
 
@@ -11,6 +12,13 @@ class EchoAgent(BaseAgent):
     async def _on_query(self, query: str) -> str:
         return "Echo: " + query
 
+    async def _on_query_stream(self, query: str) -> AsyncIterator[AgentEvent]:
+        words = (await self._on_query(query)).split(" ")
+        for i, word in enumerate(words):
+            yield AgentEvent(
+                type=AgentEventType.token, content=word if i == 0 else " " + word
+            )
+
     def _on_save(self):
         pass
 
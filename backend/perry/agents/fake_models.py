@@ -0,0 +1,188 @@
+import asyncio
+import hashlib
+import random
+import time
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, List, Sequence
+from llama_index.indices.query.schema import QueryBundle
+from llama_index.llms.base import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.llms.custom import CustomLLM
+from llama_index.llms.generic_utils import (
+    acompletion_to_chat_decorator,
+    astream_completion_to_chat_decorator,
+)
+from llama_index.question_gen.types import BaseQuestionGenerator, SubQuestion
+from llama_index.tools.types import ToolMetadata
+from perry.indexing.embeddings import HashingEmbedding
+
+FAKE_VOCABULARY = (
+    "the report shows revenue growth costs risk market results quarter "
+    "analysis data increase decrease compared with previous year"
+).split()
+
+
+class LatencyDistribution(str, Enum):
+    constant = "constant"
+    uniform = "uniform"
+    lognormal = "lognormal"
+
+
+@dataclass
+class LatencyModel:
+    """Random latency in seconds around a median.
+
+    Uniform latencies range from zero to twice the median, and lognormal latencies
+    have a long tail of slow responses like remote APIs.
+    """
+
+    median: float
+    distribution: LatencyDistribution = LatencyDistribution.constant
+    sigma: float = 0.5
+
+    def sample(self, rng: random.Random) -> float:
+        if self.distribution == LatencyDistribution.uniform:
+            return rng.uniform(0, 2 * self.median)
+        if self.distribution == LatencyDistribution.lognormal and self.median > 0:
+            return rng.lognormvariate(0, self.sigma) * self.median
+        return self.median
+
+
+class FakeLLM(CustomLLM):
+    """Local stand-in for a remote LLM, for load tests without network or cost.
+
+    Answers are made up of words chosen deterministically from the prompt. The first
+    token arrives after a latency sampled from the latency model, and the following
+    tokens at tokens_per_second.
+    """
+
+    def __init__(
+        self,
+        latency: LatencyModel,
+        tokens_per_second: float,
+        output_tokens: int = 64,
+        seed: int | None = None,
+    ):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self._rng = random.Random(seed)
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(num_output=self.output_tokens)
+
+    def complete(self, prompt: str, **kwargs: Any) -> CompletionResponse:
+        time.sleep(self._get_duration())
+        return CompletionResponse(text=" ".join(self._get_tokens(prompt)))
+
+    def stream_complete(self, prompt: str, **kwargs: Any) -> CompletionResponseGen:
+        def gen() -> CompletionResponseGen:
+            time.sleep(self.latency.sample(self._rng))
+            text = ""
+            for token in self._get_tokens(prompt):
+                delta = token if not text else " " + token
+                text += delta
+                yield CompletionResponse(text=text, delta=delta)
+                time.sleep(1 / self.tokens_per_second)
+
+        return gen()
+
+    async def acomplete(self, prompt: str, **kwargs: Any) -> CompletionResponse:
+        await asyncio.sleep(self._get_duration())
+        return CompletionResponse(text=" ".join(self._get_tokens(prompt)))
+
+    async def astream_complete(
+        self, prompt: str, **kwargs: Any
+    ) -> CompletionResponseAsyncGen:
+        async def gen() -> CompletionResponseAsyncGen:
+            await asyncio.sleep(self.latency.sample(self._rng))
+            text = ""
+            for token in self._get_tokens(prompt):
+                delta = token if not text else " " + token
+                text += delta
+                yield CompletionResponse(text=text, delta=delta)
+                await asyncio.sleep(1 / self.tokens_per_second)
+
+        return gen()
+
+    async def achat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponse:
+        return await acompletion_to_chat_decorator(self.acomplete)(messages, **kwargs)
+
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        return await astream_completion_to_chat_decorator(self.astream_complete)(
+            messages, **kwargs
+        )
+
+    def _get_duration(self) -> float:
+        return (
+            self.latency.sample(self._rng) + self.output_tokens / self.tokens_per_second
+        )
+
+    def _get_tokens(self, prompt: str) -> list[str]:
+        seed = hashlib.sha256(prompt.encode("utf-8")).digest()
+        rng = random.Random(seed)
+        return [rng.choice(FAKE_VOCABULARY) for _ in range(self.output_tokens)]
+
+
+class FakeEmbedding(HashingEmbedding):
+    """Local embedding model taking a sampled latency for every request."""
+
+    def __init__(self, latency: LatencyModel, seed: int | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self._rng = random.Random(seed)
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        time.sleep(self.latency.sample(self._rng))
+        return super()._get_query_embedding(query)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency.sample(self._rng))
+        return [HashingEmbedding._get_text_embedding(self, text) for text in texts]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+
+class FakeQuestionGenerator(BaseQuestionGenerator):
+    """Ask every tool the query itself, taking as long as the LLM would.
+
+    Fake LLM output cannot be parsed into sub questions, so they are generated here.
+    """
+
+    def __init__(self, llm: FakeLLM):
+        self._llm = llm
+
+    def generate(
+        self, tools: Sequence[ToolMetadata], query: QueryBundle
+    ) -> List[SubQuestion]:
+        self._llm.complete(query.query_str)
+        return self._get_sub_questions(tools, query)
+
+    async def agenerate(
+        self, tools: Sequence[ToolMetadata], query: QueryBundle
+    ) -> List[SubQuestion]:
+        await self._llm.acomplete(query.query_str)
+        return self._get_sub_questions(tools, query)
+
+    @staticmethod
+    def _get_sub_questions(
+        tools: Sequence[ToolMetadata], query: QueryBundle
+    ) -> List[SubQuestion]:
+        return [
+            SubQuestion(sub_question=query.query_str, tool_name=tool.name)
+            for tool in tools
+        ]
@@ -0,0 +1,84 @@
+from typing import Any, Hashable
+
+
+class IndexedHeap:
+    """Binary min-heap of keys ordered by priority.
+
+    The position of every key is tracked, so the priority of a key can be updated or
+    the key removed in O(log n) instead of rebuilding the heap.
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[Any, Hashable]] = []
+        self._positions: dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._positions
+
+    def push(self, key: Hashable, priority: Any):
+        """Add a key, or update its priority if it is already in the heap."""
+        if key in self._positions:
+            position = self._positions[key]
+            self._heap[position] = (priority, key)
+            self._restore(position)
+            return
+        self._heap.append((priority, key))
+        self._positions[key] = len(self._heap) - 1
+        self._sift_up(len(self._heap) - 1)
+
+    def peek(self) -> tuple[Any, Hashable] | None:
+        """Return the (priority, key) pair with the lowest priority."""
+        return self._heap[0] if self._heap else None
+
+    def pop(self) -> tuple[Any, Hashable]:
+        """Remove and return the (priority, key) pair with the lowest priority."""
+        if not self._heap:
+            raise IndexError("pop from empty heap")
+        item = self._heap[0]
+        self.remove(item[1])
+        return item
+
+    def remove(self, key: Hashable):
+        """Remove a key if it is in the heap."""
+        position = self._positions.pop(key, None)
+        if position is None:
+            return
+        last = self._heap.pop()
+        if position < len(self._heap):
+            self._heap[position] = last
+            self._positions[last[1]] = position
+            self._restore(position)
+
+    def _restore(self, position: int):
+        if position > 0 and self._heap[position] < self._heap[(position - 1) // 2]:
+            self._sift_up(position)
+        else:
+            self._sift_down(position)
+
+    def _sift_up(self, position: int):
+        while position > 0:
+            parent = (position - 1) // 2
+            if not self._heap[position] < self._heap[parent]:
+                break
+            self._swap(position, parent)
+            position = parent
+
+    def _sift_down(self, position: int):
+        size = len(self._heap)
+        while True:
+            smallest = position
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < size and self._heap[child] < self._heap[smallest]:
+                    smallest = child
+            if smallest == position:
+                break
+            self._swap(position, smallest)
+            position = smallest
+
+    def _swap(self, i: int, j: int):
+        self._heap[i], self._heap[j] = self._heap[j], self._heap[i]
+        self._positions[self._heap[i][1]] = i
+        self._positions[self._heap[j][1]] = j
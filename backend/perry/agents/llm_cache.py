@@ -0,0 +1,250 @@
+import asyncio
+import hashlib
+import json
+import time
+from pathlib import Path
+from typing import Any, Sequence
+from llama_index.llms.base import (
+    LLM,
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from perry.sqlite_cache import SqliteCache
+
+
+class LLMResponseCache(SqliteCache):
+    """Persistent cache of LLM responses keyed by the exact request.
+
+    Responses are stored in a SQLite file and tagged with the hashes of the documents
+    the request was made for, so they can be dropped once a document is gone.
+    """
+
+    _store_path = Path(".cache", "llm_responses.sqlite3")
+    _schema = (
+        "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, "
+        "response TEXT NOT NULL, created_at REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS response_documents (key TEXT NOT NULL, "
+        "doc_hash TEXT NOT NULL, PRIMARY KEY (key, doc_hash))",
+        "CREATE INDEX IF NOT EXISTS response_documents_doc_hash "
+        "ON response_documents (doc_hash)",
+    )
+
+    @staticmethod
+    def get_key(model: str, temperature: float | None, request: Any) -> str:
+        """Return the key of a request, which must be JSON serializable."""
+        encoded = json.dumps(
+            {"model": model, "temperature": temperature, "request": request},
+            sort_keys=True,
+            default=str,
+        ).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    @classmethod
+    def get(cls, key: str) -> str | None:
+        with cls._connect() as connection:
+            row = connection.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    @classmethod
+    def put(cls, key: str, response: str, doc_hashes: Sequence[str]):
+        with cls._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at) "
+                "VALUES (?, ?, ?)",
+                (key, response, time.time()),
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO response_documents (key, doc_hash) "
+                "VALUES (?, ?)",
+                [(key, doc_hash) for doc_hash in doc_hashes],
+            )
+
+    @classmethod
+    def invalidate(cls, doc_hash: str) -> int:
+        """Drop the responses made for a document and return how many were dropped."""
+        with cls._connect() as connection:
+            keys = [
+                row[0]
+                for row in connection.execute(
+                    "SELECT key FROM response_documents WHERE doc_hash = ?",
+                    (doc_hash,),
+                )
+            ]
+            connection.executemany(
+                "DELETE FROM responses WHERE key = ?", [(key,) for key in keys]
+            )
+            connection.executemany(
+                "DELETE FROM response_documents WHERE key = ?",
+                [(key,) for key in keys],
+            )
+        return len(keys)
+
+
+class CachedLLM(LLM):
+    """LLM answering repeated requests from the LLMResponseCache.
+
+    Only meant for deterministic models, such as those with a temperature of 0.
+    Streamed responses are cached once complete and replayed as a single chunk. The
+    async methods use the cache from a worker thread, off the event loop.
+    """
+
+    def __init__(self, llm: LLM, doc_hashes: Sequence[str]):
+        self._llm = llm
+        self._doc_hashes = sorted(doc_hashes)
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self._llm.metadata
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        key = self._get_chat_key(messages, kwargs)
+        cached = self._get_chat_response(key)
+        if cached is not None:
+            return cached
+        response = self._llm.chat(messages, **kwargs)
+        self._put_chat_response(key, response)
+        return response
+
+    def complete(self, prompt: str, **kwargs: Any) -> CompletionResponse:
+        key = self._get_completion_key(prompt, kwargs)
+        cached = LLMResponseCache.get(key)
+        if cached is not None:
+            return CompletionResponse(text=cached)
+        response = self._llm.complete(prompt, **kwargs)
+        LLMResponseCache.put(key, response.text, self._doc_hashes)
+        return response
+
+    def stream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseGen:
+        key = self._get_chat_key(messages, kwargs)
+        cached = self._get_chat_response(key)
+        if cached is not None:
+            cached.delta = cached.message.content
+            return iter([cached])
+
+        def gen() -> ChatResponseGen:
+            response = None
+            for response in self._llm.stream_chat(messages, **kwargs):
+                yield response
+            if response is not None:
+                self._put_chat_response(key, response)
+
+        return gen()
+
+    def stream_complete(self, prompt: str, **kwargs: Any) -> CompletionResponseGen:
+        key = self._get_completion_key(prompt, kwargs)
+        cached = LLMResponseCache.get(key)
+        if cached is not None:
+            return iter([CompletionResponse(text=cached, delta=cached)])
+
+        def gen() -> CompletionResponseGen:
+            response = None
+            for response in self._llm.stream_complete(prompt, **kwargs):
+                yield response
+            if response is not None:
+                LLMResponseCache.put(key, response.text, self._doc_hashes)
+
+        return gen()
+
+    async def achat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponse:
+        key = self._get_chat_key(messages, kwargs)
+        cached = await asyncio.to_thread(self._get_chat_response, key)
+        if cached is not None:
+            return cached
+        response = await self._llm.achat(messages, **kwargs)
+        await asyncio.to_thread(self._put_chat_response, key, response)
+        return response
+
+    async def acomplete(self, prompt: str, **kwargs: Any) -> CompletionResponse:
+        key = self._get_completion_key(prompt, kwargs)
+        cached = await asyncio.to_thread(LLMResponseCache.get, key)
+        if cached is not None:
+            return CompletionResponse(text=cached)
+        response = await self._llm.acomplete(prompt, **kwargs)
+        await self._aput(key, response.text)
+        return response
+
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        key = self._get_chat_key(messages, kwargs)
+        cached = await asyncio.to_thread(self._get_chat_response, key)
+        responses = None
+        if cached is None:
+            responses = await self._llm.astream_chat(messages, **kwargs)
+
+        async def gen() -> ChatResponseAsyncGen:
+            if cached is not None:
+                cached.delta = cached.message.content
+                yield cached
+                return
+            response = None
+            async for response in responses:
+                yield response
+            if response is not None:
+                await asyncio.to_thread(self._put_chat_response, key, response)
+
+        return gen()
+
+    async def astream_complete(
+        self, prompt: str, **kwargs: Any
+    ) -> CompletionResponseAsyncGen:
+        key = self._get_completion_key(prompt, kwargs)
+        cached = await asyncio.to_thread(LLMResponseCache.get, key)
+        responses = None
+        if cached is None:
+            responses = await self._llm.astream_complete(prompt, **kwargs)
+
+        async def gen() -> CompletionResponseAsyncGen:
+            if cached is not None:
+                yield CompletionResponse(text=cached, delta=cached)
+                return
+            response = None
+            async for response in responses:
+                yield response
+            if response is not None:
+                await self._aput(key, response.text)
+
+        return gen()
+
+    def _get_key(self, request: dict) -> str:
+        return LLMResponseCache.get_key(
+            getattr(self._llm, "model", self._llm.__class__.__name__),
+            getattr(self._llm, "temperature", None),
+            request,
+        )
+
+    def _get_completion_key(self, prompt: str, kwargs: dict) -> str:
+        return self._get_key({"prompt": prompt, "kwargs": kwargs})
+
+    def _get_chat_key(self, messages: Sequence[ChatMessage], kwargs: dict) -> str:
+        return self._get_key(
+            {
+                "messages": [json.loads(message.json()) for message in messages],
+                "kwargs": kwargs,
+            }
+        )
+
+    @staticmethod
+    def _get_chat_response(key: str) -> ChatResponse | None:
+        cached = LLMResponseCache.get(key)
+        if cached is None:
+            return None
+        return ChatResponse(message=ChatMessage.parse_raw(cached))
+
+    def _put_chat_response(self, key: str, response: ChatResponse):
+        LLMResponseCache.put(key, response.message.json(), self._doc_hashes)
+
+    async def _aput(self, key: str, response: str):
+        await asyncio.to_thread(LLMResponseCache.put, key, response, self._doc_hashes)
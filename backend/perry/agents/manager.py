@@ -1,16 +1,30 @@
+import asyncio
+from concurrent.futures import Future
 from datetime import datetime, timedelta
+from typing import Callable
 from sqlalchemy.orm.session import Session
 from perry.db.operations.agents import read_agent
+from perry.db.session import DatabaseSessionManager
 from perry.agents.base import BaseAgent, AgentRegistry
+from perry.agents.heap import IndexedHeap
+from perry.settings import get_settings
 
-from threading import Lock, Timer
-from queue import PriorityQueue
+from threading import Lock
 
 
 class AgentManager:
-    """Manage the lifetime of agent instances."""
+    """Manage the lifetime of agent instances.
+
+    Agents are evicted after being idle for the cleanup timeout, and least recently
+    used agents are evicted whenever the approximate memory held by all loaded
+    agents exceeds the configured budget. Busy agents are never evicted.
+
+    Loaded agents are kept in a heap ordered by their last use, which gives both the
+    next agent to expire and the least recently used agent. Cleanup runs as an
+    asyncio task of the server, and runs again within a second while loaded agents
+    exceed the budget, for example because busy agents could not be evicted.
+    """
 
-    # TODO: Add memory management that scales with user demand. Will use singleton pattern for now
     _instance = None
 
     def __new__(cls):
@@ -22,37 +36,113 @@ class AgentManager:
     @classmethod
     def reset(cls):
         cls.agent_dict = {}
-        cls.expiry_queue = PriorityQueue()
+        cls._loading = {}
         cls.lock = Lock()
         cls._cleanup_timeout = timedelta(minutes=60)
+        cls._memory_budget = get_settings().agent_memory_budget_mb * 1024 * 1024
+        cls._recency_heap = IndexedHeap()
+        cls._heap_lock = Lock()
+        cls._cleanup_interval = 60
+        cls._pressure_cleanup_interval = 1
+        cls._cleanup_task = None
+        cls._cleanup_event = None
+        cls._loop = None
 
     @classmethod
-    def load_agent(self, db: Session, agent_id):
+    def load_agent(
+        self,
+        db: Session,
+        agent_id,
+        progress_callback: Callable[[float], None] | None = None,
+    ):
+        """Return the loaded agent pinned, loading it first if it is not in memory yet.
+
+        The agent is pinned under the lock that eviction takes, so it cannot be
+        unloaded before the caller uses it. Callers must unpin it when done.
+        Concurrent requests for an agent that is still loading wait for the same load
+        to finish, while different agents load in parallel. Only the request that
+        starts a load reports its progress. Every lookup refreshes the recency of the
+        agent.
+        """
         if not isinstance(agent_id, int):
             raise ValueError("Agent ID must be an integer.")
 
+        while True:
+            with self.lock:
+                entry = self.agent_dict.get(agent_id)
+                if entry is not None:
+                    entry["agent"].pin()
+                    return self._touch(agent_id, entry)
+                future = self._loading.get(agent_id)
+                if future is None:
+                    future = Future()
+                    self._loading[agent_id] = future
+                    break
+            # Wait for the load, then look the agent up again to pin it.
+            future.result()
+
+        try:
+            agent = self._create_agent(db, agent_id, progress_callback)
+            entry = {"agent": agent, "memory_footprint": agent.get_memory_footprint()}
+        except BaseException as e:
+            with self.lock:
+                del self._loading[agent_id]
+            future.set_exception(e)
+            raise
+
         with self.lock:
-            if agent_id in self.agent_dict:
-                return self.agent_dict[agent_id]["agent"]
+            self.agent_dict[agent_id] = entry
+            agent.pin()
+            self._touch(agent_id, entry)
+            del self._loading[agent_id]
+            within_budget = self._enforce_memory_budget(keep_agent_id=agent_id)
+        future.set_result(agent)
+        if not within_budget:
+            self.request_cleanup()
 
-            db_agent = read_agent(db, agent_id)
-            if not db_agent:
-                raise ValueError(f"No agent found with ID {agent_id} in database.")
+        return agent
 
-            agent_class = AgentRegistry().get_agent_class(db_agent.type)
-            agent = agent_class(db, db_agent.config, agent_id)
+    @classmethod
+    def get_memory_usage(cls) -> int:
+        """Return the approximate number of bytes held by all loaded agents."""
+        return sum(entry["memory_footprint"] for entry in list(cls.agent_dict.values()))
 
-            if not agent:
-                raise ValueError(f"Failed to load agent with ID {agent_id}.")
+    @classmethod
+    def _touch(cls, agent_id: int, entry: dict) -> BaseAgent:
+        """Refresh the recency of an agent in O(log n)."""
+        entry["last_used"] = datetime.utcnow()
+        with cls._heap_lock:
+            cls._recency_heap.push(agent_id, entry["last_used"])
+        return entry["agent"]
 
-            agent.busy = False
+    @staticmethod
+    def _create_agent(
+        db: Session,
+        agent_id: int,
+        progress_callback: Callable[[float], None] | None = None,
+    ) -> BaseAgent:
+        db_agent = read_agent(db, agent_id)
+        if not db_agent:
+            raise ValueError(f"No agent found with ID {agent_id} in database.")
 
-            expiry_time = datetime.utcnow() + self._cleanup_timeout
-            self.agent_dict[agent_id] = {"agent": agent, "expiry_time": expiry_time}
+        agent_class = AgentRegistry().get_agent_class(db_agent.type)
+        # Agents outlive the session of the request or job loading them.
+        agent_session = DatabaseSessionManager.get_session_local()()
+        try:
+            agent = agent_class(
+                agent_session,
+                db_agent.config,
+                agent_id,
+                progress_callback=progress_callback,
+            )
+        except BaseException:
+            agent_session.close()
+            raise
 
-            self.expiry_queue.put((expiry_time, agent_id))
+        if not agent:
+            raise ValueError(f"Failed to load agent with ID {agent_id}.")
 
-            return agent
+        return agent
 
     def _remove_agent(self, agent_id):
         with self.lock:
@@ -60,18 +150,126 @@ class AgentManager:
                 agent_id in self.agent_dict
                 and not self.agent_dict[agent_id]["agent"].busy
             ):
-                del self.agent_dict[agent_id]
+                self._evict(agent_id)
+
+    @classmethod
+    def _evict(cls, agent_id: int) -> int:
+        """Unload an agent and return its memory footprint.
 
-    def _cleanup(self):
-        while not self.expiry_queue.empty():
-            expiry_time, agent_id = self.expiry_queue.get()
-            if expiry_time <= datetime.utcnow():
-                self._remove_agent(agent_id)
-            else:
-                self.expiry_queue.put((expiry_time, agent_id))
-                break
+        Must be called while holding the lock.
+        """
+        with cls._heap_lock:
+            cls._recency_heap.remove(agent_id)
+        entry = cls.agent_dict.pop(agent_id)
+        entry["agent"].close()
+        return entry["memory_footprint"]
+
+    @classmethod
+    def _evict_least_recently_used(
+        cls, should_evict: Callable[[datetime, int], bool]
+    ) -> int:
+        """Evict idle agents in order of last use while should_evict allows it.
 
-        Timer(60, self._cleanup).start()
+        should_evict gets the last use and the memory still held by loaded agents.
+        Busy agents are skipped and stay pinned. Returns the memory still held. Must be
+        called while holding the lock.
+        """
+        memory_usage = cls.get_memory_usage()
+        pinned = []
+        while True:
+            with cls._heap_lock:
+                item = cls._recency_heap.peek()
+                if item is None or not should_evict(item[0], memory_usage):
+                    break
+                cls._recency_heap.pop()
+            last_used, agent_id = item
+            entry = cls.agent_dict.get(agent_id)
+            if entry is None:
+                continue
+            if entry["agent"].busy:
+                pinned.append(item)
+                continue
+            memory_usage -= cls._evict(agent_id)
+        with cls._heap_lock:
+            for last_used, agent_id in pinned:
+                if agent_id in cls.agent_dict and agent_id not in cls._recency_heap:
+                    cls._recency_heap.push(agent_id, last_used)
+        return memory_usage
+
+    @classmethod
+    def _enforce_memory_budget(cls, keep_agent_id: int | None = None) -> bool:
+        """Evict the least recently used idle agents until the budget is met.
+
+        Returns whether loaded agents are within the budget. Must be called while
+        holding the lock.
+        """
+        if cls.get_memory_usage() <= cls._memory_budget:
+            return True
+        with cls._heap_lock:
+            cls._recency_heap.remove(keep_agent_id)
+        memory_usage = cls._evict_least_recently_used(
+            lambda last_used, memory_usage: memory_usage > cls._memory_budget
+        )
+        if keep_agent_id in cls.agent_dict:
+            with cls._heap_lock:
+                cls._recency_heap.push(
+                    keep_agent_id, cls.agent_dict[keep_agent_id]["last_used"]
+                )
+        return memory_usage <= cls._memory_budget
+
+    def _cleanup(self) -> bool:
+        """Evict idle agents and agents over the memory budget.
+
+        Returns whether loaded agents are within the budget.
+        """
+        expiry_time = datetime.utcnow() - self._cleanup_timeout
+        with self.lock:
+            self._evict_least_recently_used(
+                lambda last_used, memory_usage: last_used <= expiry_time
+            )
+            return self._enforce_memory_budget()
+
+    @classmethod
+    def request_cleanup(cls):
+        """Run a cleanup pass as soon as possible. Safe to call from any thread."""
+        if cls._loop is None or cls._cleanup_event is None:
+            return
+        try:
+            cls._loop.call_soon_threadsafe(cls._cleanup_event.set)
+        except RuntimeError:
+            # The event loop was closed while the server shut down.
+            pass
+
+    async def _run_cleanup(self):
+        while True:
+            within_budget = self._cleanup()
+            interval = (
+                self._cleanup_interval
+                if within_budget
+                else self._pressure_cleanup_interval
+            )
+            try:
+                await asyncio.wait_for(self._cleanup_event.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._cleanup_event.clear()
 
     def start(self):
-        self._cleanup()
+        """Start the cleanup task on the running event loop."""
+        if self._cleanup_task is not None:
+            return
+        self.__class__._loop = asyncio.get_running_loop()
+        self.__class__._cleanup_event = asyncio.Event()
+        self.__class__._cleanup_task = self._loop.create_task(self._run_cleanup())
+
+    async def stop(self):
+        if self._cleanup_task is None:
+            return
+        self._cleanup_task.cancel()
+        try:
+            await self._cleanup_task
+        except asyncio.CancelledError:
+            pass
+        self.__class__._cleanup_task = None
+        self.__class__._cleanup_event = None
+        self.__class__._loop = None
@@ -0,0 +1,393 @@
+import asyncio
+import logging
+from contextlib import nullcontext
+from typing import Any, AsyncIterator, Coroutine, List, Optional, Sequence, cast
+from llama_index.bridge.langchain import get_color_mapping, print_text
+from llama_index.callbacks.schema import CBEventType, EventPayload
+from llama_index.embeddings.base import BaseEmbedding
+from llama_index.indices.query.schema import QueryBundle
+from llama_index.indices.vector_store.retrievers import VectorIndexRetriever
+from llama_index.query_engine import RetrieverQueryEngine, SubQuestionQueryEngine
+from llama_index.query_engine.sub_question_query_engine import SubQuestionAnswerPair
+from llama_index.question_gen.types import SubQuestion
+from llama_index.response.schema import RESPONSE_TYPE
+from llama_index.response_synthesizers import Refine
+from llama_index.schema import NodeWithScore
+from llama_index.tools import QueryEngineTool
+from llama_index.vector_stores.types import VectorStoreQueryMode
+from perry.agents.base import AgentEvent, AgentEventType
+from perry.indexing.embeddings import get_query_embedding_batch
+from perry.indexing.vector_store import MemmapVectorStore
+
+logger = logging.getLogger(__name__)
+
+
+class BatchedSubQuestionQueryEngine(SubQuestionQueryEngine):
+    """Sub question query engine that retrieves context for sub questions in batches.
+
+    The sub questions sent to the same document are scored in a single call to its
+    vector store before their answers are synthesized. Tools whose query engine
+    cannot be batched are queried one sub question at a time.
+
+    At most max_concurrency retrievals and sub question answers run at the same
+    time, and those taking longer than tool_timeout seconds are dropped, so the final
+    answer is synthesized from the sub questions answered in time.
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        max_concurrency: int | None = None,
+        tool_timeout: float | None = None,
+        **kwargs: Any,
+    ):
+        super().__init__(*args, **kwargs)
+        self._max_concurrency = max_concurrency
+        self._tool_timeout = tool_timeout
+
+    @classmethod
+    def from_defaults(
+        cls,
+        query_engine_tools: Sequence[QueryEngineTool],
+        max_concurrency: int | None = None,
+        tool_timeout: float | None = None,
+        **kwargs: Any,
+    ) -> "BatchedSubQuestionQueryEngine":
+        engine = super().from_defaults(query_engine_tools, **kwargs)
+        engine._max_concurrency = max_concurrency
+        engine._tool_timeout = tool_timeout
+        return engine
+
+    async def _aquery(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+        sub_questions = await self._question_gen.agenerate(
+            self._metadatas, query_bundle
+        )
+
+        colors = get_color_mapping([str(i) for i in range(len(sub_questions))])
+
+        if self._verbose:
+            print_text(f"Generated {len(sub_questions)} sub questions.\n")
+
+        event_id = self.callback_manager.on_event_start(
+            CBEventType.SUB_QUESTIONS,
+            payload={
+                EventPayload.SUB_QUESTIONS: [
+                    SubQuestionAnswerPair(sub_q=sub_q) for sub_q in sub_questions
+                ]
+            },
+        )
+
+        tasks = await self._create_subq_tasks(sub_questions, colors)
+        qa_pairs_all = await asyncio.gather(*tasks)
+        qa_pairs_all = cast(List[Optional[SubQuestionAnswerPair]], qa_pairs_all)
+
+        # filter out sub questions that failed
+        qa_pairs: List[SubQuestionAnswerPair] = list(filter(None, qa_pairs_all))
+
+        self.callback_manager.on_event_end(
+            CBEventType.SUB_QUESTIONS,
+            payload={EventPayload.SUB_QUESTIONS: qa_pairs},
+            event_id=event_id,
+        )
+
+        nodes = [self._construct_node(pair) for pair in qa_pairs]
+
+        return await self._response_synthesizer.asynthesize(
+            query=query_bundle,
+            nodes=nodes,
+        )
+
+    async def astream(self, query_str: str) -> AsyncIterator[AgentEvent]:
+        """Answer a query, reporting each answered sub question and streaming tokens.
+
+        The final answer is streamed when all sub question answers fit in a single
+        prompt of the response synthesizer. Otherwise it is refined over several
+        prompts and sent as a single token event once done.
+        """
+        query_bundle = QueryBundle(query_str)
+        sub_questions = await self._question_gen.agenerate(
+            self._metadatas, query_bundle
+        )
+        yield AgentEvent(
+            type=AgentEventType.progress,
+            content=f"Generated {len(sub_questions)} sub questions.",
+        )
+
+        colors = get_color_mapping([str(i) for i in range(len(sub_questions))])
+        qa_pairs = []
+        for answered in asyncio.as_completed(
+            await self._create_subq_tasks(sub_questions, colors)
+        ):
+            qa_pair = await answered
+            if qa_pair is None:
+                continue
+            qa_pairs.append(qa_pair)
+            yield AgentEvent(
+                type=AgentEventType.progress,
+                content=f"[{qa_pair.sub_q.tool_name}] {qa_pair.sub_q.sub_question}",
+            )
+
+        nodes = [self._construct_node(pair) for pair in qa_pairs]
+        async for token in self._astream_synthesis(query_bundle, nodes):
+            yield AgentEvent(type=AgentEventType.token, content=token)
+
+    async def _astream_synthesis(
+        self, query_bundle: QueryBundle, nodes: list[NodeWithScore]
+    ) -> AsyncIterator[str]:
+        synthesizer = self._response_synthesizer
+        if isinstance(synthesizer, Refine) and nodes:
+            text_qa_template = synthesizer._text_qa_template.partial_format(
+                query_str=query_bundle.query_str
+            )
+            service_context = synthesizer._service_context
+            text_chunks = service_context.prompt_helper.repack(
+                text_qa_template, [node.node.get_content() for node in nodes]
+            )
+            if len(text_chunks) == 1:
+                tokens = await service_context.llm_predictor.astream(
+                    text_qa_template, context_str=text_chunks[0]
+                )
+                async for token in tokens:
+                    yield token
+                return
+        response = await synthesizer.asynthesize(query=query_bundle, nodes=nodes)
+        yield str(response)
+
+    async def _create_subq_tasks(
+        self, sub_questions: list[SubQuestion], colors: dict[str, str]
+    ) -> list[Coroutine[Any, Any, Optional[SubQuestionAnswerPair]]]:
+        semaphore = nullcontext()
+        if self._max_concurrency is not None:
+            semaphore = asyncio.Semaphore(self._max_concurrency)
+        retrievals = await self._aretrieve_batches(semaphore, sub_questions)
+        return [
+            self._aanswer_subq_limited(
+                semaphore, ind, sub_q, retrievals.get(ind), color=colors[str(ind)]
+            )
+            for ind, sub_q in enumerate(sub_questions)
+        ]
+
+    async def _aretrieve_batches(
+        self,
+        semaphore: asyncio.Semaphore | nullcontext,
+        sub_questions: list[SubQuestion],
+    ) -> dict[int, asyncio.Task]:
+        """Start retrieving the nodes of all sub questions of each batchable tool.
+
+        The sub questions are embedded at once, then the nodes of each tool are
+        retrieved by a task of its own. Both run off the event loop. Returns the
+        retrieval task of each batched sub question keyed by its position.
+        """
+        positions_by_tool: dict[str, list[int]] = {}
+        for ind, sub_q in enumerate(sub_questions):
+            if self._get_batch_retriever(sub_q.tool_name) is not None:
+                positions_by_tool.setdefault(sub_q.tool_name, []).append(ind)
+        if not positions_by_tool:
+            return {}
+
+        query_bundles = {
+            ind: QueryBundle(sub_questions[ind].sub_question)
+            for positions in positions_by_tool.values()
+            for ind in positions
+        }
+        async with semaphore:
+            try:
+                await asyncio.wait_for(
+                    asyncio.to_thread(
+                        self._embed_batches, positions_by_tool, query_bundles
+                    ),
+                    timeout=self._tool_timeout,
+                )
+            except (asyncio.TimeoutError, ValueError):
+                logger.warning("Failed to embed sub questions in batch")
+                return {}
+
+        retrievals = {}
+        for tool_name, positions in positions_by_tool.items():
+            retrieval = asyncio.ensure_future(
+                self._aretrieve_batch_limited(
+                    semaphore,
+                    tool_name,
+                    {ind: query_bundles[ind] for ind in positions},
+                )
+            )
+            retrievals.update({ind: retrieval for ind in positions})
+        return retrievals
+
+    def _embed_batches(
+        self,
+        positions_by_tool: dict[str, list[int]],
+        query_bundles: dict[int, QueryBundle],
+    ) -> None:
+        """Embed the batched sub questions, in one call per embedding model."""
+        batches: dict[int, tuple[BaseEmbedding, list[QueryBundle]]] = {}
+        for tool_name, positions in positions_by_tool.items():
+            retriever = cast(VectorIndexRetriever, self._get_batch_retriever(tool_name))
+            embed_model = retriever._service_context.embed_model
+            batches.setdefault(id(embed_model), (embed_model, []))[1].extend(
+                query_bundles[ind] for ind in positions
+            )
+        for embed_model, batch in batches.values():
+            embeddings = get_query_embedding_batch(
+                embed_model, [query_bundle.query_str for query_bundle in batch]
+            )
+            for query_bundle, embedding in zip(batch, embeddings):
+                query_bundle.embedding = embedding
+
+    async def _aretrieve_batch_limited(
+        self,
+        semaphore: asyncio.Semaphore | nullcontext,
+        tool_name: str,
+        query_bundles: dict[int, QueryBundle],
+    ) -> dict[int, tuple[QueryBundle, list[NodeWithScore]]] | None:
+        """Retrieve the nodes of a tool once the semaphore allows, within the timeout.
+
+        Returns the query and nodes keyed by the position of the sub question, or
+        None if the retrieval timed out. A failed batch returns no nodes, so its sub
+        questions are queried one at a time instead.
+        """
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(
+                    asyncio.to_thread(
+                        self._retrieve_tool_batch, tool_name, query_bundles
+                    ),
+                    timeout=self._tool_timeout,
+                )
+            except asyncio.TimeoutError:
+                logger.warning(
+                    f"[{tool_name}] Timed out after {self._tool_timeout}s "
+                    f"retrieving {len(query_bundles)} sub questions"
+                )
+                return None
+            except ValueError:
+                logger.warning(
+                    f"[{tool_name}] Failed to retrieve sub questions in batch"
+                )
+                return {}
+
+    def _retrieve_tool_batch(
+        self, tool_name: str, query_bundles: dict[int, QueryBundle]
+    ) -> dict[int, tuple[QueryBundle, list[NodeWithScore]]]:
+        query_engine = self._query_engines[tool_name]
+        retriever = cast(VectorIndexRetriever, self._get_batch_retriever(tool_name))
+        batch_nodes = self._retrieve_batch(retriever, list(query_bundles.values()))
+        retrieved = {}
+        for (ind, query_bundle), nodes in zip(query_bundles.items(), batch_nodes):
+            for node_postprocessor in query_engine._node_postprocessors:
+                nodes = node_postprocessor.postprocess_nodes(
+                    nodes, query_bundle=query_bundle
+                )
+            retrieved[ind] = (query_bundle, nodes)
+        return retrieved
+
+    @staticmethod
+    def _retrieve_batch(
+        retriever: VectorIndexRetriever, query_bundles: list[QueryBundle]
+    ) -> list[list[NodeWithScore]]:
+        vector_store = cast(MemmapVectorStore, retriever._vector_store)
+        rows = None
+        if retriever._node_ids:
+            rows = vector_store._get_rows(retriever._node_ids)
+        results = vector_store.query_batch(
+            [query_bundle.embedding for query_bundle in query_bundles],
+            retriever._similarity_top_k,
+            rows=rows,
+        )
+        nodes_dict = retriever._index.index_struct.nodes_dict
+        return [
+            [
+                NodeWithScore(node=node, score=score)
+                for node, score in zip(
+                    retriever._docstore.get_nodes(
+                        [nodes_dict[id_] for id_ in result.ids]
+                    ),
+                    result.similarities,
+                )
+            ]
+            for result in results
+        ]
+
+    def _get_batch_retriever(self, tool_name: str) -> VectorIndexRetriever | None:
+        """Return the retriever of a tool if its sub questions can be batched."""
+        query_engine = self._query_engines.get(tool_name)
+        if not isinstance(query_engine, RetrieverQueryEngine):
+            return None
+        retriever = query_engine.retriever
+        if (
+            isinstance(retriever, VectorIndexRetriever)
+            and isinstance(retriever._vector_store, MemmapVectorStore)
+            and retriever._vector_store_query_mode == VectorStoreQueryMode.DEFAULT
+            and retriever._filters is None
+            and not retriever._doc_ids
+        ):
+            return retriever
+        return None
+
+    async def _aanswer_subq_limited(
+        self,
+        semaphore: asyncio.Semaphore | nullcontext,
+        ind: int,
+        sub_q: SubQuestion,
+        retrieval: asyncio.Task | None,
+        color: Optional[str] = None,
+    ) -> Optional[SubQuestionAnswerPair]:
+        """Answer a sub question once the semaphore allows, within the tool timeout.
+
+        Batched sub questions first wait for the nodes retrieved for their tool, and
+        are dropped if the retrieval timed out.
+        """
+        retrieved = None
+        if retrieval is not None:
+            batch = await retrieval
+            if batch is None:
+                return None
+            retrieved = batch.get(ind)
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(
+                    self._aanswer_subq(sub_q, retrieved, color=color),
+                    timeout=self._tool_timeout,
+                )
+            except asyncio.TimeoutError:
+                logger.warning(
+                    f"[{sub_q.tool_name}] Timed out after {self._tool_timeout}s "
+                    f"answering {sub_q.sub_question}"
+                )
+                return None
+
+    async def _aanswer_subq(
+        self,
+        sub_q: SubQuestion,
+        retrieved: tuple[QueryBundle, list[NodeWithScore]] | None,
+        color: Optional[str] = None,
+    ) -> Optional[SubQuestionAnswerPair]:
+        query_engine = self._query_engines.get(sub_q.tool_name)
+        if retrieved is None and not isinstance(query_engine, RetrieverQueryEngine):
+            return await self._aquery_subq(sub_q, color=color)
+        try:
+            if retrieved is None:
+                # Retrieval embeds the sub question, which blocks, so it runs off the
+                # event loop.
+                query_bundle = QueryBundle(sub_q.sub_question)
+                nodes = await asyncio.to_thread(query_engine.retrieve, query_bundle)
+            else:
+                query_bundle, nodes = retrieved
+
+            if self._verbose:
+                print_text(
+                    f"[{sub_q.tool_name}] Q: {sub_q.sub_question}\n", color=color
+                )
+
+            response = await query_engine.asynthesize(query_bundle, nodes)
+            response_text = str(response)
+
+            if self._verbose:
+                print_text(f"[{sub_q.tool_name}] A: {response_text}\n", color=color)
+
+            return SubQuestionAnswerPair(
+                sub_q=sub_q, answer=response_text, sources=response.source_nodes
+            )
+        except ValueError:
+            logger.warning(f"[{sub_q.tool_name}] Failed to run {sub_q.sub_question}")
+            return None
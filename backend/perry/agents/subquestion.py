@@ -1,30 +1,44 @@
+import asyncio
+import hashlib
 import json
 import os
 from enum import Enum
 from pathlib import Path
-from pydantic import confloat, Field
+from typing import AsyncIterator
+from pydantic import confloat, conint, Field
 from llama_index import (
     Document,
-    SimpleDirectoryReader,
     VectorStoreIndex,
     ServiceContext,
-    StorageContext,
-    load_index_from_storage,
     Prompt,
 )
 from llama_index.response.schema import Response
 from llama_index.tools import QueryEngineTool, ToolMetadata
 from llama_index.llms import OpenAI
 from llama_index.llms.base import LLM
-from llama_index.query_engine import SubQuestionQueryEngine
+from llama_index.embeddings.base import BaseEmbedding
 from llama_index.callbacks import CallbackManager, LlamaDebugHandler
 from dotenv import load_dotenv
 import openai
 from sqlalchemy.orm import Session
 
-from perry.agents.base import BaseAgent, BaseAgentConfig
+from perry.agents.base import AgentEvent, BaseAgent, BaseAgentConfig
+from perry.agents.fake_models import (
+    FakeEmbedding,
+    FakeLLM,
+    FakeQuestionGenerator,
+    LatencyDistribution,
+    LatencyModel,
+)
+from perry.agents.llm_cache import CachedLLM
+from perry.agents.query_engine import BatchedSubQuestionQueryEngine
 from perry.db.models import Document as DBDocument, User as DBUser, Agent as DBAgent
 from perry.db.operations.documents import get_document
+from perry.indexing.embeddings import create_embed_model
+from perry.indexing.parsing import PdfParser
+from perry.indexing.store import IndexStore
+from perry.indexing.vector_store import MemmapVectorStore
+from perry.settings import get_settings
 
 
 class ModelType(str, Enum):
@@ -33,6 +47,22 @@ class ModelType(str, Enum):
     GPT_3_5_TURBO = "gpt-3.5-turbo"
 
 
+class ModelProvider(str, Enum):
+    OPENAI = "openai"
+    FAKE = "fake"
+
+
+# Settings of the config that change the answer to a query, so answers given with
+# other values are not reused.
+ANSWER_CACHE_CONFIG_FIELDS = {
+    "language_model_type",
+    "temperature",
+    "model_provider",
+    "ann_probes",
+    "sub_question_timeout",
+}
+
+
 class SubquestionConfig(BaseAgentConfig):
     """Configuration for the SubquestionAgent."""
 
@@ -44,20 +74,72 @@ class SubquestionConfig(BaseAgentConfig):
         description=f"The type of language model to use. Choose from {', '.join([i.value for i in ModelType])}.",
     )
     temperature: confloat(ge=0.0, le=1.0) = 0.0
+    ann_probes: conint(ge=1) = Field(
+        8,
+        title="Approximate search probes",
+        description="Clusters searched per sub question in documents large enough to be searched approximately. More probes are slower but find more of the exact top results.",
+    )
+    max_concurrent_sub_questions: conint(ge=1) = Field(
+        8,
+        title="Concurrent sub questions",
+        description="Sub questions answered at the same time.",
+    )
+    sub_question_timeout: confloat(ge=1.0) = Field(
+        60.0,
+        title="Sub question timeout (seconds)",
+        description="Time after which the answer of a sub question is dropped, so the final answer is synthesized from the sub questions answered in time.",
+    )
+    use_answer_cache: bool = Field(
+        False,
+        title="Reuse answers to similar questions",
+        description="Answer questions very similar to earlier questions on the same documents with the earlier answer.",
+    )
+    model_provider: ModelProvider = Field(
+        ModelProvider.OPENAI,
+        title="Model provider",
+        type="string",
+        choices=[i.value for i in ModelProvider],
+        description="The provider of the language and embedding models. The fake provider answers offline with made up text after a simulated latency, for load tests.",
+    )
+    fake_latency_ms: confloat(ge=0.0) = Field(
+        500.0,
+        title="Fake model latency (ms)",
+        description="Median time before the fake language model sends its first token.",
+    )
+    fake_latency_distribution: LatencyDistribution = Field(
+        LatencyDistribution.lognormal,
+        title="Fake model latency distribution",
+        type="string",
+        choices=[i.value for i in LatencyDistribution],
+        description=f"The distribution of the fake model latencies. Choose from {', '.join([i.value for i in LatencyDistribution])}.",
+    )
+    fake_tokens_per_second: confloat(gt=0.0) = Field(
+        50.0,
+        title="Fake model tokens per second",
+        description="Rate at which the fake language model sends tokens after the first.",
+    )
+    fake_embedding_latency_ms: confloat(ge=0.0) = Field(
+        20.0,
+        title="Fake embedding latency (ms)",
+        description="Median time the fake embedding model takes per request.",
+    )
 
 
 class SubquestionAgent(BaseAgent):
     """An agent that queries a set of indexed documents by posing subquestions."""
 
-    _cache_path = Path(".cache", "subquestion")
-    _document_hash_file_name = "doc_hashes.json"
-
     def _setup(self):
+        llm = self._get_new_model(self.config)
+        if (
+            get_settings().llm_cache
+            and self.config.temperature == 0.0
+            and self.config.model_provider == ModelProvider.OPENAI
+        ):
+            llm = CachedLLM(llm, self._get_document_hashes())
         self._service_context = self._get_new_service_context(
-            self._get_new_model(
-                self.config.language_model_type, self.config.temperature
-            )
+            llm, self._get_new_embed_model(self.config)
         )
+        self._vector_indexes = {}
         self._engine = self._create_engine()
 
     async def _on_query(self, query: str) -> str:
@@ -68,6 +150,37 @@ class SubquestionAgent(BaseAgent):
             return response
         raise Exception(f"Unexpected response type: {type(response)}")
 
+    async def _on_query_stream(self, query: str) -> AsyncIterator[AgentEvent]:
+        async for event in self._engine.astream(query):
+            yield event
+
+    def _get_answer_cache_key(self) -> str | None:
+        if not self.config.use_answer_cache:
+            return None
+        doc_hashes = sorted(self._get_document_hashes())
+        model_config = self.config.dict(include=ANSWER_CACHE_CONFIG_FIELDS)
+        embeddings = IndexStore.get_embedding_fingerprint(self._service_context)
+        encoded = json.dumps(
+            {"documents": doc_hashes, "model": model_config, "embeddings": embeddings},
+            sort_keys=True,
+        ).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def _get_document_hashes(self) -> list[str]:
+        documents = getattr(self._agent_data.conversation, "documents", [])
+        return [document.hash or f"document:{document.id}" for document in documents]
+
+    async def _embed_query(self, query: str) -> list[float]:
+        return await asyncio.to_thread(
+            self._service_context.embed_model.get_query_embedding, query
+        )
+
+    def get_memory_footprint(self) -> int:
+        return sum(
+            IndexStore.get_memory_footprint(index)
+            for index in self._vector_indexes.values()
+        )
+
     def _on_save(self):
         pass
 
@@ -82,16 +195,35 @@ class SubquestionAgent(BaseAgent):
         return SubquestionConfig
 
     @staticmethod
-    def _get_new_model(model: str, temperature: float) -> LLM:
+    def _get_new_model(config: SubquestionConfig) -> LLM:
+        if config.model_provider == ModelProvider.FAKE:
+            return FakeLLM(
+                LatencyModel(
+                    config.fake_latency_ms / 1000, config.fake_latency_distribution
+                ),
+                config.fake_tokens_per_second,
+            )
         load_dotenv()
         openai.api_key = os.getenv("OPENAI_API_KEY")
-        return OpenAI(temperature=temperature, model=model)
+        return OpenAI(temperature=config.temperature, model=config.language_model_type)
 
     @staticmethod
-    def _get_new_service_context(llm: OpenAI) -> ServiceContext:
-        return ServiceContext.from_defaults(
-            llm=llm,
-        )
+    def _get_new_embed_model(config: SubquestionConfig) -> BaseEmbedding:
+        if config.model_provider == ModelProvider.FAKE:
+            return FakeEmbedding(
+                LatencyModel(
+                    config.fake_embedding_latency_ms / 1000,
+                    config.fake_latency_distribution,
+                ),
+                dim=get_settings().local_embedding_dim,
+            )
+        return create_embed_model()
+
+    @staticmethod
+    def _get_new_service_context(
+        llm: LLM, embed_model: BaseEmbedding
+    ) -> ServiceContext:
+        return ServiceContext.from_defaults(llm=llm, embed_model=embed_model)
 
     def _get_doc_paths(self) -> dict[int, Path]:
         """Return a list of paths to the documents in the conversation with ids as dictionary keys."""
@@ -104,39 +236,6 @@ class SubquestionAgent(BaseAgent):
                 doc_paths[document.id] = doc_path
         return doc_paths
 
-    def _get_hash_save_file(self) -> Path:
-        return Path(
-            self._cache_path,
-            "agent_" + str(self._agent_data.id),
-            self._document_hash_file_name,
-        )
-
-    def _save_file_hashes(self):
-        doc_hashes = {}
-        if hasattr(self._agent_data.conversation, "documents"):
-            for document in self._agent_data.conversation.documents:
-                doc_hashes[document.id] = document.hash
-        if not self._get_hash_save_file().parent.exists():
-            self._get_hash_save_file().parent.mkdir(parents=True)
-        with self._get_hash_save_file().open("w") as f:
-            json.dump(doc_hashes, f)
-
-    def _load_file_hashes(self) -> dict[int, str]:
-        file = self._get_hash_save_file()
-        if not file.exists():
-            return {}
-        with file.open("r") as f:
-            return json.load(f)
-
-    def _file_hash_matches(self, doc_id: int) -> bool:
-        doc_hashes = self._load_file_hashes()
-        if doc_id not in doc_hashes:
-            return False
-        document = get_document(self._db_session, doc_id)
-        if document.hash != doc_hashes[doc_id]:
-            return False
-        return True
-
     def _validate_pdf_path(self, doc_path: Path):
         if not doc_path.is_file():
             raise Exception(
@@ -146,100 +245,141 @@ class SubquestionAgent(BaseAgent):
             raise Exception(f"The file at '{doc_path}' is not a PDF.")
 
     def _create_engine(self):
-        docs_grouped = self._load_docs()
-        doc_vector_indexes = self._get_vector_indexes(docs_grouped)
-        self._save_file_hashes()
+        self._vector_indexes = self._get_vector_indexes(self._get_doc_paths())
 
-        return self._create_subquestion_engine(doc_vector_indexes)
+        return self._create_subquestion_engine(self._vector_indexes)
 
-    def _load_docs(self) -> dict[int, list[Document]]:
-        file_paths = self._get_doc_paths()
+    def _load_docs(
+        self, file_paths: dict[int, Path] | None = None
+    ) -> dict[int, list[Document]]:
+        if file_paths is None:
+            file_paths = self._get_doc_paths()
         if not file_paths:
             return {}
 
-        reader = SimpleDirectoryReader(input_files=file_paths.values())
-        pages = reader.load_data()
-        pages_grouped = self._group_pages_by_filename(pages)
-
-        return self._group_docs_by_id(file_paths, pages_grouped)
-
-    def _group_pages_by_filename(
-        self, pages: list[Document]
-    ) -> dict[str, list[Document]]:
-        pages_grouped = {}
-        for page in pages:
-            file_name = page.metadata.get("file_name", "NO_FILE_NAME")
-            pages_grouped.setdefault(file_name, []).append(page)
-        return pages_grouped
-
-    def _group_docs_by_id(
-        self, file_paths: dict[int, Path], pages_grouped: dict[str, list[Document]]
-    ) -> dict[int, list[Document]]:
-        docs_grouped = {}
-        for doc_id, doc_path in file_paths.items():
-            file_name = doc_path.name
-            if file_name in pages_grouped:
-                docs_grouped[doc_id] = pages_grouped[file_name]
-            else:
-                raise Exception(f"Pages not found for file {file_name}")
-        return docs_grouped
+        return PdfParser().parse(file_paths)
 
     def _get_vector_indexes(
-        self, doc_sets: dict[int, list[Document]]
+        self, file_paths: dict[int, Path]
     ) -> dict[int, VectorStoreIndex]:
+        """Load the indexes of the documents, parsing only those not yet indexed."""
+        keys = {
+            doc_id: self._get_index_key(
+                get_document(self._db_session, doc_id).hash, self._service_context
+            )
+            for doc_id in file_paths.keys()
+        }
+        missing_paths = {
+            doc_id: file_path
+            for doc_id, file_path in file_paths.items()
+            if keys[doc_id] is None or not IndexStore.exists(keys[doc_id])
+        }
+        doc_sets = self._load_docs(missing_paths) if missing_paths else {}
         indexes_info = {}
 
-        for doc_id in doc_sets.keys():
-            save_path = Path(self._cache_path, str(doc_id))
-
-            if self._cache_exists(save_path) and self._file_hash_matches(doc_id):
-                indexes_info[doc_id] = self._load_index(doc_id)
-            else:
+        for index_count, doc_id in enumerate(file_paths.keys(), start=1):
+            if keys[doc_id] is None:
                 indexes_info[doc_id] = self._create_index(doc_id, doc_sets[doc_id])
+            else:
+                indexes_info[doc_id] = IndexStore.get_or_create(
+                    keys[doc_id],
+                    self._service_context,
+                    lambda doc_id=doc_id: self._create_index(
+                        doc_id,
+                        doc_sets.get(doc_id)
+                        or self._load_docs({doc_id: file_paths[doc_id]})[doc_id],
+                    ),
+                )
+                IndexStore.add_reference(keys[doc_id], doc_id)
+            self._report_progress(index_count / len(file_paths))
         return indexes_info
 
+    def _configure_ann_index(self, index: VectorStoreIndex):
+        """Search large documents approximately with the probes of the config.
+
+        Indexes persisted before approximate search was available get their IVF
+        index built in memory.
+        """
+        vector_store = self._get_large_vector_store(index)
+        if vector_store is None:
+            return
+        if not vector_store.has_ann_index:
+            vector_store.build_ann_index(get_settings().ann_lists)
+        vector_store.ann_probes = self.config.ann_probes
+
     @staticmethod
-    def _cache_exists(directory: Path) -> bool:
-        if not directory.exists():
-            return False
-        if not Path(directory, "docstore.json").exists():
-            return False
-        if not Path(directory, "index_store.json").exists():
-            return False
-        if not Path(directory, "graph_store.json").exists():
-            return False
-        if not Path(directory, "vector_store.json").exists():
-            return False
-        return True
-
-    def _load_index(self, doc_id: int) -> VectorStoreIndex:
-        save_path = Path(self._cache_path, str(doc_id))
-        try:
-            print(
-                f"Loading vector index for document_id: {doc_id} from cache for {self.__class__.__name__}"
-            )
-            storage_context = StorageContext.from_defaults(
-                persist_dir=save_path,
-            )
-            return load_index_from_storage(storage_context)
-        except FileNotFoundError:
-            raise FileNotFoundError(
-                f"Vector index for document_id: {doc_id} not found in cache {save_path}"
-            )
+    def _get_large_vector_store(index: VectorStoreIndex) -> MemmapVectorStore | None:
+        """Return the vector store of an index if it is large enough for an IVF index."""
+        vector_store = index.storage_context.vector_store
+        if (
+            isinstance(vector_store, MemmapVectorStore)
+            and vector_store.size >= get_settings().ann_min_nodes
+        ):
+            return vector_store
+        return None
+
+    @staticmethod
+    def _get_index_key(doc_hash: str | None, service_context: ServiceContext):
+        """Return the index store key of a document, or None if it has no hash."""
+        if not doc_hash:
+            return None
+        return IndexStore.get_index_key(doc_hash, service_context)
+
+    @classmethod
+    def index_document(cls, db_session: Session, document_id: int):
+        document = get_document(db_session, document_id)
+        if document is None:
+            raise ValueError(f"No document found with ID {document_id} in database.")
+        if not document.hash:
+            return
+
+        config = SubquestionConfig(name=cls.__name__)
+        service_context = cls._get_new_service_context(
+            cls._get_new_model(config), cls._get_new_embed_model(config)
+        )
+        file_path = Path(document.file_path)
+        key = cls._get_index_key(document.hash, service_context)
+        IndexStore.get_or_create(
+            key,
+            service_context,
+            lambda: cls._build_index(
+                PdfParser().parse({document_id: file_path})[document_id],
+                service_context,
+            ),
+        )
+        IndexStore.add_reference(key, document_id)
+        # The document may have been deleted while it was indexed, after its
+        # references were released. Deletion commits before releasing references, so
+        # checking after adding the reference never leaks it.
+        db_session.commit()
+        if get_document(db_session, document_id) is None:
+            IndexStore.remove_references(document_id)
 
     def _create_index(self, doc_id: int, doc_set: list[Document]) -> VectorStoreIndex:
+        return self._build_index(doc_set, self._service_context)
+
+    @classmethod
+    def _build_index(
+        cls, doc_set: list[Document], service_context: ServiceContext
+    ) -> VectorStoreIndex:
+        """Embed a document, adding an IVF index if it has enough chunks."""
         index = VectorStoreIndex.from_documents(
-            doc_set, service_context=self._service_context
+            doc_set,
+            service_context=service_context,
+            storage_context=IndexStore.new_storage_context(),
         )
-        index.storage_context.persist(persist_dir=Path(self._cache_path, str(doc_id)))
+        vector_store = cls._get_large_vector_store(index)
+        if vector_store is not None:
+            vector_store.build_ann_index(get_settings().ann_lists)
         return index
 
     def _create_subquestion_engine(
         self, doc_indexes: dict[int, VectorStoreIndex]
-    ) -> SubQuestionQueryEngine:
+    ) -> BatchedSubQuestionQueryEngine:
         tools = []
         for doc_id in doc_indexes.keys():
             summary = get_document(self._db_session, doc_id).description
+            self._configure_ann_index(doc_indexes[doc_id])
             tools.append(
                 QueryEngineTool(
                     query_engine=doc_indexes[doc_id].as_query_engine(
@@ -248,7 +388,13 @@ class SubquestionAgent(BaseAgent):
                     metadata=ToolMetadata(name=str(doc_id), description=summary),
                 )
             )
-        return SubQuestionQueryEngine.from_defaults(
+        kwargs = {}
+        if self.config.model_provider == ModelProvider.FAKE:
+            kwargs["question_gen"] = FakeQuestionGenerator(self._service_context.llm)
+        return BatchedSubQuestionQueryEngine.from_defaults(
             query_engine_tools=tools,
             service_context=self._service_context,
+            max_concurrency=self.config.max_concurrent_sub_questions,
+            tool_timeout=self.config.sub_question_timeout,
+            **kwargs,
         )
@@ -1,13 +1,15 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from perry.api.endpoints.user import user_router
 from perry.api.endpoints.document import document_router, file_router
 from perry.api.endpoints.conversation import conversation_router
 from perry.api.endpoints.agent import agent_router
 from perry.agents.base import AgentRegistry
+from perry.agents.manager import AgentManager
 from perry.agents.echo import EchoAgent
 from perry.agents.subquestion import SubquestionAgent
-
-app = FastAPI()
+from perry.indexing.jobs import IndexingWorker
+from perry.indexing.parsing import PdfParser
 
 USERS_URL = "/users"
 DOCUMENTS_URL = "/documents/info"
@@ -23,6 +25,19 @@ def init_agent_registry():
 
 init_agent_registry()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    AgentManager().start()
+    IndexingWorker().start()
+    yield
+    IndexingWorker().stop()
+    PdfParser.shutdown()
+    await AgentManager().stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
 app.include_router(user_router, prefix=USERS_URL)
 app.include_router(file_router, prefix=FILES_URL)
 app.include_router(conversation_router, prefix=CONVERSATION_URL)
@@ -1,7 +1,7 @@
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from typing import Annotated
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from perry.api.schemas import APIUser
@@ -52,7 +52,7 @@ def decode_access_token(token: Annotated[str, Depends(oauth2_scheme)]) -> dict:
 
 
 async def get_db_user_from_token(
-    token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(get_db)
+    token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSession = Depends(get_db)
 ) -> DBUser:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -63,7 +63,7 @@ async def get_db_user_from_token(
     username: str = payload.get("username")
     if username is None:
         raise credentials_exception
-    db_user = get_user_by_username(db, username)
+    db_user = await db.run_sync(get_user_by_username, username)
     if db_user is None:
         raise credentials_exception
     return db_user
@@ -1,9 +1,11 @@
+from typing import AsyncIterator
+from sqlalchemy.ext.asyncio import AsyncSession
 from perry.db.session import DatabaseSessionManager
 
 
-def get_db():
-    db = DatabaseSessionManager.get_db_session()
+async def get_db() -> AsyncIterator[AsyncSession]:
+    db = DatabaseSessionManager.get_async_db_session()
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
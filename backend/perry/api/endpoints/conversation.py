@@ -1,6 +1,10 @@
+import json
 from typing import Annotated
 from datetime import datetime
-from fastapi import APIRouter, Depends, status, HTTPException
+from fastapi import APIRouter, Depends, status, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from perry.api.authentication import get_current_user_id
 from perry.api.schemas import APIDocument
@@ -12,16 +16,24 @@ from perry.db.operations.conversations import (
     create_conversation,
     delete_conversation,
     read_conversation,
+    read_user_conversations,
     update_conversation,
     add_messages_to_conversation,
     Conversation as DBConversation,
 )
-from perry.db.operations.messages import create_message, delete_message
+from perry.db.operations.messages import (
+    create_message,
+    delete_message,
+    read_conversation_messages,
+)
+from perry.db.operations.jobs import create_job, get_conversation_job
+from perry.db.models import JobStatusEnum
 from perry.db.operations.agents import update_agent, create_agent
-from perry.db.operations.users import get_user
+from perry.db.session import DatabaseSessionManager
 from perry.agents.manager import AgentManager
-from perry.agents.base import AgentRegistry
+from perry.agents.base import AgentEventType, AgentRegistry, BaseAgent
 from perry.api.dependencies import get_db
+from perry.indexing.jobs import IndexingWorker
 
 
 conversation_router = APIRouter()
@@ -31,6 +43,7 @@ from pydantic import BaseModel
 
 
 class ConversationMessage(BaseModel):
+    id: int
     role: str
     message: str
     timestamp: datetime
@@ -47,6 +60,12 @@ class ConversationQuery(BaseModel):
     query: str
 
 
+class ConversationStatus(BaseModel):
+    status: JobStatusEnum
+    progress: float
+    error: str | None = None
+
+
 class ConversationInfo(BaseModel):
     id: int
     name: str
@@ -58,6 +77,7 @@ class ConversationInfo(BaseModel):
 
 
 def check_owned_conversation(db, conversation_id, user_id) -> DBConversation:
+    """Return the conversation if the user owns it, for handlers to reuse."""
     conversation = read_conversation(db, conversation_id)
     if conversation is None:
         raise HTTPException(
@@ -69,6 +89,22 @@ def check_owned_conversation(db, conversation_id, user_id) -> DBConversation:
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Conversation not authorized.",
         )
+    return conversation
+
+
+def check_conversation_indexed(db, conversation_id):
+    job = get_conversation_job(db, conversation_id)
+    if job is None or job.status == JobStatusEnum.completed:
+        return
+    if job.status == JobStatusEnum.failed:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Conversation indexing failed.",
+        )
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="Conversation is still indexing.",
+    )
 
 
 def conversation_db_to_info(db_conversation: DBConversation) -> ConversationInfo:
@@ -88,18 +124,20 @@ def conversation_db_to_info(db_conversation: DBConversation) -> ConversationInfo
 )
 async def get_user_conversations(
     db_user_id: Annotated[int, Depends(get_current_user_id)],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    conversations = get_user(db, db_user_id).conversations
-    return [conversation_db_to_info(conv) for conv in conversations]
+    return await db.run_sync(
+        lambda session: [
+            conversation_db_to_info(conv)
+            for conv in read_user_conversations(session, db_user_id)
+        ]
+    )
 
 
-@conversation_router.post("/", status_code=status.HTTP_201_CREATED)
-async def conversation_agent_setup(
-    conversation_config: ConversationConfig,
-    db_user_id: Annotated[int, Depends(get_current_user_id)],
-    db: Session = Depends(get_db),
-):
+def create_conversation_with_agent(
+    db: Session, conversation_config: ConversationConfig, db_user_id: int
+) -> tuple[int, int]:
+    """Create a conversation with its agent, returning its id and indexing job id."""
     docs = get_user_documents(db, db_user_id)
     user_document_ids = [doc.id for doc in docs]
     if not set(conversation_config.doc_ids).issubset(set(user_document_ids)):
@@ -137,15 +175,34 @@ async def conversation_agent_setup(
         )
 
     try:
-        agent = agent_class(
-            db, conversation_config.agent_settings, agent_id=new_agent_id
+        agent_config = agent_class._get_config_instance(
+            conversation_config.agent_settings
+        )
+        update_agent(
+            db,
+            new_agent_id,
+            config_data=agent_config.dict(),
+            agent_type=conversation_config.agent_type,
         )
-        agent.save()
     except Exception:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Agent could not be created.",
         )
+
+    return conversation_id, create_job(db, conversation_id)
+
+
+@conversation_router.post("/", status_code=status.HTTP_201_CREATED)
+async def conversation_agent_setup(
+    conversation_config: ConversationConfig,
+    db_user_id: Annotated[int, Depends(get_current_user_id)],
+    db: AsyncSession = Depends(get_db),
+):
+    conversation_id, job_id = await db.run_sync(
+        create_conversation_with_agent, conversation_config, db_user_id
+    )
+    IndexingWorker().submit(job_id)
     return conversation_id
 
 
@@ -153,36 +210,82 @@ async def conversation_agent_setup(
 async def get_conversation_info(
     conversation_id: int,
     db_user_id: Annotated[int, Depends(get_current_user_id)],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    check_owned_conversation(db, conversation_id, db_user_id)
-    conversation = read_conversation(db, conversation_id)
-    if conversation is None:
+    return await db.run_sync(
+        lambda session: conversation_db_to_info(
+            check_owned_conversation(session, conversation_id, db_user_id)
+        )
+    )
+
+
+@conversation_router.get(
+    "/{conversation_id}/status",
+    status_code=status.HTTP_200_OK,
+    response_model=ConversationStatus,
+)
+async def get_conversation_status(
+    conversation_id: int,
+    db_user_id: Annotated[int, Depends(get_current_user_id)],
+    db: AsyncSession = Depends(get_db),
+):
+    await db.run_sync(check_owned_conversation, conversation_id, db_user_id)
+    job = await db.run_sync(get_conversation_job, conversation_id)
+    if job is None:
+        # Conversations created before indexing jobs existed build their agent on use.
+        return ConversationStatus(status=JobStatusEnum.completed, progress=1.0)
+    return ConversationStatus(status=job.status, progress=job.progress, error=job.error)
+
+
+@conversation_router.post(
+    "/{conversation_id}/status",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=ConversationStatus,
+)
+async def retry_conversation_indexing(
+    conversation_id: int,
+    db_user_id: Annotated[int, Depends(get_current_user_id)],
+    db: AsyncSession = Depends(get_db),
+):
+    """Requeue the indexing of a conversation whose indexing failed."""
+    await db.run_sync(check_owned_conversation, conversation_id, db_user_id)
+    job = await db.run_sync(get_conversation_job, conversation_id)
+    if job is None or job.status != JobStatusEnum.failed:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Conversation not found.",
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Conversation indexing has not failed.",
         )
-    return conversation_db_to_info(conversation)
+    job_id = await db.run_sync(create_job, conversation_id)
+    IndexingWorker().submit(job_id)
+    return ConversationStatus(status=JobStatusEnum.queued, progress=0.0)
 
 
 @conversation_router.get("/{conversation_id}/messages", status_code=status.HTTP_200_OK)
 async def get_conversation_message_history(
     conversation_id: int,
     db_user_id: Annotated[int, Depends(get_current_user_id)],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
+    before_id: int | None = None,
+    after_id: int | None = None,
+    limit: Annotated[int | None, Query(ge=1, le=1000)] = None,
 ):
-    check_owned_conversation(db, conversation_id, db_user_id)
-    conversation = read_conversation(db, conversation_id)
-    if conversation is None:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Conversation not found.",
-        )
+    """Return the messages of a conversation in order, or a page of them.
+
+    Pages are keyed by message id: after_id reads the messages after a known one,
+    and before_id pages back from the latest messages towards the first.
+    """
+    await db.run_sync(check_owned_conversation, conversation_id, db_user_id)
+    messages = await db.run_sync(
+        read_conversation_messages, conversation_id, before_id, after_id, limit
+    )
     return [
         ConversationMessage(
-            role=message.role, message=message.message, timestamp=message.timestamp
+            id=message.id,
+            role=message.role,
+            message=message.message,
+            timestamp=message.timestamp,
         )
-        for message in conversation.messages
+        for message in messages
     ]
 
 
@@ -190,45 +293,45 @@ async def get_conversation_message_history(
 async def remove_conversation_history(
     conversation_id: int,
     db_user_id: Annotated[int, Depends(get_current_user_id)],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    check_owned_conversation(db, conversation_id, db_user_id)
-    delete_conversation(db, conversation_id)
-
+    await db.run_sync(check_owned_conversation, conversation_id, db_user_id)
+    await db.run_sync(delete_conversation, conversation_id)
 
-@conversation_router.post("/{conversation_id}", status_code=status.HTTP_200_OK)
-async def query_conversation_agent(
-    conversation_query: ConversationQuery,
-    conversation_id: int,
-    db_user_id: Annotated[int, Depends(get_current_user_id)],
-    db: Session = Depends(get_db),
-):
-    agent_manager = AgentManager()
-    check_owned_conversation(db, conversation_id, db_user_id)
 
+async def load_conversation_agent(
+    db: AsyncSession, conversation: DBConversation
+) -> BaseAgent:
     agent_not_found_exception = HTTPException(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         detail="Could not load agent.",
     )
     try:
-        conversation = read_conversation(db, conversation_id)
-        agent = agent_manager.load_agent(db, conversation.agent.id)
+        agent_id = await db.run_sync(lambda session: conversation.agent.id)
+        agent = await run_in_threadpool(load_agent, agent_id)
         if not agent:
             raise agent_not_found_exception
     except Exception:
         raise agent_not_found_exception
+    return agent
 
-    query_failed_exception = HTTPException(
-        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-        detail="Query failed.",
-    )
 
+def load_agent(agent_id: int) -> BaseAgent:
+    """Load an agent in a thread, which cannot use the async session of a request.
+
+    The agent is returned pinned, and must be unpinned once the query is done.
+    """
+    db = DatabaseSessionManager.get_session_local()()
     try:
-        answer = await agent.query(conversation_query.query)
-    except Exception:
-        raise query_failed_exception
+        return AgentManager().load_agent(db, agent_id)
+    finally:
+        db.close()
+
 
-    user_message_id = create_message(db, db_user_id, "user", conversation_query.query)
+def save_conversation_messages(
+    db: Session, db_user_id: int, conversation_id: int, query: str, answer: str
+):
+    user_message_id = create_message(db, db_user_id, "user", query)
     agent_message_id = create_message(db, db_user_id, "assistant", answer)
     if not add_messages_to_conversation(
         db, conversation_id, [user_message_id, agent_message_id]
@@ -239,4 +342,89 @@ async def query_conversation_agent(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Could not add messages to conversation.",
         )
+
+
+def format_server_sent_event(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@conversation_router.post("/{conversation_id}", status_code=status.HTTP_200_OK)
+async def query_conversation_agent(
+    conversation_query: ConversationQuery,
+    conversation_id: int,
+    db_user_id: Annotated[int, Depends(get_current_user_id)],
+    db: AsyncSession = Depends(get_db),
+):
+    conversation = await db.run_sync(
+        check_owned_conversation, conversation_id, db_user_id
+    )
+    await db.run_sync(check_conversation_indexed, conversation_id)
+    agent = await load_conversation_agent(db, conversation)
+
+    query_failed_exception = HTTPException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        detail="Query failed.",
+    )
+
+    try:
+        answer = await agent.query(conversation_query.query)
+    except Exception:
+        raise query_failed_exception
+    finally:
+        agent.unpin()
+
+    await db.run_sync(
+        save_conversation_messages,
+        db_user_id,
+        conversation_id,
+        conversation_query.query,
+        answer,
+    )
     return answer
+
+
+@conversation_router.post("/{conversation_id}/stream", status_code=status.HTTP_200_OK)
+async def stream_conversation_agent(
+    conversation_query: ConversationQuery,
+    conversation_id: int,
+    db_user_id: Annotated[int, Depends(get_current_user_id)],
+    db: AsyncSession = Depends(get_db),
+):
+    """Query the agent and stream its answer as Server-Sent Events.
+
+    Progress and token events carry JSON encoded text. The messages are saved once
+    the answer is complete, after which a done event is sent. A failure ends the
+    stream with an error event instead, and nothing is saved.
+    """
+    conversation = await db.run_sync(
+        check_owned_conversation, conversation_id, db_user_id
+    )
+    await db.run_sync(check_conversation_indexed, conversation_id)
+    agent = await load_conversation_agent(db, conversation)
+
+    async def stream_events():
+        tokens = []
+        try:
+            async for event in agent.query_stream(conversation_query.query):
+                if event.type == AgentEventType.token:
+                    tokens.append(event.content)
+                yield format_server_sent_event(event.type.value, event.content)
+        except Exception:
+            yield format_server_sent_event("error", "Query failed.")
+            return
+        finally:
+            agent.unpin()
+        try:
+            await db.run_sync(
+                save_conversation_messages,
+                db_user_id,
+                conversation_id,
+                conversation_query.query,
+                "".join(tokens),
+            )
+        except HTTPException as exception:
+            yield format_server_sent_event("error", exception.detail)
+            return
+        yield format_server_sent_event("done", "".join(tokens))
+
+    return StreamingResponse(stream_events(), media_type="text/event-stream")
@@ -1,19 +1,29 @@
+import os
 from typing import Annotated
 from fastapi import APIRouter, Depends, status, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from perry.api.authentication import get_current_user_id
 from perry.api.schemas import APIDocument
 from perry.db.operations.documents import (
-    save_file,
-    remove_file,
-    load_file,
-    get_document,
+    stage_file,
+    add_file_document,
+    remove_stored_files,
+    load_bytes_from_file,
+    delete_document,
+    get_document_with_ownership,
     update_document,
-    document_owned_by_user,
+    document_hash_in_use,
     get_user_documents,
+    Document as DBDocument,
 )
 from perry.db.operations.users import get_user, User as DBUser
 from perry.api.dependencies import get_db
+from perry.db.operations.jobs import create_job
+from perry.indexing.jobs import IndexingWorker
+from perry.agents.llm_cache import LLMResponseCache
+from perry.indexing.store import IndexStore
 
 
 file_router = APIRouter()
@@ -46,6 +56,51 @@ def check_max_documents(user: DBUser):
         )
 
 
+def check_owned_document(
+    db: Session, document_id: int, user_id: int, action: str
+) -> DBDocument:
+    """Return the document if the user owns it, reading it and its ownership at once."""
+    document, owned = get_document_with_ownership(db, document_id, user_id)
+    if document is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document not found",
+        )
+    if not owned:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Not authorized to {action} document",
+        )
+    return document
+
+
+async def save_uploaded_file(db: AsyncSession, file: UploadFile) -> int:
+    """Save the uploaded PDF and add its document, returning the document id.
+
+    Writing and hashing the file run in the threadpool, only adding the document runs
+    on the session.
+    """
+    staged_path, file_hash = await run_in_threadpool(stage_file, file.file, "pdf")
+    file_path = None
+    try:
+        doc_id, file_path = await db.run_sync(
+            add_file_document, staged_path, file_hash, "pdf"
+        )
+        await run_in_threadpool(os.replace, staged_path, file_path)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        await run_in_threadpool(remove_stored_files, staged_path, file_path)
+        raise
+    return doc_id
+
+
+async def remove_document_and_file(db: AsyncSession, document_id: int):
+    """Delete the document, then remove its file in the threadpool."""
+    file_path = await db.run_sync(delete_document, document_id)
+    await run_in_threadpool(remove_stored_files, file_path)
+
+
 def api_doc_from_db_doc(db_doc):
     return APIDocument(title=db_doc.title, id=db_doc.id, description=db_doc.description)
 
@@ -54,27 +109,32 @@ def api_doc_from_db_doc(db_doc):
 async def upload_file(
     file: UploadFile,
     db_user_id: Annotated[int, Depends(get_current_user_id)],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     check_file_type(file.content_type)
     check_file_size(file.size)
-    check_max_documents(get_user(db, db_user_id))
+    await db.run_sync(
+        lambda session: check_max_documents(get_user(session, db_user_id))
+    )
 
     try:
-        doc_id = save_file(db, file.file, "pdf")
+        doc_id = await save_uploaded_file(db, file)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Could not save file",
         )
     try:
-        update_document(db, doc_id, title=file.filename, user_ids=[db_user_id])
+        await db.run_sync(
+            update_document, doc_id, title=file.filename, user_ids=[db_user_id]
+        )
     except Exception as e:
-        remove_file(db, doc_id)
+        await remove_document_and_file(db, doc_id)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Could not update document",
         )
+    IndexingWorker().submit(await db.run_sync(create_job, document_id=doc_id))
     return {"id": doc_id}
 
 
@@ -82,41 +142,33 @@ async def upload_file(
 async def delete_file(
     document_id: int,
     db_user_id: Annotated[int, Depends(get_current_user_id)],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    if not document_owned_by_user(db, document_id, db_user_id):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to delete document",
-        )
+    document = await db.run_sync(
+        check_owned_document, document_id, db_user_id, "delete"
+    )
+    doc_hash = document.hash
     try:
-        remove_file(db, document_id)
+        await remove_document_and_file(db, document_id)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Could not delete file",
         )
+    await run_in_threadpool(IndexStore.remove_references, document_id)
+    if doc_hash and not await db.run_sync(document_hash_in_use, doc_hash):
+        await run_in_threadpool(LLMResponseCache.invalidate, doc_hash)
 
 
 @file_router.get("/{document_id}", response_model=UploadFile)
 async def retrieve_file_binary(
     document_id: int,
     db_user_id: Annotated[int, Depends(get_current_user_id)],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    db_doc = get_document(db, document_id)
-    if not db_doc:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Document not found",
-        )
-    if not document_owned_by_user(db, document_id, db_user_id):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to get document",
-        )
+    db_doc = await db.run_sync(check_owned_document, document_id, db_user_id, "get")
     try:
-        file_bytes = load_file(db, document_id)
+        file_bytes = await run_in_threadpool(load_bytes_from_file, db_doc.file_path)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -128,9 +180,9 @@ async def retrieve_file_binary(
 @document_router.get("/", response_model=list[APIDocument])
 async def get_all_docs(
     db_user_id: Annotated[int, Depends(get_current_user_id)],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    db_documents = get_user_documents(db, db_user_id)
+    db_documents = await db.run_sync(get_user_documents, db_user_id)
     docs = []
     for doc in db_documents:
         docs.append(
@@ -143,19 +195,9 @@ async def get_all_docs(
 async def get_doc_by_id(
     document_id: int,
     db_user_id: Annotated[int, Depends(get_current_user_id)],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    doc = get_document(db, document_id)
-    if not doc:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Document not found",
-        )
-    if not document_owned_by_user(db, document_id, db_user_id):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to get document",
-        )
+    doc = await db.run_sync(check_owned_document, document_id, db_user_id, "get")
     return api_doc_from_db_doc(doc)
 
 
@@ -164,15 +206,11 @@ async def update_doc_description(
     document_id: int,
     info: APIDocument,
     db_user_id: Annotated[int, Depends(get_current_user_id)],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    if not document_owned_by_user(db, document_id, db_user_id):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to update document",
-        )
+    await db.run_sync(check_owned_document, document_id, db_user_id, "update")
     try:
-        update_document(db, document_id, description=info.description)
+        await db.run_sync(update_document, document_id, description=info.description)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1,14 +1,14 @@
 from typing import Annotated
 from datetime import timedelta
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, APIRouter, Depends, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from perry.db.operations.users import (
-    get_user,
     create_user,
     get_user_by_username,
-    authenticate_user,
 )
+from perry.db.models import hash_password
 from perry.api.dependencies import get_db
 from perry.api.schemas import APIUser, UserRegister, Token
 from perry.api.authentication import create_access_token, get_current_user
@@ -18,27 +18,29 @@ user_router = APIRouter()
 
 
 @user_router.post("/register")
-async def register(user: UserRegister, db: Session = Depends(get_db)):
-    db_user = get_user_by_username(db, user.username)
+async def register(user: UserRegister, db: AsyncSession = Depends(get_db)):
+    db_user = await db.run_sync(get_user_by_username, user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    create_user(db, user.username, user.password)
+    password_hash = await run_in_threadpool(hash_password, user.password)
+    await db.run_sync(create_user, user.username, password_hash=password_hash)
     return {"username": user.username}
 
 
 @user_router.post("/token", response_model=Token)
 async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    user_id = authenticate_user(db, form_data.username, form_data.password)
-    if not user_id:
+    user = await db.run_sync(get_user_by_username, form_data.username)
+    if not user or not await run_in_threadpool(
+        user.verify_password, form_data.password
+    ):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    user = get_user(db, user_id)
     access_token_expires = timedelta(days=7)
     access_token = create_access_token(
         data=user.to_jwt_payload(), expires_delta=access_token_expires
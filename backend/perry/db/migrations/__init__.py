@@ -0,0 +1,24 @@
+from pathlib import Path
+from alembic import command
+from alembic.config import Config
+from sqlalchemy.engine import Connection, Engine
+
+MIGRATIONS_PATH = Path(__file__).parent
+
+
+def get_alembic_config(connection: Connection = None) -> Config:
+    """Return the Alembic configuration of the migrations, run on the connection."""
+    config = Config()
+    config.set_main_option("script_location", str(MIGRATIONS_PATH))
+    config.attributes["connection"] = connection
+    return config
+
+
+def upgrade_database(engine: Engine, revision: str = "head"):
+    """Migrate the database of the engine to the revision.
+
+    The first revision only creates the tables and indexes that are missing, so a
+    database created before migrations existed is upgraded in place.
+    """
+    with engine.begin() as connection:
+        command.upgrade(get_alembic_config(connection), revision)
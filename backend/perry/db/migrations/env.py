@@ -0,0 +1,27 @@
+from alembic import context
+from perry.db.models import Base
+
+
+def run_migrations(connection):
+    # SQLite alters most of a table by copying it, which batch operations do.
+    context.configure(
+        connection=connection,
+        target_metadata=Base.metadata,
+        render_as_batch=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+connection = context.config.attributes.get("connection")
+if connection is not None:
+    run_migrations(connection)
+else:
+    from perry.db.session import DatabaseSessionManager
+
+    engine = DatabaseSessionManager._create_engine(
+        f"sqlite:///{DatabaseSessionManager._get_db_path()}"
+    )
+    with engine.connect() as connection:
+        run_migrations(connection)
+    engine.dispose()
@@ -0,0 +1,147 @@
+"""Initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2023-10-18 12:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created before migrations already hold some or all of these.
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("username", sa.String(), nullable=True),
+        sa.Column("_email", sa.String(), nullable=True),
+        sa.Column("password", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        if_not_exists=True,
+    )
+    op.create_index("ix_users_id", "users", ["id"], if_not_exists=True)
+    op.create_index(
+        "ix_users_username", "users", ["username"], unique=True, if_not_exists=True
+    )
+    op.create_index(
+        "ix_users__email", "users", ["_email"], unique=True, if_not_exists=True
+    )
+    op.create_table(
+        "documents",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("hash", sa.String(), nullable=True),
+        sa.Column("file_path", sa.String(), nullable=True),
+        sa.Column("title", sa.String(), nullable=True),
+        sa.Column("description", sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        if_not_exists=True,
+    )
+    op.create_index("ix_documents_id", "documents", ["id"], if_not_exists=True)
+    op.create_table(
+        "user_document_association",
+        sa.Column("user_id", sa.Integer(), nullable=True),
+        sa.Column("document_id", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(["document_id"], ["documents.id"]),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        if_not_exists=True,
+    )
+    op.create_table(
+        "conversations",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("start_time", sa.DateTime(), nullable=True),
+        sa.Column("name", sa.String(), nullable=True),
+        sa.Column("user_id", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        if_not_exists=True,
+    )
+    op.create_index("ix_conversations_id", "conversations", ["id"], if_not_exists=True)
+    op.create_table(
+        "conversation_document_association",
+        sa.Column("conversation_id", sa.Integer(), nullable=True),
+        sa.Column("document_id", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(["conversation_id"], ["conversations.id"]),
+        sa.ForeignKeyConstraint(["document_id"], ["documents.id"]),
+        if_not_exists=True,
+    )
+    op.create_table(
+        "messages",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=True),
+        sa.Column(
+            "role",
+            sa.Enum("user", "assistant", name="MessageRoleEnum"),
+            nullable=True,
+        ),
+        sa.Column("message", sa.String(), nullable=True),
+        sa.Column("timestamp", sa.DateTime(), nullable=True),
+        sa.Column("conversation_id", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(["conversation_id"], ["conversations.id"]),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        if_not_exists=True,
+    )
+    op.create_index("ix_messages_id", "messages", ["id"], if_not_exists=True)
+    op.create_table(
+        "agents",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("type", sa.String(), nullable=True),
+        sa.Column("conversation_id", sa.Integer(), nullable=True),
+        sa.Column("config", sa.JSON(), nullable=True),
+        sa.ForeignKeyConstraint(["conversation_id"], ["conversations.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("conversation_id"),
+        if_not_exists=True,
+    )
+    op.create_index("ix_agents_id", "agents", ["id"], if_not_exists=True)
+    op.create_table(
+        "indexing_jobs",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column(
+            "status",
+            sa.Enum("queued", "running", "completed", "failed", name="JobStatusEnum"),
+            nullable=True,
+        ),
+        sa.Column("progress", sa.Float(), nullable=True),
+        sa.Column("error", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.Column("conversation_id", sa.Integer(), nullable=True),
+        sa.Column("document_id", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(["conversation_id"], ["conversations.id"]),
+        sa.ForeignKeyConstraint(["document_id"], ["documents.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        if_not_exists=True,
+    )
+    op.create_index("ix_indexing_jobs_id", "indexing_jobs", ["id"], if_not_exists=True)
+    op.create_index(
+        "ix_indexing_jobs_conversation_id",
+        "indexing_jobs",
+        ["conversation_id"],
+        if_not_exists=True,
+    )
+    op.create_index(
+        "ix_indexing_jobs_document_id",
+        "indexing_jobs",
+        ["document_id"],
+        if_not_exists=True,
+    )
+
+
+def downgrade():
+    op.drop_table("indexing_jobs")
+    op.drop_table("agents")
+    op.drop_table("messages")
+    op.drop_table("conversation_document_association")
+    op.drop_table("conversations")
+    op.drop_table("user_document_association")
+    op.drop_table("documents")
+    op.drop_table("users")
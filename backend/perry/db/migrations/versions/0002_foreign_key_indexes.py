@@ -0,0 +1,54 @@
+"""Index foreign keys and make document associations unique
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2023-10-18 12:30:00.000000
+"""
+from alembic import op
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+ASSOCIATIONS = {
+    "user_document_association": "user_id",
+    "conversation_document_association": "conversation_id",
+}
+
+
+def upgrade():
+    for table, owner_column in ASSOCIATIONS.items():
+        # Associations were never unique, so duplicates must go before the index.
+        op.execute(
+            f"DELETE FROM {table} WHERE rowid NOT IN "
+            f"(SELECT min(rowid) FROM {table} GROUP BY {owner_column}, document_id)"
+        )
+        op.create_index(
+            f"ix_{table}_{owner_column}_document_id",
+            table,
+            [owner_column, "document_id"],
+            unique=True,
+        )
+        op.create_index(f"ix_{table}_document_id", table, ["document_id"])
+    op.create_index("ix_conversations_user_id", "conversations", ["user_id"])
+    op.create_index("ix_messages_user_id", "messages", ["user_id"])
+    # Databases created after message paging was added already have this index.
+    op.create_index(
+        "ix_messages_conversation_id_id",
+        "messages",
+        ["conversation_id", "id"],
+        if_not_exists=True,
+    )
+    op.create_index("ix_documents_hash", "documents", ["hash"])
+
+
+def downgrade():
+    op.drop_index("ix_documents_hash", "documents")
+    op.drop_index("ix_messages_conversation_id_id", "messages")
+    op.drop_index("ix_messages_user_id", "messages")
+    op.drop_index("ix_conversations_user_id", "conversations")
+    for table, owner_column in ASSOCIATIONS.items():
+        op.drop_index(f"ix_{table}_document_id", table)
+        op.drop_index(f"ix_{table}_{owner_column}_document_id", table)
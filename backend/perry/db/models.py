@@ -6,8 +6,10 @@ from sqlalchemy import (
     Column,
     String,
     Integer,
+    Float,
     ForeignKey,
     DateTime,
+    Index,
     JSON,
     Enum as ENUM,
 )
@@ -20,6 +22,10 @@ Base = declarative_base()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
 def to_db_enum(enum_class) -> ENUM:
     return ENUM(enum_class, name=enum_class.__name__)
 
@@ -29,11 +35,25 @@ class MessageRoleEnum(str, Enum):
     assistant = "assistant"
 
 
+class JobStatusEnum(str, Enum):
+    queued = "queued"
+    running = "running"
+    completed = "completed"
+    failed = "failed"
+
+
 user_document_relation = Table(
     "user_document_association",
     Base.metadata,
     Column("user_id", Integer, ForeignKey("users.id")),
     Column("document_id", Integer, ForeignKey("documents.id")),
+    Index(
+        "ix_user_document_association_user_id_document_id",
+        "user_id",
+        "document_id",
+        unique=True,
+    ),
+    Index("ix_user_document_association_document_id", "document_id"),
 )
 
 conversation_document_relation = Table(
@@ -41,6 +61,13 @@ conversation_document_relation = Table(
     Base.metadata,
     Column("conversation_id", Integer, ForeignKey("conversations.id")),
     Column("document_id", Integer, ForeignKey("documents.id")),
+    Index(
+        "ix_conversation_document_association_conversation_id_document_id",
+        "conversation_id",
+        "document_id",
+        unique=True,
+    ),
+    Index("ix_conversation_document_association_document_id", "document_id"),
 )
 
 
@@ -59,7 +86,10 @@ class User(Base):
     conversations = relationship("Conversation", back_populates="user")
 
     def set_password(self, password: str):
-        self._password = pwd_context.hash(password)
+        self.set_password_hash(hash_password(password))
+
+    def set_password_hash(self, password_hash: str):
+        self._password = password_hash
 
     def verify_password(self, password: str):
         return pwd_context.verify(password, self._password)
@@ -79,19 +109,21 @@ class Message(Base):
     __tablename__ = "messages"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     role = Column(to_db_enum(MessageRoleEnum))
     message = Column(String)
     timestamp = Column(DateTime, default=datetime.now)
     conversation_id = Column(Integer, ForeignKey("conversations.id"))
     conversation = relationship("Conversation", back_populates="messages")
 
+    __table_args__ = (Index("ix_messages_conversation_id_id", "conversation_id", "id"),)
+
 
 class Document(Base):
     __tablename__ = "documents"
 
     id = Column(Integer, primary_key=True, index=True)
-    hash = Column(String)
+    hash = Column(String, index=True)
     users = relationship(
         "User", secondary=user_document_relation, back_populates="documents"
     )
@@ -103,6 +135,9 @@ class Document(Base):
         secondary=conversation_document_relation,
         back_populates="documents",
     )
+    jobs = relationship(
+        "IndexingJob", back_populates="document", cascade="all, delete-orphan"
+    )
 
 
 class Conversation(Base):
@@ -112,10 +147,13 @@ class Conversation(Base):
     start_time = Column(DateTime, default=datetime.now)
     name = Column(String, default="")
 
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     user = relationship("User", back_populates="conversations")
 
     agent = relationship("Agent", uselist=False, back_populates="conversation")
+    jobs = relationship(
+        "IndexingJob", back_populates="conversation", cascade="all, delete-orphan"
+    )
 
     messages = relationship("Message", back_populates="conversation")
     documents = relationship(
@@ -134,3 +172,22 @@ class Agent(Base):
 
     conversation = relationship("Conversation", back_populates="agent")
     config = Column(JSON)
+
+
+class IndexingJob(Base):
+    __tablename__ = "indexing_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(to_db_enum(JobStatusEnum), default=JobStatusEnum.queued)
+    progress = Column(Float, default=0.0)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    conversation_id = Column(
+        Integer, ForeignKey("conversations.id"), nullable=True, index=True
+    )
+    conversation = relationship("Conversation", back_populates="jobs")
+
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=True, index=True)
+    document = relationship("Document", back_populates="jobs")
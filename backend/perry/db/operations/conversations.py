@@ -1,4 +1,4 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload, selectinload
 from perry.db.models import Conversation
 from perry.db.operations.messages import read_message
 
@@ -14,6 +14,21 @@ def read_conversation(session: Session, conversation_id):
     return session.query(Conversation).filter_by(id=conversation_id).first()
 
 
+def read_user_conversations(session: Session, user_id) -> list[Conversation]:
+    """Read the conversations of a user with their agents and documents.
+
+    Agents are joined and the documents of all conversations loaded in one more
+    query, rather than loading both lazily per conversation.
+    """
+    return (
+        session.query(Conversation)
+        .options(joinedload(Conversation.agent), selectinload(Conversation.documents))
+        .filter_by(user_id=user_id)
+        .order_by(Conversation.id)
+        .all()
+    )
+
+
 def update_conversation(session: Session, conversation_id, user_id=None, name=None):
     conversation = read_conversation(session, conversation_id)
     if not conversation:
@@ -1,35 +1,69 @@
+import hashlib
 import pathlib
 import io
 import os
+import tempfile
+import uuid
+from sqlalchemy import exists
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
-from perry.db.models import Document
+from perry.db.models import Document, user_document_relation
 from perry.db.operations.conversations import read_conversation
 from perry.db.operations.users import get_user
 
+FILE_CHUNK_SIZE = 1024 * 1024
+
 
 def save_file(db_session: Session, bytes_obj: io.BytesIO, suffix: str) -> int:
     """Convert bytes object to a saved file on the filesystem and create an entry in the document database."""
-    new_doc = Document()
-    db_session.add(new_doc)
-    db_session.flush()  # Generates the ID without committing the transaction
-
-    file_path = pathlib.Path(get_file_storage_path(), f"{new_doc.id}.{suffix}")
+    staged_path, file_hash = stage_file(bytes_obj, suffix)
+    file_path = None
     try:
-        new_doc.file_path = str(file_path)
-        new_doc.hash = _get_file_hash(bytes_obj)
-        save_bytes_to_file(bytes_obj, file_path)
-
+        document_id, file_path = add_file_document(
+            db_session, staged_path, file_hash, suffix
+        )
+        os.replace(staged_path, file_path)
         db_session.commit()
-    except SQLAlchemyError as sql_e:
-        db_session.rollback()
-        raise
     except Exception:
-        if file_path.is_file():
-            os.remove(file_path)
         db_session.rollback()
+        remove_stored_files(staged_path, file_path)
         raise
-    return new_doc.id
+    return document_id
+
+
+def stage_file(bytes_obj: io.BytesIO, suffix: str) -> tuple[pathlib.Path, str]:
+    """Stream bytes object to a new file in the file storage.
+
+    Returns the path of the file and its SHA-256 hash. The file is moved to the path
+    of its document once the document is added, see add_file_document.
+    """
+    staged_path = pathlib.Path(
+        get_file_storage_path(), f"upload-{uuid.uuid4().hex}.{suffix}"
+    )
+    return staged_path, save_bytes_to_file(bytes_obj, staged_path)
+
+
+def add_file_document(
+    db_session: Session, staged_path: pathlib.Path, file_hash: str, suffix: str
+) -> tuple[int, pathlib.Path]:
+    """Add the document of a staged file without committing it.
+
+    Returns the id of the document and the path the file must be moved to before the
+    document is committed.
+    """
+    new_doc = Document(hash=file_hash)
+    db_session.add(new_doc)
+    db_session.flush()  # Generates the ID without committing the transaction
+    file_path = staged_path.with_name(f"{new_doc.id}.{suffix}")
+    new_doc.file_path = str(file_path)
+    return new_doc.id, file_path
+
+
+def remove_stored_files(*file_paths: pathlib.Path | str | None):
+    """Remove the given files from the file storage, skipping those not there."""
+    for file_path in file_paths:
+        if file_path is not None and pathlib.Path(file_path).is_file():
+            os.remove(file_path)
 
 
 def remove_file(db_session: Session, document_id: int):
@@ -83,10 +117,26 @@ def move_file(db_session: Session, document_id: int, new_file_path: str):
         raise
 
 
-def save_bytes_to_file(bytes_obj: io.BytesIO, file_path: pathlib.Path):
-    """Convert bytes object to file on the filesystem."""
-    with open(file_path, "wb") as f:
-        f.write(bytes_obj.read())
+def save_bytes_to_file(bytes_obj: io.BytesIO, file_path: pathlib.Path) -> str:
+    """Stream bytes object to file on the filesystem and return its SHA-256 hash.
+
+    The data is written in chunks to a temporary file next to the target, which is
+    renamed into place once complete so a partially written file is never visible.
+    """
+    file_path = pathlib.Path(file_path)
+    sha256 = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(dir=file_path.parent, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: bytes_obj.read(FILE_CHUNK_SIZE), b""):
+                sha256.update(chunk)
+                f.write(chunk)
+        os.replace(temp_path, file_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return sha256.hexdigest()
 
 
 def load_bytes_from_file(file_path: pathlib.Path) -> io.BytesIO:
@@ -118,17 +168,25 @@ def get_document(db: Session, document_id: int) -> Document:
     return db.query(Document).filter(Document.id == document_id).first()
 
 
+def document_hash_in_use(db: Session, doc_hash: str) -> bool:
+    """Return whether any document has the given content hash."""
+    return db.query(Document.id).filter(Document.hash == doc_hash).first() is not None
+
+
 def get_user_documents(db: Session, user_id: int) -> list[Document]:
     """Get all documents owned by a user."""
     return get_user(db, user_id).documents
 
 
-def delete_document(db: Session, document_id: int):
-    """Delete a document object from the database."""
+def delete_document(db: Session, document_id: int) -> str | None:
+    """Delete a document object from the database, returning the path of its file."""
     db_document = get_document(db, document_id)
-    if db_document:
-        db.delete(db_document)
-        db.commit()
+    if not db_document:
+        return None
+    file_path = db_document.file_path
+    db.delete(db_document)
+    db.commit()
+    return file_path
 
 
 def update_document(
@@ -166,20 +224,27 @@ def update_document(
     return doc_id_updated
 
 
-def document_owned_by_user(db: Session, document_id: int, user_id: int):
-    doc = get_document(db, document_id)
-    user = get_user(db, user_id)
-    if doc is None or user is None or doc.users is None:
-        return False
-    if user in doc.users:
-        return True
-    return False
+def _owned_by_user(document_id, user_id: int):
+    return exists().where(
+        user_document_relation.c.user_id == user_id,
+        user_document_relation.c.document_id == document_id,
+    )
+
+
+def document_owned_by_user(db: Session, document_id: int, user_id: int) -> bool:
+    """Return whether the user owns the document, in a single query."""
+    return db.query(_owned_by_user(document_id, user_id)).scalar()
 
 
-def _get_file_hash(file: io.BytesIO):
-    """Get a hash of the file."""
-    original_position = file.tell()
-    file.seek(0)
-    h = hash(file.read())
-    file.seek(original_position)
-    return h
+def get_document_with_ownership(
+    db: Session, document_id: int, user_id: int
+) -> tuple[Document | None, bool]:
+    """Get a document and whether the user owns it, in a single query."""
+    row = (
+        db.query(Document, _owned_by_user(Document.id, user_id))
+        .filter(Document.id == document_id)
+        .first()
+    )
+    if row is None:
+        return None, False
+    return row[0], row[1]
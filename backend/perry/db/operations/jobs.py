@@ -0,0 +1,57 @@
+from sqlalchemy.orm import Session
+from perry.db.models import IndexingJob, JobStatusEnum
+
+
+def create_job(
+    session: Session, conversation_id: int = None, document_id: int = None
+) -> int:
+    """Create a job building the agent of a conversation or indexing a document."""
+    if (conversation_id is None) == (document_id is None):
+        raise ValueError("A job needs either a conversation or a document.")
+    job = IndexingJob(conversation_id=conversation_id, document_id=document_id)
+    session.add(job)
+    session.commit()
+    return job.id
+
+
+def read_job(session: Session, job_id: int) -> IndexingJob:
+    return session.query(IndexingJob).filter_by(id=job_id).first()
+
+
+def get_conversation_job(session: Session, conversation_id: int) -> IndexingJob:
+    """Get the most recent indexing job of a conversation."""
+    return (
+        session.query(IndexingJob)
+        .filter_by(conversation_id=conversation_id)
+        .order_by(IndexingJob.id.desc())
+        .first()
+    )
+
+
+def get_unfinished_jobs(session: Session) -> list[IndexingJob]:
+    return (
+        session.query(IndexingJob)
+        .filter(IndexingJob.status.in_([JobStatusEnum.queued, JobStatusEnum.running]))
+        .order_by(IndexingJob.id)
+        .all()
+    )
+
+
+def update_job(
+    session: Session,
+    job_id: int,
+    status: JobStatusEnum = None,
+    progress: float = None,
+    error: str = None,
+):
+    job = read_job(session, job_id)
+    if not job:
+        return None
+    if status:
+        job.status = status
+    if progress is not None:
+        job.progress = progress
+    if error is not None:
+        job.error = error
+    session.commit()
+    return True
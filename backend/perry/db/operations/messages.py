@@ -26,3 +26,27 @@ def delete_message(db: Session, message_id: int):
 
 def get_messages_by_user(db: Session, user_id: int):
     return db.query(Message).filter(Message.user_id == user_id).all()
+
+
+def read_conversation_messages(
+    db: Session,
+    conversation_id: int,
+    before_id: int = None,
+    after_id: int = None,
+    limit: int = None,
+) -> list[Message]:
+    """Read a page of the messages of a conversation in order of their ids.
+
+    Messages are read by their id after after_id and before before_id. Without
+    after_id, the page is the latest messages, so a limit alone reads the end of a
+    conversation and before_id pages back from there.
+    """
+    query = db.query(Message).filter(Message.conversation_id == conversation_id)
+    if before_id is not None:
+        query = query.filter(Message.id < before_id)
+    if after_id is not None:
+        return (
+            query.filter(Message.id > after_id).order_by(Message.id).limit(limit).all()
+        )
+    messages = query.order_by(Message.id.desc()).limit(limit).all()
+    return messages[::-1]
@@ -2,9 +2,15 @@ from sqlalchemy.orm import Session
 from perry.db.models import User
 
 
-def create_user(db: Session, username: str, password: str) -> int:
+def create_user(
+    db: Session, username: str, password: str = None, password_hash: str = None
+) -> int:
+    """Create a user from its password, or from its hash_password hash."""
     user = User(username=username)
-    user.set_password(password)
+    if password_hash is None:
+        user.set_password(password)
+    else:
+        user.set_password_hash(password_hash)
     db.add(user)
     db.commit()
     db.refresh(user)
@@ -1,36 +1,100 @@
 import os
 from pathlib import Path
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import Session
-from perry.db.models import Base
+from perry.db.migrations import upgrade_database
+from perry.settings import get_settings
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Configure every new SQLite connection with the database settings.
+
+    In WAL mode readers never wait for writers, and with synchronous set to normal
+    a commit only waits for the log to be written, not for it to be synced.
+    """
+    settings = get_settings()
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={settings.db_journal_mode.value}")
+        cursor.execute(f"PRAGMA synchronous={settings.db_synchronous.value}")
+        cursor.execute(f"PRAGMA mmap_size={settings.db_mmap_size_mb * 1024 * 1024}")
+        cursor.execute(f"PRAGMA busy_timeout={settings.db_busy_timeout_ms}")
+    finally:
+        cursor.close()
 
 
 class DatabaseSessionManager:
+    """Create the engines and sessions of the database.
+
+    Request handlers use async sessions, so waiting on the database never blocks the
+    event loop. Agents and indexing jobs run in threads and use sync sessions on the
+    same database file.
+    """
+
     _db_name = "perry"
+    _db_directory: Path | None = None
     _engine = None
     _SessionLocal = None
+    _async_engine = None
+    _AsyncSessionLocal = None
 
     @classmethod
     def get_engine(cls):
         if cls._engine is None:
-            current_file_path = Path(__file__).resolve()
-            target_directory = current_file_path.parents[2]
-
-            if not target_directory.exists():
-                raise FileNotFoundError(
-                    f"The directory {target_directory} does not exist."
-                )
-            if not os.access(target_directory, os.W_OK):
-                raise PermissionError(
-                    f"No write permission for directory {target_directory}"
-                )
-
-            db_path = target_directory / f"{cls._db_name}.db"
-            cls._engine = create_engine(f"sqlite:///{db_path}")
-            Base.metadata.create_all(bind=cls._engine)
+            db_path = cls._get_db_path()
+            cls._engine = cls._create_engine(f"sqlite:///{db_path}")
+            upgrade_database(cls._engine)
         return cls._engine
 
+    @classmethod
+    def get_async_engine(cls) -> AsyncEngine:
+        if cls._async_engine is None:
+            # The sync engine migrates the database, which must be done before use.
+            cls.get_engine()
+            settings = get_settings()
+            cls._async_engine = create_async_engine(
+                f"sqlite+aiosqlite:///{cls._get_db_path()}",
+                pool_size=settings.db_pool_size,
+                max_overflow=settings.db_max_overflow,
+                pool_timeout=settings.db_pool_timeout_seconds,
+            )
+            event.listen(cls._async_engine.sync_engine, "connect", set_sqlite_pragmas)
+        return cls._async_engine
+
+    @classmethod
+    def _get_db_path(cls) -> Path:
+        """Return the database file, in the backend directory unless set otherwise."""
+        target_directory = cls._db_directory or Path(__file__).resolve().parents[2]
+
+        if not target_directory.exists():
+            raise FileNotFoundError(f"The directory {target_directory} does not exist.")
+        if not os.access(target_directory, os.W_OK):
+            raise PermissionError(
+                f"No write permission for directory {target_directory}"
+            )
+        return target_directory / f"{cls._db_name}.db"
+
+    @staticmethod
+    def _create_engine(url: str) -> Engine:
+        """Create an engine with the pool and SQLite pragmas of the settings."""
+        settings = get_settings()
+        engine = create_engine(
+            url,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout_seconds,
+        )
+        event.listen(engine, "connect", set_sqlite_pragmas)
+        return engine
+
     @classmethod
     def get_session_local(cls):
         if cls._SessionLocal is None:
@@ -45,3 +109,17 @@ class DatabaseSessionManager:
             cls.get_session_local()
 
         return cls._SessionLocal()
+
+    @classmethod
+    def get_async_session_local(cls) -> async_sessionmaker[AsyncSession]:
+        if cls._AsyncSessionLocal is None:
+            # Loaded objects stay readable after a commit without a lazy refresh,
+            # which async sessions cannot do implicitly.
+            cls._AsyncSessionLocal = async_sessionmaker(
+                bind=cls.get_async_engine(), autoflush=False, expire_on_commit=False
+            )
+        return cls._AsyncSessionLocal
+
+    @classmethod
+    def get_async_db_session(cls) -> AsyncSession:
+        return cls.get_async_session_local()()
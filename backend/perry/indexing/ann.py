@@ -0,0 +1,82 @@
+import numpy as np
+
+TRAINING_POINTS_PER_LIST = 64
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class IvfIndex:
+    """Inverted file index for approximate cosine similarity search.
+
+    Embeddings are clustered around centroids with spherical k-means, and every
+    embedding is listed under its nearest centroid. A search only scores the
+    embeddings in the lists of the n_probe centroids nearest to the query, so more
+    probes trade latency for recall. Probing all lists gives the exact result.
+    """
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+        cls,
+        embeddings: np.ndarray,
+        n_lists: int | None = None,
+        n_iterations: int = 10,
+        seed: int = 0,
+    ) -> "IvfIndex":
+        """Cluster the embeddings into n_lists lists, by default about sqrt(n)."""
+        vectors = normalize(np.asarray(embeddings, dtype=np.float32))
+        n_lists = min(n_lists or max(1, int(np.sqrt(len(vectors)))), len(vectors))
+        rng = np.random.default_rng(seed)
+
+        training_size = min(len(vectors), n_lists * TRAINING_POINTS_PER_LIST)
+        training = vectors[rng.choice(len(vectors), training_size, replace=False)]
+        centroids = training[rng.choice(training_size, n_lists, replace=False)]
+        for _ in range(n_iterations):
+            assignments = np.argmax(training @ centroids.T, axis=1)
+            for list_id in range(n_lists):
+                members = training[assignments == list_id]
+                if len(members):
+                    centroids[list_id] = normalize(members.sum(axis=0))
+
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(assignments, kind="stable").astype(np.int64)
+        counts = np.bincount(assignments, minlength=n_lists)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(centroids, order, offsets)
+
+    def get_candidates(self, queries: np.ndarray, n_probe: int) -> list[np.ndarray]:
+        """Return the rows listed under the centroids nearest to each query."""
+        n_probe = min(n_probe, self.n_lists)
+        centroid_scores = normalize(queries) @ self.centroids.T
+        if n_probe < self.n_lists:
+            probes = np.argpartition(-centroid_scores, n_probe - 1, axis=1)[:, :n_probe]
+        else:
+            probes = np.tile(np.arange(self.n_lists), (len(queries), 1))
+        return [
+            np.concatenate(
+                [self.order[self.offsets[i] : self.offsets[i + 1]] for i in lists]
+            )
+            for lists in probes
+        ]
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            np.savez(
+                f, centroids=self.centroids, order=self.order, offsets=self.offsets
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "IvfIndex":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["centroids"], data["order"], data["offsets"])
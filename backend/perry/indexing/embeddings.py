@@ -0,0 +1,186 @@
+import hashlib
+import json
+import re
+from pathlib import Path
+from typing import List, Tuple
+import numpy as np
+from llama_index.embeddings.base import BaseEmbedding
+from llama_index.embeddings.openai import OpenAIEmbedding
+from perry.settings import EmbeddingBackend, get_settings
+from perry.sqlite_cache import SqliteCache
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class HashingEmbedding(BaseEmbedding):
+    """Local embedding model hashing the words of a text into a fixed size vector.
+
+    Needs no network or model download, so documents can be indexed offline, and
+    counts its tokens as words instead of with the tiktoken tokenizer. Texts sharing
+    words get similar embeddings, but synonyms are not matched.
+    """
+
+    def __init__(self, dim: int = 512, **kwargs):
+        kwargs.setdefault("tokenizer", TOKEN_PATTERN.findall)
+        super().__init__(**kwargs)
+        self.dim = dim
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._get_text_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.dim] += 1.0 if value >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+
+class EmbeddingCache(SqliteCache):
+    """Persistent cache of text embeddings keyed by model and text content hash."""
+
+    _store_path = Path(".cache", "embeddings.sqlite3")
+    _schema = (
+        "CREATE TABLE IF NOT EXISTS embeddings (model TEXT NOT NULL, "
+        "text_hash TEXT NOT NULL, embedding BLOB NOT NULL, "
+        "PRIMARY KEY (model, text_hash))",
+    )
+
+    @classmethod
+    def get_many(cls, model: str, text_hashes: list[str]) -> dict[str, list[float]]:
+        if not text_hashes:
+            return {}
+        embeddings = {}
+        with cls._connect() as connection:
+            for start in range(0, len(text_hashes), 500):
+                batch = text_hashes[start : start + 500]
+                rows = connection.execute(
+                    "SELECT text_hash, embedding FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({', '.join('?' * len(batch))})",
+                    [model, *batch],
+                )
+                for text_hash, embedding in rows:
+                    embeddings[text_hash] = np.frombuffer(
+                        embedding, dtype=np.float32
+                    ).tolist()
+        return embeddings
+
+    @classmethod
+    def put_many(cls, model: str, embeddings: dict[str, list[float]]):
+        with cls._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, embedding) "
+                "VALUES (?, ?, ?)",
+                [
+                    (model, text_hash, np.asarray(embedding, np.float32).tobytes())
+                    for text_hash, embedding in embeddings.items()
+                ],
+            )
+
+
+class CachedEmbedding(BaseEmbedding):
+    """Embedding model embedding each distinct text once.
+
+    Queued texts are deduplicated by content hash and looked up in the
+    EmbeddingCache, and only the texts missing from it are sent to the wrapped
+    model, in batches of embed_batch_size. Query embeddings are not cached.
+    """
+
+    def __init__(self, embed_model: BaseEmbedding, **kwargs):
+        super().__init__(**kwargs)
+        self.embed_model = embed_model
+
+    @property
+    def model_name(self) -> str:
+        """Name the settings of the wrapped model that change its embeddings."""
+        model = self.embed_model
+        return json.dumps(
+            {
+                "class": model.__class__.__name__,
+                "engine": getattr(model, "text_engine", None),
+                "dim": getattr(model, "dim", None),
+            },
+            sort_keys=True,
+        )
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self.embed_model.get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        text_hashes = [self.get_text_hash(text) for text in texts]
+        embeddings = EmbeddingCache.get_many(
+            self.model_name, list(dict.fromkeys(text_hashes))
+        )
+        missing = {
+            text_hash: text
+            for text_hash, text in zip(text_hashes, texts)
+            if text_hash not in embeddings
+        }
+        if missing:
+            computed = {}
+            missing_hashes = list(missing.keys())
+            for start in range(0, len(missing_hashes), self._embed_batch_size):
+                batch = missing_hashes[start : start + self._embed_batch_size]
+                batch_embeddings = self.embed_model._get_text_embeddings(
+                    [missing[text_hash] for text_hash in batch]
+                )
+                computed.update(zip(batch, batch_embeddings))
+            EmbeddingCache.put_many(self.model_name, computed)
+            embeddings.update(computed)
+        return [embeddings[text_hash] for text_hash in text_hashes]
+
+    def get_queued_text_embeddings(
+        self, show_progress: bool = False
+    ) -> Tuple[List[str], List[List[float]]]:
+        """Embed all queued texts at once, so duplicates across batches are shared."""
+        text_queue, self._text_queue = self._text_queue, []
+        if not text_queue:
+            return [], []
+        for _, text in text_queue:
+            self._total_tokens_used += len(self._tokenizer(text))
+        text_ids = [text_id for text_id, _ in text_queue]
+        return text_ids, self._get_text_embeddings([text for _, text in text_queue])
+
+    async def aget_queued_text_embeddings(
+        self, text_queue: List[Tuple[str, str]], show_progress: bool = False
+    ) -> Tuple[List[str], List[List[float]]]:
+        self._text_queue = list(text_queue)
+        return self.get_queued_text_embeddings(show_progress)
+
+    @staticmethod
+    def get_text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def create_embed_model() -> CachedEmbedding:
+    """Return the embedding model set up by the settings, with a cache in front."""
+    settings = get_settings()
+    if settings.embedding_backend == EmbeddingBackend.local:
+        embed_model = HashingEmbedding(dim=settings.local_embedding_dim)
+    else:
+        embed_model = OpenAIEmbedding()
+    return CachedEmbedding(embed_model, embed_batch_size=settings.embed_batch_size)
+
+
+def get_query_embedding_batch(
+    embed_model: BaseEmbedding, queries: List[str]
+) -> List[List[float]]:
+    """Embed queries in as few calls to the model as its batch size allows.
+
+    The models used here embed queries and texts alike, so the queries are sent as a
+    batch of texts. Queries skip the cache of a cached model, as they are not reused.
+    """
+    if isinstance(embed_model, CachedEmbedding):
+        embed_model = embed_model.embed_model
+    embeddings = []
+    for start in range(0, len(queries), embed_model._embed_batch_size):
+        batch = queries[start : start + embed_model._embed_batch_size]
+        embeddings.extend(embed_model._get_text_embeddings(batch))
+    for query in queries:
+        embed_model._total_tokens_used += len(embed_model._tokenizer(query))
+    return embeddings
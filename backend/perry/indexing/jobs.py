@@ -0,0 +1,105 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from sqlalchemy.orm import Session
+from perry.agents.base import AgentRegistry
+from perry.agents.manager import AgentManager
+from perry.db.models import IndexingJob, JobStatusEnum
+from perry.db.operations.conversations import read_conversation
+from perry.db.operations.jobs import (
+    read_job,
+    update_job,
+    get_unfinished_jobs,
+)
+from perry.db.session import DatabaseSessionManager
+from perry.settings import get_settings
+
+
+class IndexingWorker:
+    """Run indexing jobs on a pool of background threads.
+
+    Document jobs let every registered agent type prepare a newly uploaded document,
+    conversation jobs build the agent of a conversation from the prepared indexes.
+
+    Jobs are stored in the database, so jobs that did not finish before a restart are
+    picked up again when the worker is started.
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(IndexingWorker, cls).__new__(cls)
+            cls.reset()
+        return cls._instance
+
+    @classmethod
+    def reset(cls):
+        cls._executor = None
+        cls._executor_lock = Lock()
+
+    def start(self):
+        """Requeue jobs left unfinished by a previous run."""
+        db = DatabaseSessionManager.get_session_local()()
+        try:
+            job_ids = [job.id for job in get_unfinished_jobs(db)]
+        finally:
+            db.close()
+        for job_id in job_ids:
+            self.submit(job_id)
+
+    def stop(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self.__class__._executor = None
+
+    def submit(self, job_id: int) -> Future:
+        return self._get_executor().submit(self.run_job, job_id)
+
+    def run_job(self, job_id: int):
+        db = DatabaseSessionManager.get_session_local()()
+        try:
+            job = read_job(db, job_id)
+            if job is None:
+                return
+            update_job(db, job_id, status=JobStatusEnum.running, progress=0.0)
+            progress_callback = lambda progress: update_job(
+                db, job_id, progress=progress
+            )
+            if job.document_id is not None:
+                self._index_document(db, job, progress_callback)
+            else:
+                self._load_conversation_agent(db, job, progress_callback)
+            update_job(db, job_id, status=JobStatusEnum.completed, progress=1.0)
+        except Exception as e:
+            db.rollback()
+            update_job(db, job_id, status=JobStatusEnum.failed, error=str(e))
+        finally:
+            db.close()
+
+    @staticmethod
+    def _index_document(db: Session, job: IndexingJob, progress_callback):
+        agent_types = AgentRegistry().get_agent_types()
+        for count, agent_type in enumerate(agent_types, start=1):
+            AgentRegistry().get_agent_class(agent_type).index_document(
+                db, job.document_id
+            )
+            progress_callback(count / len(agent_types))
+
+    @staticmethod
+    def _load_conversation_agent(db: Session, job: IndexingJob, progress_callback):
+        conversation = read_conversation(db, job.conversation_id)
+        if conversation is None or conversation.agent is None:
+            raise ValueError(f"No agent found for job {job.id}.")
+        AgentManager().load_agent(
+            db, conversation.agent.id, progress_callback=progress_callback
+        ).unpin()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self.__class__._executor = ThreadPoolExecutor(
+                    max_workers=get_settings().indexing_workers,
+                    thread_name_prefix="indexing",
+                )
+            return self._executor
@@ -0,0 +1,113 @@
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from threading import Lock
+import pypdf
+from llama_index import Document
+from perry.settings import get_settings
+
+
+def parse_page_range(file_path: Path, start: int, stop: int) -> list[tuple[str, str]]:
+    """Extract the text and label of the pages in [start, stop) of a PDF file.
+
+    Runs in a worker process, so it only returns plain picklable values.
+    """
+    with open(file_path, "rb") as fp:
+        pdf = pypdf.PdfReader(fp)
+        page_labels = pdf.page_labels
+        return [
+            (pdf.pages[page].extract_text(), page_labels[page])
+            for page in range(start, stop)
+        ]
+
+
+def count_pages(file_path: Path) -> int:
+    with open(file_path, "rb") as fp:
+        return len(pypdf.PdfReader(fp).pages)
+
+
+class PdfParser:
+    """Parse PDF files into page documents using a shared pool of worker processes.
+
+    Every file is split into page ranges that are parsed in parallel, so the time to
+    parse a set of documents is bounded by the largest file rather than their sum.
+
+    Parsers with the same number of workers share a pool. Workers are spawned rather
+    than forked, because pools are created from threads of a multithreaded server.
+    """
+
+    _executors: dict[int | None, Executor] = {}
+    _executor_lock = Lock()
+
+    def __init__(self, max_workers: int | None = None, pages_per_task: int = None):
+        settings = get_settings()
+        self.max_workers = max_workers or settings.parse_workers
+        self.pages_per_task = pages_per_task or settings.parse_pages_per_task
+
+    def parse(self, file_paths: dict[int, Path]) -> dict[int, list[Document]]:
+        """Return the pages of each file, keyed by document id."""
+        tasks, results = self._extract_pages(file_paths)
+        return self._group_pages(file_paths, tasks, results)
+
+    def _extract_pages(
+        self, file_paths: dict[int, Path]
+    ) -> tuple[list[tuple[int, Path, int, int]], list[list[tuple[str, str]]]]:
+        """Extract the text of all pages, returning the page range tasks and results."""
+        tasks = []
+        for doc_id, file_path in file_paths.items():
+            for start, stop in self._get_page_ranges(count_pages(file_path)):
+                tasks.append((doc_id, Path(file_path), start, stop))
+
+        if len(tasks) <= 1 or self.max_workers == 1:
+            results = [
+                parse_page_range(path, start, stop) for _, path, start, stop in tasks
+            ]
+        else:
+            executor = self._get_executor(self.max_workers)
+            futures = [
+                executor.submit(parse_page_range, path, start, stop)
+                for _, path, start, stop in tasks
+            ]
+            results = [future.result() for future in futures]
+        return tasks, results
+
+    @staticmethod
+    def _group_pages(
+        file_paths: dict[int, Path],
+        tasks: list[tuple[int, Path, int, int]],
+        results: list[list[tuple[str, str]]],
+    ) -> dict[int, list[Document]]:
+        """Turn the extracted pages into page documents grouped by document id."""
+        docs_grouped = {doc_id: [] for doc_id in file_paths.keys()}
+        for (doc_id, file_path, _, _), pages in zip(tasks, results):
+            docs_grouped[doc_id].extend(
+                Document(
+                    text=text,
+                    metadata={"page_label": page_label, "file_name": file_path.name},
+                )
+                for text, page_label in pages
+            )
+        return docs_grouped
+
+    def _get_page_ranges(self, num_pages: int) -> list[tuple[int, int]]:
+        return [
+            (start, min(start + self.pages_per_task, num_pages))
+            for start in range(0, num_pages, self.pages_per_task)
+        ]
+
+    @classmethod
+    def _get_executor(cls, max_workers: int | None) -> Executor:
+        with cls._executor_lock:
+            if max_workers not in cls._executors:
+                cls._executors[max_workers] = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return cls._executors[max_workers]
+
+    @classmethod
+    def shutdown(cls):
+        with cls._executor_lock:
+            for executor in cls._executors.values():
+                executor.shutdown()
+            cls._executors.clear()
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+from threading import Lock
+from typing import Callable
+from llama_index import (
+    VectorStoreIndex,
+    ServiceContext,
+    StorageContext,
+    load_index_from_storage,
+)
+from perry.indexing.embeddings import CachedEmbedding, HashingEmbedding
+from perry.indexing.vector_store import MemmapVectorStore
+
+
+class IndexStore:
+    """Content addressed store of persisted vector indexes.
+
+    Indexes are keyed by the content hash of a document together with the settings
+    that determine its embeddings, so identical documents are embedded only once and
+    their index is shared by all agents and users. The documents referring to an
+    index are counted and the index is removed once the last reference is released.
+
+    Embeddings are stored in a MemmapVectorStore, so loading an index maps its
+    embeddings instead of parsing them. Indexes persisted before with the default
+    JSON vector store are still loaded.
+    """
+
+    _store_path = Path(".cache", "indexes")
+    _references_file_name = "references.json"
+    _required_files = [
+        "docstore.json",
+        "index_store.json",
+        "graph_store.json",
+        "vector_store.json",
+    ]
+
+    _references_lock = Lock()
+    _key_locks: dict[str, Lock] = {}
+    _key_locks_lock = Lock()
+
+    @staticmethod
+    def get_index_key(doc_hash: str, service_context: ServiceContext) -> str:
+        """Return the key of the index for a document hash and embedding settings."""
+        if not doc_hash:
+            raise ValueError("A document hash is required to address an index.")
+        fingerprint = {
+            "document_hash": doc_hash,
+            **IndexStore.get_embedding_fingerprint(service_context),
+        }
+        encoded = json.dumps(fingerprint, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    @staticmethod
+    def get_embedding_fingerprint(service_context: ServiceContext) -> dict:
+        """Return the settings of a service context that change the embeddings."""
+        embed_model = service_context.embed_model
+        if isinstance(embed_model, CachedEmbedding):
+            embed_model = embed_model.embed_model
+        text_splitter = getattr(service_context.node_parser, "_text_splitter", None)
+        fingerprint = {
+            "embed_model": embed_model.__class__.__name__,
+            "embed_engine": getattr(embed_model, "text_engine", None),
+            "chunk_size": getattr(text_splitter, "_chunk_size", None),
+            "chunk_overlap": getattr(text_splitter, "_chunk_overlap", None),
+        }
+        if isinstance(embed_model, HashingEmbedding):
+            fingerprint["embed_dim"] = embed_model.dim
+        return fingerprint
+
+    @staticmethod
+    def get_memory_footprint(index: VectorStoreIndex) -> int:
+        """Estimate the bytes held in memory by the embeddings and nodes of an index."""
+        footprint = 0
+        vector_store = index.storage_context.vector_store
+        if isinstance(vector_store, MemmapVectorStore):
+            footprint += vector_store.get_memory_footprint()
+        else:
+            vector_store_data = getattr(vector_store, "_data", None)
+            embedding_dict = getattr(vector_store_data, "embedding_dict", {})
+            float_size = sys.getsizeof(0.0)
+            for embedding in embedding_dict.values():
+                footprint += sys.getsizeof(embedding) + len(embedding) * float_size
+        for node in index.docstore.docs.values():
+            footprint += sys.getsizeof(node.get_content())
+            footprint += sys.getsizeof(json.dumps(node.metadata))
+        return footprint
+
+    @classmethod
+    def get_path(cls, key: str) -> Path:
+        return Path(cls._store_path, key)
+
+    @classmethod
+    def exists(cls, key: str) -> bool:
+        directory = cls.get_path(key)
+        if not directory.exists():
+            return False
+        for file_name in cls._required_files:
+            if not Path(directory, file_name).exists():
+                return False
+        return True
+
+    @classmethod
+    def load(cls, key: str, service_context: ServiceContext) -> VectorStoreIndex:
+        if not cls.exists(key):
+            raise FileNotFoundError(
+                f"Vector index {key} not found in {cls._store_path}"
+            )
+        path = cls.get_path(key)
+        vector_store = None
+        if MemmapVectorStore.exists(path):
+            vector_store = MemmapVectorStore.from_persist_dir(path)
+        storage_context = StorageContext.from_defaults(
+            persist_dir=path, vector_store=vector_store
+        )
+        return load_index_from_storage(storage_context, service_context=service_context)
+
+    @staticmethod
+    def new_storage_context() -> StorageContext:
+        """Return an empty storage context for building an index to store."""
+        return StorageContext.from_defaults(vector_store=MemmapVectorStore())
+
+    @classmethod
+    def get_or_create(
+        cls,
+        key: str,
+        service_context: ServiceContext,
+        create_index: Callable[[], VectorStoreIndex],
+    ) -> VectorStoreIndex:
+        """Load the index for a key, creating and persisting it if it does not exist.
+
+        Concurrent requests for the same key wait for a single index to be built.
+        """
+        with cls._get_key_lock(key):
+            if cls.exists(key):
+                return cls.load(key, service_context)
+            index = create_index()
+            cls._persist(key, index)
+            return index
+
+    @classmethod
+    def add_reference(cls, key: str, doc_id: int):
+        with cls._references_lock:
+            references = cls._load_references()
+            doc_ids = set(references.get(key, []))
+            doc_ids.add(doc_id)
+            references[key] = sorted(doc_ids)
+            cls._save_references(references)
+
+    @classmethod
+    def remove_references(cls, doc_id: int) -> list[str]:
+        """Release all references of a document and delete indexes no longer used.
+
+        Returns the keys of the deleted indexes.
+        """
+        removed_keys = []
+        with cls._references_lock:
+            references = cls._load_references()
+            for key in list(references.keys()):
+                if doc_id not in references[key]:
+                    continue
+                references[key].remove(doc_id)
+                if not references[key]:
+                    del references[key]
+                    removed_keys.append(key)
+            cls._save_references(references)
+
+        for key in removed_keys:
+            with cls._get_key_lock(key):
+                shutil.rmtree(cls.get_path(key), ignore_errors=True)
+        return removed_keys
+
+    @classmethod
+    def get_reference_count(cls, key: str) -> int:
+        with cls._references_lock:
+            return len(cls._load_references().get(key, []))
+
+    @classmethod
+    def _persist(cls, key: str, index: VectorStoreIndex):
+        """Persist to a temporary directory first so readers never see partial indexes."""
+        save_path = cls.get_path(key)
+        temp_path = Path(cls._store_path, f".{key}.{os.getpid()}.tmp")
+        shutil.rmtree(temp_path, ignore_errors=True)
+        index.storage_context.persist(persist_dir=temp_path)
+        shutil.rmtree(save_path, ignore_errors=True)
+        os.replace(temp_path, save_path)
+
+    @classmethod
+    def _get_key_lock(cls, key: str) -> Lock:
+        with cls._key_locks_lock:
+            return cls._key_locks.setdefault(key, Lock())
+
+    @classmethod
+    def _get_references_file(cls) -> Path:
+        return Path(cls._store_path, cls._references_file_name)
+
+    @classmethod
+    def _load_references(cls) -> dict[str, list[int]]:
+        file = cls._get_references_file()
+        if not file.exists():
+            return {}
+        with file.open("r") as f:
+            return json.load(f)
+
+    @classmethod
+    def _save_references(cls, references: dict[str, list[int]]):
+        file = cls._get_references_file()
+        if not file.parent.exists():
+            file.parent.mkdir(parents=True)
+        temp_file = file.with_suffix(".tmp")
+        with temp_file.open("w") as f:
+            json.dump(references, f)
+        os.replace(temp_file, file)
@@ -0,0 +1,303 @@
+import json
+import os
+from typing import Any, List, Optional
+import fsspec
+import numpy as np
+from llama_index.indices.query.embedding_utils import (
+    get_top_k_embeddings_learner,
+    get_top_k_mmr_embeddings,
+)
+from llama_index.vector_stores.types import (
+    DEFAULT_PERSIST_FNAME,
+    NodeWithEmbedding,
+    VectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from perry.indexing.ann import IvfIndex
+
+EMBEDDINGS_SUFFIX = ".npy"
+ANN_INDEX_SUFFIX = ".ivf.npz"
+DEFAULT_ANN_PROBES = 8
+
+
+class MemmapVectorStore(VectorStore):
+    """Vector store keeping embeddings in a float32 NumPy file that is memory mapped.
+
+    Embeddings are persisted as a matrix next to a compact JSON sidecar with the node
+    ids and their document ids. Loading maps the matrix instead of parsing it, so it
+    takes constant time and processes serving the same index share its pages through
+    the page cache. Adding or deleting embeddings copies the matrix into memory.
+
+    Similarities of any number of queries are computed with one matrix product over
+    all embeddings, and only the top k rows of each query are sorted. Large stores
+    can build an approximate IVF index, after which unrestricted queries only score
+    the embeddings in the ann_probes lists nearest to each query.
+    """
+
+    stores_text: bool = False
+
+    def __init__(
+        self,
+        embeddings: np.ndarray | None = None,
+        node_ids: list[str] | None = None,
+        ref_doc_ids: list[str] | None = None,
+        ann_index: IvfIndex | None = None,
+    ):
+        self._embeddings = embeddings
+        self._node_ids = node_ids or []
+        self._ref_doc_ids = ref_doc_ids or []
+        self._norms = None
+        self._ann_index = ann_index
+        self.ann_probes = DEFAULT_ANN_PROBES
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str) -> "MemmapVectorStore":
+        return cls.from_persist_path(os.path.join(persist_dir, DEFAULT_PERSIST_FNAME))
+
+    @classmethod
+    def from_persist_path(cls, persist_path: str) -> "MemmapVectorStore":
+        with open(persist_path, "r") as f:
+            metadata = json.load(f)
+        node_ids = metadata["node_ids"]
+        ref_doc_ids = [metadata["ref_doc_ids"][i] for i in metadata["ref_doc_index"]]
+        embeddings = None
+        if node_ids:
+            embeddings = np.load(
+                cls.get_embeddings_path(persist_path), mmap_mode="r", allow_pickle=False
+            )
+        ann_index = None
+        if os.path.exists(cls.get_ann_index_path(persist_path)):
+            ann_index = IvfIndex.load(cls.get_ann_index_path(persist_path))
+        return cls(embeddings, node_ids, ref_doc_ids, ann_index)
+
+    @staticmethod
+    def exists(persist_dir: str) -> bool:
+        """Return whether a directory holds a persisted memory mapped vector store."""
+        persist_path = os.path.join(persist_dir, DEFAULT_PERSIST_FNAME)
+        return os.path.exists(MemmapVectorStore.get_embeddings_path(persist_path))
+
+    @staticmethod
+    def get_embeddings_path(persist_path: str) -> str:
+        return os.path.splitext(persist_path)[0] + EMBEDDINGS_SUFFIX
+
+    @staticmethod
+    def get_ann_index_path(persist_path: str) -> str:
+        return os.path.splitext(persist_path)[0] + ANN_INDEX_SUFFIX
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @property
+    def is_memory_mapped(self) -> bool:
+        return isinstance(self._embeddings, np.memmap)
+
+    @property
+    def size(self) -> int:
+        return len(self._node_ids)
+
+    @property
+    def has_ann_index(self) -> bool:
+        return self._ann_index is not None
+
+    def build_ann_index(self, n_lists: int | None = None):
+        """Cluster the embeddings into an IVF index used by unrestricted queries."""
+        self._ann_index = None
+        if self._embeddings is not None:
+            self._ann_index = IvfIndex.build(self._embeddings, n_lists=n_lists)
+
+    def get_memory_footprint(self) -> int:
+        """Return the bytes held privately by the store.
+
+        Memory mapped embeddings live in the page cache, which is shared and can be
+        reclaimed, so only embeddings copied into memory are counted.
+        """
+        footprint = sum(len(node_id) for node_id in self._node_ids)
+        footprint += sum(len(ref_doc_id) for ref_doc_id in self._ref_doc_ids)
+        if self._ann_index is not None:
+            footprint += self._ann_index.centroids.nbytes + self._ann_index.order.nbytes
+        if self._embeddings is not None and not self.is_memory_mapped:
+            footprint += self._embeddings.nbytes
+        return footprint
+
+    def add(self, embedding_results: List[NodeWithEmbedding]) -> List[str]:
+        if not embedding_results:
+            return []
+        new_embeddings = np.asarray(
+            [result.embedding for result in embedding_results], dtype=np.float32
+        )
+        if self._embeddings is None:
+            self._embeddings = new_embeddings
+        else:
+            self._embeddings = np.concatenate([self._embeddings, new_embeddings])
+        self._norms = None
+        self._ann_index = None
+        self._node_ids.extend(result.id for result in embedding_results)
+        self._ref_doc_ids.extend(result.ref_doc_id for result in embedding_results)
+        return [result.id for result in embedding_results]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        keep = [i for i, id_ in enumerate(self._ref_doc_ids) if id_ != ref_doc_id]
+        if len(keep) == len(self._ref_doc_ids):
+            return
+        self._embeddings = np.array(self._embeddings[keep]) if keep else None
+        self._norms = None
+        self._ann_index = None
+        self._node_ids = [self._node_ids[i] for i in keep]
+        self._ref_doc_ids = [self._ref_doc_ids[i] for i in keep]
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.filters is not None:
+            raise ValueError(
+                "Metadata filters not implemented for MemmapVectorStore yet."
+            )
+        if self._embeddings is None:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        rows = self._get_rows(query.node_ids) if query.node_ids else None
+        if query.mode == VectorStoreQueryMode.DEFAULT:
+            return self.query_batch(
+                [query.query_embedding], query.similarity_top_k, rows=rows
+            )[0]
+
+        embeddings, node_ids = self._embeddings, self._node_ids
+        if rows is not None:
+            embeddings = self._embeddings[rows]
+            node_ids = [self._node_ids[i] for i in rows]
+
+        if query.mode == VectorStoreQueryMode.MMR:
+            top_similarities, top_ids = get_top_k_mmr_embeddings(
+                query.query_embedding,
+                embeddings.tolist(),
+                similarity_top_k=query.similarity_top_k,
+                embedding_ids=node_ids,
+                mmr_threshold=kwargs.get("mmr_threshold", None),
+            )
+        elif query.mode in [
+            VectorStoreQueryMode.SVM,
+            VectorStoreQueryMode.LINEAR_REGRESSION,
+            VectorStoreQueryMode.LOGISTIC_REGRESSION,
+        ]:
+            top_similarities, top_ids = get_top_k_embeddings_learner(
+                query.query_embedding,
+                embeddings.tolist(),
+                similarity_top_k=query.similarity_top_k,
+                embedding_ids=node_ids,
+            )
+        else:
+            raise ValueError(f"Invalid query mode: {query.mode}")
+        return VectorStoreQueryResult(similarities=top_similarities, ids=top_ids)
+
+    def query_batch(
+        self,
+        query_embeddings: list[list[float]],
+        similarity_top_k: int,
+        rows: list[int] | None = None,
+    ) -> list[VectorStoreQueryResult]:
+        """Return the most similar nodes of every query, scored by cosine similarity.
+
+        All queries are scored with a single matrix product. Restrict the search to
+        some rows of the store by passing their positions. Unrestricted queries use
+        the approximate index when the store has one.
+        """
+        if self._embeddings is None or not query_embeddings or rows == []:
+            return [
+                VectorStoreQueryResult(similarities=[], ids=[])
+                for _ in query_embeddings
+            ]
+        if rows is None and self._ann_index is not None:
+            return self._query_ann(query_embeddings, similarity_top_k)
+        embeddings, norms = self._embeddings, self._get_norms()
+        if rows is not None:
+            embeddings, norms = embeddings[rows], norms[rows]
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        query_norms = np.linalg.norm(queries, axis=1)
+        denominators = np.outer(norms, query_norms)
+        scores = (embeddings @ queries.T) / np.where(denominators == 0, 1, denominators)
+
+        results = []
+        for column in range(scores.shape[1]):
+            top_rows = self.get_top_k_rows(scores[:, column], similarity_top_k)
+            if rows is not None:
+                node_ids = [self._node_ids[rows[i]] for i in top_rows]
+            else:
+                node_ids = [self._node_ids[i] for i in top_rows]
+            results.append(
+                VectorStoreQueryResult(
+                    similarities=scores[top_rows, column].tolist(), ids=node_ids
+                )
+            )
+        return results
+
+    def _query_ann(
+        self, query_embeddings: list[list[float]], similarity_top_k: int
+    ) -> list[VectorStoreQueryResult]:
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        norms = self._get_norms()
+        candidates = self._ann_index.get_candidates(queries, self.ann_probes)
+        results = []
+        for query, rows in zip(queries, candidates):
+            denominators = norms[rows] * np.linalg.norm(query)
+            scores = (self._embeddings[rows] @ query) / np.where(
+                denominators == 0, 1, denominators
+            )
+            top = self.get_top_k_rows(scores, similarity_top_k)
+            results.append(
+                VectorStoreQueryResult(
+                    similarities=scores[top].tolist(),
+                    ids=[self._node_ids[rows[i]] for i in top],
+                )
+            )
+        return results
+
+    @staticmethod
+    def get_top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+        """Return the positions of the k highest scores, highest first, in O(n + k log k)."""
+        if k >= len(scores):
+            return np.argsort(-scores, kind="stable")
+        top_rows = np.argpartition(-scores, k - 1)[:k]
+        return top_rows[np.argsort(-scores[top_rows], kind="stable")]
+
+    def _get_rows(self, node_ids: list[str]) -> list[int]:
+        available_ids = set(node_ids)
+        return [i for i, id_ in enumerate(self._node_ids) if id_ in available_ids]
+
+    def _get_norms(self) -> np.ndarray:
+        """Return the norms of all embeddings, computed once per set of embeddings."""
+        if self._norms is None:
+            self._norms = np.linalg.norm(self._embeddings, axis=1)
+        return self._norms
+
+    def persist(
+        self,
+        persist_path: str,
+        fs: Optional[fsspec.AbstractFileSystem] = None,
+    ) -> None:
+        """Write the embeddings matrix and the metadata sidecar."""
+        dirpath = os.path.dirname(persist_path)
+        if not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        unique_ref_doc_ids = list(dict.fromkeys(self._ref_doc_ids))
+        ref_doc_positions = {id_: i for i, id_ in enumerate(unique_ref_doc_ids)}
+        metadata = {
+            "node_ids": self._node_ids,
+            "ref_doc_ids": unique_ref_doc_ids,
+            "ref_doc_index": [ref_doc_positions[id_] for id_ in self._ref_doc_ids],
+        }
+        embeddings = self._embeddings
+        if embeddings is None:
+            embeddings = np.zeros((0, 0), dtype=np.float32)
+        np.save(
+            self.get_embeddings_path(persist_path),
+            np.ascontiguousarray(embeddings, dtype=np.float32),
+            allow_pickle=False,
+        )
+        ann_index_path = self.get_ann_index_path(persist_path)
+        if self._ann_index is not None:
+            self._ann_index.save(ann_index_path)
+        elif os.path.exists(ann_index_path):
+            os.remove(ann_index_path)
+        with open(persist_path, "w") as f:
+            json.dump(metadata, f)
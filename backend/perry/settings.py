@@ -0,0 +1,58 @@
+from enum import Enum
+from functools import lru_cache
+from pydantic import BaseSettings, confloat, conint
+
+
+class EmbeddingBackend(str, Enum):
+    openai = "openai"
+    local = "local"
+
+
+class SqliteJournalMode(str, Enum):
+    delete = "delete"
+    truncate = "truncate"
+    persist = "persist"
+    memory = "memory"
+    wal = "wal"
+    off = "off"
+
+
+class SqliteSynchronous(str, Enum):
+    off = "off"
+    normal = "normal"
+    full = "full"
+    extra = "extra"
+
+
+class Settings(BaseSettings):
+    """Server settings, read from environment variables prefixed with PERRY_."""
+
+    parse_workers: conint(ge=1) | None = None
+    parse_pages_per_task: conint(ge=1) = 25
+    indexing_workers: conint(ge=1) = 2
+    agent_memory_budget_mb: conint(ge=0) = 2048
+    ann_min_nodes: conint(ge=1) = 5000
+    ann_lists: conint(ge=1) | None = None
+    answer_cache_similarity: confloat(ge=0.0, le=1.0) = 0.95
+    answer_cache_ttl_seconds: conint(ge=1) = 3600
+    answer_cache_max_entries: conint(ge=1) = 1000
+    llm_cache: bool = True
+    embedding_backend: EmbeddingBackend = EmbeddingBackend.openai
+    embed_batch_size: conint(ge=1) = 100
+    local_embedding_dim: conint(ge=8) = 512
+    db_journal_mode: SqliteJournalMode = SqliteJournalMode.wal
+    db_synchronous: SqliteSynchronous = SqliteSynchronous.normal
+    db_mmap_size_mb: conint(ge=0) = 256
+    db_busy_timeout_ms: conint(ge=0) = 5000
+    db_pool_size: conint(ge=1) = 10
+    db_max_overflow: conint(ge=0) = 40
+    db_pool_timeout_seconds: confloat(gt=0.0) = 30.0
+
+    class Config:
+        env_prefix = "PERRY_"
+        env_file = ".env"
+
+
+@lru_cache
+def get_settings() -> Settings:
+    return Settings()
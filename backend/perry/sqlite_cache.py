@@ -0,0 +1,45 @@
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Iterator
+
+
+class SqliteCache:
+    """Base of the persistent caches stored in a SQLite file.
+
+    Subclasses set the store path and the statements creating their tables. The
+    connection is opened, and the tables created, on first use of the store path. It
+    is shared between threads, which use it one transaction at a time.
+    """
+
+    _store_path: Path
+    _schema: tuple[str, ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._lock = Lock()
+        cls._connection: sqlite3.Connection | None = None
+        cls._connection_path: Path | None = None
+
+    @classmethod
+    @contextmanager
+    def _connect(cls) -> Iterator[sqlite3.Connection]:
+        """Use the cache in a transaction committed when the block exits."""
+        with cls._lock:
+            if cls._connection is None or cls._connection_path != cls._store_path:
+                cls._open()
+            with cls._connection:
+                yield cls._connection
+
+    @classmethod
+    def _open(cls):
+        if cls._connection is not None:
+            cls._connection.close()
+        cls._store_path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(cls._store_path, check_same_thread=False)
+        with connection:
+            for statement in cls._schema:
+                connection.execute(statement)
+        cls._connection = connection
+        cls._connection_path = cls._store_path
@@ -0,0 +1,81 @@
+import json
+import time
+import click
+import numpy as np
+from llama_index.schema import TextNode
+from llama_index.vector_stores.types import NodeWithEmbedding
+from perry.indexing.vector_store import MemmapVectorStore
+
+
+def generate_embeddings(
+    count: int, dim: int, clusters: int, rng: np.random.Generator
+) -> np.ndarray:
+    """Generate embeddings grouped around random topics, like chunks of a document."""
+    topics = rng.normal(scale=0.5, size=(clusters, dim))
+    assignments = rng.integers(clusters, size=count)
+    return topics[assignments] + rng.normal(size=(count, dim))
+
+
+def time_queries(store: MemmapVectorStore, queries: list[list[float]], top_k: int):
+    start = time.perf_counter()
+    results = [store.query_batch([query], top_k)[0] for query in queries]
+    return results, (time.perf_counter() - start) / len(queries)
+
+
+@click.command()
+@click.option("--nodes", default=50000, help="Embeddings in the store.")
+@click.option("--dim", default=1536, help="Dimension of the embeddings.")
+@click.option("--queries", "query_count", default=100, help="Queries to run.")
+@click.option("--top-k", default=10, help="Results per query.")
+@click.option("--lists", default=None, type=int, help="IVF clusters.")
+@click.option(
+    "--probes", default="1,2,4,8,16,32", help="Comma separated probe counts to test."
+)
+@click.option("--seed", default=0, help="Seed of the generated embeddings.")
+def benchmark_ann(nodes, dim, query_count, top_k, lists, probes, seed):
+    """Report recall@k and latency of IVF search against exact search."""
+    rng = np.random.default_rng(seed)
+    embeddings = generate_embeddings(nodes, dim, max(1, nodes // 100), rng)
+    store = MemmapVectorStore()
+    store.add(
+        [
+            NodeWithEmbedding(node=TextNode(text="", id_=str(i)), embedding=embedding)
+            for i, embedding in enumerate(embeddings.tolist())
+        ]
+    )
+    queries = (
+        embeddings[rng.integers(nodes, size=query_count)]
+        + rng.normal(size=(query_count, dim))
+    ).tolist()
+
+    exact, exact_latency = time_queries(store, queries, top_k)
+    start = time.perf_counter()
+    store.build_ann_index(lists)
+    build_seconds = time.perf_counter() - start
+
+    report = {
+        "nodes": nodes,
+        "dim": dim,
+        "top_k": top_k,
+        "lists": store._ann_index.n_lists,
+        "build_seconds": build_seconds,
+        "exact_ms": exact_latency * 1000,
+        "ann": [],
+    }
+    for probe_count in [int(probe) for probe in probes.split(",")]:
+        store.ann_probes = probe_count
+        approximate, latency = time_queries(store, queries, top_k)
+        recall = np.mean(
+            [
+                len(set(result.ids) & set(expected.ids)) / len(expected.ids)
+                for result, expected in zip(approximate, exact)
+            ]
+        )
+        report["ann"].append(
+            {"probes": probe_count, "recall": recall, "ms": latency * 1000}
+        )
+    click.echo(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    benchmark_ann()
@@ -0,0 +1,99 @@
+import json
+import time
+from contextlib import contextmanager
+import click
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from perry.api.endpoints.conversation import conversation_db_to_info
+from perry.db.models import Agent, Base, Conversation, Document, User
+from perry.db.operations.conversations import read_user_conversations
+from perry.db.operations.users import get_user
+
+
+def seed_conversations(db, conversations: int, documents: int) -> int:
+    """Add a user with conversations of an agent and documents, returning its id."""
+    user = User(username="benchmark")
+    db.add(user)
+    for i in range(conversations):
+        db.add(
+            Conversation(
+                name=f"Conversation {i}",
+                user=user,
+                agent=Agent(type="SubquestionAgent", config={}),
+                documents=[Document(title=f"Document {j}") for j in range(documents)],
+            )
+        )
+    db.commit()
+    return user.id
+
+
+@contextmanager
+def count_queries(engine):
+    statements = []
+    record = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def list_lazily(db, user_id: int):
+    return [conversation_db_to_info(c) for c in get_user(db, user_id).conversations]
+
+
+def list_eagerly(db, user_id: int):
+    return [conversation_db_to_info(c) for c in read_user_conversations(db, user_id)]
+
+
+STRATEGIES = {"lazy": list_lazily, "eager": list_eagerly}
+
+
+def measure(engine, user_id: int, strategy: str) -> dict:
+    db = sessionmaker(bind=engine)()
+    try:
+        with count_queries(engine) as statements:
+            start = time.perf_counter()
+            STRATEGIES[strategy](db, user_id)
+            duration = time.perf_counter() - start
+    finally:
+        db.close()
+    return {"queries": len(statements), "ms": duration * 1000}
+
+
+@click.command()
+@click.option(
+    "--conversations",
+    default="1,10,100,1000",
+    help="Comma separated conversation counts of the user.",
+)
+@click.option("--documents", default=3, help="Documents of every conversation.")
+def benchmark_conversation_queries(conversations, documents):
+    """Report the queries and time of listing the conversations of a user.
+
+    The lazy strategy reads the conversations of the user and loads the agent and
+    documents of each on access, as the endpoint did before. The eager strategy
+    loads them up front with read_user_conversations.
+    """
+    levels = []
+    for count in [int(count) for count in conversations.split(",")]:
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        seed_db = sessionmaker(bind=engine)()
+        user_id = seed_conversations(seed_db, count, documents)
+        seed_db.close()
+        levels.append(
+            {
+                "conversations": count,
+                **{
+                    strategy: measure(engine, user_id, strategy)
+                    for strategy in STRATEGIES
+                },
+            }
+        )
+        engine.dispose()
+    click.echo(json.dumps({"documents": documents, "levels": levels}, indent=2))
+
+
+if __name__ == "__main__":
+    benchmark_conversation_queries()
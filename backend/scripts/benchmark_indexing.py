@@ -0,0 +1,163 @@
+import json
+import random
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+import click
+from fpdf import FPDF
+from llama_index import VectorStoreIndex
+from llama_index.schema import MetadataMode
+from llama_index.tools import QueryEngineTool, ToolMetadata
+from perry.agents.fake_models import FakeQuestionGenerator
+from perry.agents.query_engine import BatchedSubQuestionQueryEngine
+from perry.agents.subquestion import SubquestionAgent, SubquestionConfig
+from perry.indexing.parsing import PdfParser
+from perry.indexing.store import IndexStore
+from perry.settings import get_settings
+
+WORDS = (
+    "revenue growth costs risk market results quarter analysis demand supply "
+    "currency personnel materials board expects forecast margin profit loss "
+    "investment customers products region sales operations guidance outlook"
+).split()
+STAGES = ["parse", "group", "chunk", "embed", "build", "persist", "load", "engine"]
+
+
+def generate_corpus(directory: Path, documents: int, pages: int, seed: int):
+    """Write PDFs of random sentences, returning their paths keyed by document id."""
+    rng = random.Random(seed)
+    file_paths = {}
+    for doc_id in range(documents):
+        pdf = FPDF()
+        pdf.set_font("Arial", size=11)
+        for _ in range(pages):
+            pdf.add_page()
+            for _ in range(12):
+                sentence = " ".join(rng.choices(WORDS, k=rng.randint(30, 60)))
+                pdf.multi_cell(0, 5, sentence.capitalize() + ".")
+        file_paths[doc_id] = Path(directory, f"{doc_id}.pdf")
+        pdf.output(str(file_paths[doc_id]))
+    return file_paths
+
+
+def run_pipeline(file_paths: dict[int, Path], config: SubquestionConfig) -> dict:
+    """Build the engine of the corpus like an agent does, timing every stage."""
+    timings = dict.fromkeys(STAGES, 0.0)
+
+    @contextmanager
+    def timed(stage: str):
+        start = time.perf_counter()
+        yield
+        timings[stage] += time.perf_counter() - start
+
+    service_context = SubquestionAgent._get_new_service_context(
+        SubquestionAgent._get_new_model(config),
+        SubquestionAgent._get_new_embed_model(config),
+    )
+    parser = PdfParser()
+    with timed("parse"):
+        tasks, results = parser._extract_pages(file_paths)
+    with timed("group"):
+        doc_sets = parser._group_pages(file_paths, tasks, results)
+
+    indexes = {}
+    node_count = 0
+    for doc_id, doc_set in doc_sets.items():
+        with timed("chunk"):
+            nodes = service_context.node_parser.get_nodes_from_documents(doc_set)
+        with timed("embed"):
+            embed_model = service_context.embed_model
+            for node in nodes:
+                embed_model.queue_text_for_embedding(
+                    node.node_id, node.get_content(metadata_mode=MetadataMode.EMBED)
+                )
+            node_ids, embeddings = embed_model.get_queued_text_embeddings()
+            embeddings_by_id = dict(zip(node_ids, embeddings))
+            for node in nodes:
+                node.embedding = embeddings_by_id[node.node_id]
+        with timed("build"):
+            index = VectorStoreIndex(
+                nodes,
+                service_context=service_context,
+                storage_context=IndexStore.new_storage_context(),
+            )
+            vector_store = SubquestionAgent._get_large_vector_store(index)
+            if vector_store is not None:
+                vector_store.build_ann_index(get_settings().ann_lists)
+        key = f"benchmark-{doc_id}"
+        with timed("persist"):
+            IndexStore._persist(key, index)
+        with timed("load"):
+            indexes[doc_id] = IndexStore.load(key, service_context)
+        node_count += len(nodes)
+
+    with timed("engine"):
+        tools = [
+            QueryEngineTool(
+                query_engine=index.as_query_engine(service_context=service_context),
+                metadata=ToolMetadata(name=str(doc_id), description=f"Report {doc_id}"),
+            )
+            for doc_id, index in indexes.items()
+        ]
+        BatchedSubQuestionQueryEngine.from_defaults(
+            query_engine_tools=tools,
+            service_context=service_context,
+            question_gen=FakeQuestionGenerator(service_context.llm),
+            max_concurrency=config.max_concurrent_sub_questions,
+            tool_timeout=config.sub_question_timeout,
+        )
+    return {"nodes": node_count, "timings": timings}
+
+
+@click.command()
+@click.option("--documents", default=4, help="Generated PDFs in the corpus.")
+@click.option("--pages", default=20, help="Pages of every generated PDF.")
+@click.option("--repeat", default=3, help="Runs of the pipeline to average.")
+@click.option(
+    "--embedding-latency-ms", default=0.0, help="Fake embedding latency per request."
+)
+@click.option("--seed", default=0, help="Seed of the generated corpus.")
+def benchmark_indexing(documents, pages, repeat, embedding_latency_ms, seed):
+    """Report the time spent in every stage of building a subquestion agent engine.
+
+    Documents are embedded by the fake embedding model of the given latency, so the
+    embedding stage shows the cost of the pipeline around a remote model rather
+    than the model itself. A first run starting the parser processes is not
+    counted.
+    """
+    config = SubquestionConfig(
+        name="Benchmark",
+        model_provider="fake",
+        fake_embedding_latency_ms=embedding_latency_ms,
+    )
+    with tempfile.TemporaryDirectory() as work_dir:
+        file_paths = generate_corpus(Path(work_dir), documents, pages, seed)
+        IndexStore._store_path = Path(work_dir, "indexes")
+        run_pipeline(file_paths, config)
+        runs = [run_pipeline(file_paths, config) for _ in range(repeat)]
+    PdfParser.shutdown()
+
+    total = sum(sum(run["timings"].values()) for run in runs) / repeat
+    report = {
+        "documents": documents,
+        "pages": pages,
+        "nodes": runs[0]["nodes"],
+        "repeat": repeat,
+        "total_ms": total * 1000,
+        "stages": {
+            stage: {
+                "mean_ms": statistics.mean(run["timings"][stage] for run in runs)
+                * 1000,
+                "min_ms": min(run["timings"][stage] for run in runs) * 1000,
+                "share": statistics.mean(run["timings"][stage] for run in runs) / total,
+            }
+            for stage in STAGES
+        },
+    }
+    click.echo(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    benchmark_indexing()
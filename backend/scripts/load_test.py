@@ -0,0 +1,355 @@
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+import click
+import httpx
+import numpy as np
+from fpdf import FPDF
+
+OPERATION_WEIGHTS = {
+    "login": 5,
+    "upload": 5,
+    "create_conversation": 5,
+    "list_conversations": 10,
+    "message_history": 25,
+    "query": 35,
+    "stream_query": 15,
+}
+QUERIES = [
+    "How did revenue develop compared with last year?",
+    "What are the main risks mentioned?",
+    "Summarize the results of the quarter.",
+    "Which costs increased the most?",
+]
+PARAGRAPHS = [
+    "Revenue grew in the third quarter as demand in the core market increased.",
+    "Costs of materials rose, while personnel costs stayed flat compared with "
+    "the previous year.",
+    "The main risks are currency fluctuations and delays at suppliers.",
+    "The board expects growth to continue next year at a slower pace.",
+]
+
+
+@dataclass
+class EndpointStats:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+
+
+@dataclass
+class User:
+    username: str
+    password: str
+    headers: dict[str, str]
+    conversation_ids: list[int]
+
+
+def generate_pdf(pages: int, rng: random.Random) -> bytes:
+    pdf = FPDF()
+    pdf.set_font("Arial", size=12)
+    for _ in range(pages):
+        pdf.add_page()
+        for _ in range(20):
+            pdf.multi_cell(0, 6, rng.choice(PARAGRAPHS))
+    return pdf.output(dest="S").encode("latin-1")
+
+
+class LoadTest:
+    """Drive the API in-process with a weighted mix of user operations.
+
+    Every operation is timed per endpoint, so one operation may time several
+    endpoints, such as an upload followed by removing the document to stay within
+    the document limit of a user.
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        agent_settings: dict,
+        pdf_pages: int,
+        seed: int,
+    ):
+        self.client = client
+        self.agent_settings = agent_settings
+        self.pdf_pages = pdf_pages
+        self.rng = random.Random(seed)
+        self.stats: dict[str, EndpointStats] = {}
+
+    async def request(self, endpoint: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        response = await self.client.request(method, url, **kwargs)
+        stats = self.stats.setdefault(endpoint, EndpointStats())
+        stats.latencies.append(time.perf_counter() - start)
+        if response.is_error or b"event: error" in response.content:
+            stats.errors += 1
+        return response
+
+    async def seed_user(self, index: int) -> User:
+        username, password = f"load-test-{index}", "password"
+        await self.client.post(
+            "/users/register", json={"username": username, "password": password}
+        )
+        user = User(username, password, {}, [])
+        await self.login(user)
+        await self.upload(user)
+        user.conversation_ids.append(await self.create_conversation(user))
+        await self.wait_for_indexing(user, user.conversation_ids[0])
+        return user
+
+    async def wait_for_indexing(self, user: User, conversation_id: int):
+        while True:
+            response = await self.client.get(
+                f"/conversations/{conversation_id}/status", headers=user.headers
+            )
+            status = response.json()["status"]
+            if status == "failed":
+                raise click.ClickException(response.json()["error"])
+            if status == "completed":
+                return
+            await asyncio.sleep(0.1)
+
+    async def login(self, user: User):
+        response = await self.request(
+            "POST /users/token",
+            "POST",
+            "/users/token",
+            data={"username": user.username, "password": user.password},
+        )
+        user.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def upload(self, user: User) -> int:
+        response = await self.request(
+            "POST /documents/file",
+            "POST",
+            "/documents/file/",
+            files={
+                "file": (
+                    "report.pdf",
+                    generate_pdf(self.pdf_pages, self.rng),
+                    "application/pdf",
+                )
+            },
+            headers=user.headers,
+        )
+        return response.json()["id"]
+
+    async def create_conversation(self, user: User) -> int:
+        documents = await self.client.get("/documents/info/", headers=user.headers)
+        response = await self.request(
+            "POST /conversations",
+            "POST",
+            "/conversations/",
+            json={
+                "name": "Load test",
+                "agent_type": "SubquestionAgent",
+                "agent_settings": self.agent_settings,
+                "doc_ids": [document["id"] for document in documents.json()],
+            },
+            headers=user.headers,
+        )
+        return response.json()
+
+    async def run_operation(self, operation: str, user: User):
+        conversation_id = self.rng.choice(user.conversation_ids)
+        if operation == "login":
+            await self.login(user)
+        elif operation == "upload":
+            document_id = await self.upload(user)
+            await self.request(
+                "DELETE /documents/file/{id}",
+                "DELETE",
+                f"/documents/file/{document_id}",
+                headers=user.headers,
+            )
+        elif operation == "create_conversation":
+            await self.create_conversation(user)
+        elif operation == "list_conversations":
+            await self.request(
+                "GET /conversations", "GET", "/conversations/", headers=user.headers
+            )
+        elif operation == "message_history":
+            await self.request(
+                "GET /conversations/{id}/messages",
+                "GET",
+                f"/conversations/{conversation_id}/messages",
+                headers=user.headers,
+            )
+        elif operation == "query":
+            await self.request(
+                "POST /conversations/{id}",
+                "POST",
+                f"/conversations/{conversation_id}",
+                json={"query": self.rng.choice(QUERIES)},
+                headers=user.headers,
+            )
+        elif operation == "stream_query":
+            await self.request(
+                "POST /conversations/{id}/stream",
+                "POST",
+                f"/conversations/{conversation_id}/stream",
+                json={"query": self.rng.choice(QUERIES)},
+                headers=user.headers,
+            )
+
+    async def run_level(
+        self, users: list[User], concurrency: int, request_count: int
+    ) -> dict:
+        """Run request_count operations with concurrency clients at a time."""
+        self.stats = {}
+        operations = self.rng.choices(
+            list(OPERATION_WEIGHTS.keys()),
+            weights=list(OPERATION_WEIGHTS.values()),
+            k=request_count,
+        )
+        queue = asyncio.Queue()
+        for operation in operations:
+            queue.put_nowait(operation)
+
+        async def client_loop(user: User):
+            while not queue.empty():
+                await self.run_operation(queue.get_nowait(), user)
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(client_loop(users[i % len(users)]) for i in range(concurrency))
+        )
+        duration = time.perf_counter() - start
+        return {
+            "concurrency": concurrency,
+            "operations": request_count,
+            "seconds": duration,
+            "endpoints": {
+                endpoint: self.summarize(stats, duration)
+                for endpoint, stats in sorted(self.stats.items())
+            },
+        }
+
+    @staticmethod
+    def summarize(stats: EndpointStats, duration: float) -> dict:
+        p50, p95, p99 = np.percentile(np.array(stats.latencies) * 1000, [50, 95, 99])
+        return {
+            "requests": len(stats.latencies),
+            "errors": stats.errors,
+            "requests_per_second": len(stats.latencies) / duration,
+            "p50_ms": p50,
+            "p95_ms": p95,
+            "p99_ms": p99,
+        }
+
+
+async def run_load_test(
+    users: int,
+    levels: list[int],
+    request_count: int,
+    agent_settings: dict,
+    pdf_pages: int,
+    seed: int,
+) -> dict:
+    from perry.api.app import app
+    from perry.db.session import DatabaseSessionManager
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), httpx.AsyncClient(
+        transport=transport, base_url="http://load-test", timeout=None
+    ) as client:
+        load_test = LoadTest(client, agent_settings, pdf_pages, seed)
+        seeded_users = [await load_test.seed_user(i) for i in range(users)]
+        report = {
+            "users": users,
+            "agent_settings": agent_settings,
+            "levels": [
+                await load_test.run_level(seeded_users, concurrency, request_count)
+                for concurrency in levels
+            ],
+        }
+    await DatabaseSessionManager.get_async_engine().dispose()
+    return report
+
+
+@click.command()
+@click.option("--users", default=4, help="Users seeded with a document and agent.")
+@click.option(
+    "--concurrency", default="1,4,16", help="Comma separated concurrent clients."
+)
+@click.option("--requests", "request_count", default=200, help="Operations per level.")
+@click.option("--pdf-pages", default=2, help="Pages of each generated PDF.")
+@click.option("--latency-ms", default=500.0, help="Median fake LLM latency.")
+@click.option(
+    "--latency-distribution",
+    default="lognormal",
+    type=click.Choice(["constant", "uniform", "lognormal"]),
+)
+@click.option("--tokens-per-second", default=50.0, help="Fake LLM token rate.")
+@click.option("--embedding-latency-ms", default=20.0, help="Fake embedding latency.")
+@click.option("--seed", default=0, help="Seed of the operation mix and documents.")
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, resolve_path=True),
+    help="JSON report file.",
+)
+def load_test(
+    users,
+    concurrency,
+    request_count,
+    pdf_pages,
+    latency_ms,
+    latency_distribution,
+    tokens_per_second,
+    embedding_latency_ms,
+    seed,
+    output,
+):
+    """Report latency percentiles and throughput per endpoint under load.
+
+    The app runs in-process with subquestion agents on the fake model provider, a
+    fresh database and temporary file storage and caches, so nothing leaves the
+    machine and existing data is left alone.
+    """
+    os.environ.setdefault("PERRY_EMBEDDING_BACKEND", "local")
+    from perry.db.session import DatabaseSessionManager
+    import perry.db.operations.documents as documents
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        storage_path = Path(work_dir, "files")
+        storage_path.mkdir()
+        documents.get_file_storage_path = lambda: storage_path
+        DatabaseSessionManager._db_name = "load_test"
+        DatabaseSessionManager._db_directory = Path(work_dir)
+        engine = DatabaseSessionManager.get_engine()
+        try:
+            report = asyncio.run(
+                run_load_test(
+                    users,
+                    [int(level) for level in concurrency.split(",")],
+                    request_count,
+                    {
+                        "name": "Load test",
+                        "model_provider": "fake",
+                        "fake_latency_ms": latency_ms,
+                        "fake_latency_distribution": latency_distribution,
+                        "fake_tokens_per_second": tokens_per_second,
+                        "fake_embedding_latency_ms": embedding_latency_ms,
+                    },
+                    pdf_pages,
+                    seed,
+                )
+            )
+        finally:
+            engine.dispose()
+            os.chdir(cwd)
+
+    report_json = json.dumps(report, indent=2)
+    if output:
+        Path(output).write_text(report_json)
+    click.echo(report_json)
+
+
+if __name__ == "__main__":
+    load_test()
@@ -11,7 +11,7 @@ from sqlalchemy.orm.session import Session
 from fpdf import FPDF
 from pathlib import Path
 from perry.db.operations.documents import update_document
-from perry.agents.base import BaseAgent, BaseAgentConfig
+from perry.agents.base import AgentEvent, AgentEventType, BaseAgent, BaseAgentConfig
 
 
 class DummyAgent(BaseAgent):
@@ -52,12 +52,17 @@ def create_mock_service_context(*args, **kwargs):
 
 class MockSubQuestionQueryEngine:
     @classmethod
-    def from_defaults(cls, query_engine_tools, service_context):
+    def from_defaults(cls, query_engine_tools, service_context, **kwargs):
         return cls()
 
     async def aquery(self, *args, **kwargs):
         return "Mocked aquery result"
 
+    async def astream(self, *args, **kwargs):
+        yield AgentEvent(type=AgentEventType.progress, content="Mocked progress")
+        for token in ["Mocked ", "aquery ", "result"]:
+            yield AgentEvent(type=AgentEventType.token, content=token)
+
 
 @pytest.fixture(scope="function", autouse=True)
 def mock_subquestion_agent_service_context(monkeypatch):
@@ -66,7 +71,8 @@ def mock_subquestion_agent_service_context(monkeypatch):
         create_mock_service_context,
     )
     monkeypatch.setattr(
-        "perry.agents.subquestion.SubQuestionQueryEngine", MockSubQuestionQueryEngine
+        "perry.agents.subquestion.BatchedSubQuestionQueryEngine",
+        MockSubQuestionQueryEngine,
     )
 
 
@@ -102,7 +108,6 @@ def create_subquestion_agent(
 
     def _create_agent():
         agent_id, conversation_id = add_connected_agent_conversation_to_db()
-        monkeypatch.setattr(SubquestionAgent, "_cache_path", tmp_path)
         agent = SubquestionAgent(
             test_db,
             get_subquestion_config(),
@@ -138,7 +143,6 @@ def create_subquestion_agent_with_documents(
             get_subquestion_config(),
             agent_id,
         )
-        monkeypatch.setattr(SubquestionAgent, "_cache_path", tmp_path)
         return agent, document_ids, file_paths
 
     return _create_subquestion_agent_with_documents
@@ -1,7 +1,6 @@
 import pytest
-from unittest.mock import PropertyMock
 from perry.agents.echo import EchoAgent
-from perry.agents.base import BaseAgentConfig, BaseAgent
+from perry.agents.base import AgentEventType, BaseAgentConfig, BaseAgent
 from perry.agents.subquestion import SubquestionAgent, SubquestionConfig
 from perry.db.operations.agents import update_agent
 from tests.agents.fixtures import *
@@ -74,6 +73,60 @@ def test_load_should_raise_value_error_when_agent_not_connected_to_conversation(
         agent_class.load(test_db, agent_id)
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("agent_class, config", agents_to_test)
+async def test_agent_query_stream_tokens_join_to_query_response(
+    test_db, agent_class, config, add_agent_to_db, add_conversation_to_db
+):
+    agent_id = add_agent_to_db()
+    conversation_id = add_conversation_to_db()
+    update_agent(test_db, agent_id, conversation_id=conversation_id)
+    agent_instance = agent_class(test_db, config, agent_id)
+
+    events = [event async for event in agent_instance.query_stream("test query")]
+
+    tokens = [event.content for event in events if event.type == AgentEventType.token]
+    assert "".join(tokens) == await agent_instance.query("test query")
+
+
+@pytest.mark.asyncio
+async def test_agent_is_busy_until_stream_ends(
+    test_db, add_agent_to_db, add_conversation_to_db
+):
+    agent_id = add_agent_to_db()
+    conversation_id = add_conversation_to_db()
+    update_agent(test_db, agent_id, conversation_id=conversation_id)
+    agent_instance = EchoAgent(test_db, BaseAgentConfig(name="echo").dict(), agent_id)
+
+    stream = agent_instance.query_stream("several words here")
+    await stream.__anext__()
+    assert agent_instance.busy
+    async for _ in stream:
+        pass
+    assert not agent_instance.busy
+
+
+@pytest.mark.asyncio
+async def test_agent_is_busy_until_overlapping_streams_end(
+    test_db, add_agent_to_db, add_conversation_to_db
+):
+    agent_id = add_agent_to_db()
+    conversation_id = add_conversation_to_db()
+    update_agent(test_db, agent_id, conversation_id=conversation_id)
+    agent_instance = EchoAgent(test_db, BaseAgentConfig(name="echo").dict(), agent_id)
+
+    first = agent_instance.query_stream("several words here")
+    second = agent_instance.query_stream("several words here")
+    await first.__anext__()
+    await second.__anext__()
+    async for _ in first:
+        pass
+    assert agent_instance.busy
+    async for _ in second:
+        pass
+    assert not agent_instance.busy
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("agent_class, config", agents_to_test)
 async def test_busy_toggle_decorator_is_called(
@@ -83,23 +136,22 @@ async def test_busy_toggle_decorator_is_called(
     conversation_id = add_conversation_to_db()
     update_agent(test_db, agent_id, conversation_id=conversation_id)
 
+    busy_during_calls = []
+
     async def mock_query(self, query):
+        busy_during_calls.append(self.busy)
         return "test response"
 
-    mock_busy = PropertyMock(return_value=False)
-    agent_class.busy = mock_busy
-    agent_class._on_query = mock_query
-    agent_class._on_save = lambda self: None
+    monkeypatch.setattr(agent_class, "_on_query", mock_query)
+    monkeypatch.setattr(
+        agent_class, "_on_save", lambda self: busy_during_calls.append(self.busy)
+    )
 
     agent_instance = agent_class(test_db, config, agent_id)
-    mock_busy.call_count == 3
-
-    mock_busy.reset_mock()
+    assert not agent_instance.busy
 
     agent_instance.save()
-    assert mock_busy.call_count == 2
-
-    mock_busy.reset_mock()
-
     await agent_instance.query("test query")
-    assert mock_busy.call_count == 2
+
+    assert busy_during_calls == [True, True]
+    assert not agent_instance.busy
@@ -0,0 +1,93 @@
+import pytest
+from perry.agents.cache import AnswerCache
+from perry.agents.echo import EchoAgent
+from perry.agents.base import AgentEventType, BaseAgentConfig
+from perry.db.operations.agents import update_agent
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    AnswerCache.reset()
+    monkeypatch.setattr(AnswerCache, "_similarity_threshold", 0.9)
+    monkeypatch.setattr(AnswerCache, "_ttl", 60)
+    monkeypatch.setattr(AnswerCache, "_max_entries", 3)
+    yield AnswerCache()
+    AnswerCache.reset()
+
+
+def test_similar_query_hits_and_dissimilar_query_misses(cache):
+    cache.put("docs", [1.0, 0.0], "answer")
+
+    assert cache.get("docs", [1.0, 0.1]) == "answer"
+    assert cache.get("docs", [0.0, 1.0]) is None
+    assert cache.get_stats() == {"hits": 1, "misses": 1, "size": 1}
+
+
+def test_answers_are_not_shared_between_keys(cache):
+    cache.put("docs", [1.0, 0.0], "answer")
+
+    assert cache.get("other docs", [1.0, 0.0]) is None
+
+
+def test_most_similar_answer_is_returned(cache):
+    cache.put("docs", [1.0, 0.3], "close")
+    cache.put("docs", [1.0, 0.0], "closest")
+
+    assert cache.get("docs", [1.0, 0.01]) == "closest"
+
+
+def test_answers_expire(cache, monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr("perry.agents.cache.time.monotonic", lambda: now)
+    cache.put("docs", [1.0, 0.0], "answer")
+
+    now += 61
+    assert cache.get("docs", [1.0, 0.0]) is None
+    assert cache.get_stats()["size"] == 0
+
+
+def test_least_recently_used_answer_is_evicted(cache):
+    cache.put("docs", [1.0, 0.0, 0.0], "first")
+    cache.put("docs", [0.0, 1.0, 0.0], "second")
+    cache.put("docs", [0.0, 0.0, 1.0], "third")
+    cache.get("docs", [1.0, 0.0, 0.0])
+
+    cache.put("other docs", [1.0, 0.0, 0.0], "fourth")
+
+    assert cache.get("docs", [0.0, 1.0, 0.0]) is None
+    assert cache.get("docs", [1.0, 0.0, 0.0]) == "first"
+
+
+class CachedEchoAgent(EchoAgent):
+    calls = 0
+
+    async def _on_query(self, query: str) -> str:
+        CachedEchoAgent.calls += 1
+        return "Echo: " + query
+
+    def _get_answer_cache_key(self) -> str | None:
+        return "echo"
+
+    async def _embed_query(self, query: str) -> list[float]:
+        return [float(len(query)), 1.0]
+
+
+@pytest.mark.asyncio
+async def test_agent_query_reuses_cached_answer(
+    cache, test_db, add_agent_to_db, add_conversation_to_db
+):
+    agent_id = add_agent_to_db()
+    update_agent(test_db, agent_id, conversation_id=add_conversation_to_db())
+    agent = CachedEchoAgent(test_db, BaseAgentConfig(name="echo").dict(), agent_id)
+    CachedEchoAgent.calls = 0
+
+    first = await agent.query("hello")
+    second = await agent.query("hallo")
+    streamed = [event async for event in agent.query_stream("hullo")]
+
+    assert first == second == "Echo: hello"
+    assert [(event.type, event.content) for event in streamed] == [
+        (AgentEventType.token, "Echo: hello")
+    ]
+    assert CachedEchoAgent.calls == 1
+    assert cache.get_stats()["hits"] == 2
@@ -0,0 +1,123 @@
+import asyncio
+import random
+import time
+from unittest.mock import Mock
+import pytest
+from llama_index.indices.query.schema import QueryBundle
+from llama_index.llms.base import ChatMessage, MessageRole
+from llama_index.tools.types import ToolMetadata
+from llama_index.utils import GlobalsHelper
+from perry.agents.fake_models import (
+    FakeEmbedding,
+    FakeLLM,
+    FakeQuestionGenerator,
+    LatencyDistribution,
+    LatencyModel,
+)
+
+
+def create_fake_llm(latency: float = 0.0, tokens_per_second: float = 10_000.0):
+    return FakeLLM(LatencyModel(latency), tokens_per_second, output_tokens=8)
+
+
+def test_fake_llm_answers_identical_prompts_identically():
+    llm = create_fake_llm()
+
+    first = llm.complete("What is it?")
+    second = llm.complete("What is it?")
+    other = llm.complete("What else is it?")
+
+    assert first.text == second.text
+    assert len(first.text.split()) == 8
+    assert first.text != other.text
+
+
+def test_fake_llm_streams_the_completed_answer():
+    llm = create_fake_llm()
+
+    deltas = [response.delta for response in llm.stream_complete("What is it?")]
+
+    assert "".join(deltas) == llm.complete("What is it?").text
+    assert len(deltas) == 8
+
+
+def test_fake_llm_takes_latency_and_token_time():
+    llm = create_fake_llm(latency=0.05, tokens_per_second=100.0)
+
+    start = time.perf_counter()
+    llm.complete("What is it?")
+
+    assert time.perf_counter() - start >= 0.05 + 8 / 100.0
+
+
+def test_fake_llm_chats_without_blocking_event_loop():
+    llm = create_fake_llm(latency=0.1)
+    messages = [ChatMessage(role=MessageRole.USER, content="What is it?")]
+
+    async def chat_concurrently():
+        return await asyncio.gather(*(llm.achat(messages) for _ in range(5)))
+
+    start = time.perf_counter()
+    responses = asyncio.run(chat_concurrently())
+
+    assert time.perf_counter() - start < 0.3
+    assert len({response.message.content for response in responses}) == 1
+
+
+def test_fake_llm_streams_chat_asynchronously():
+    llm = create_fake_llm()
+    messages = [ChatMessage(role=MessageRole.USER, content="What is it?")]
+
+    async def stream_chat():
+        return [response.delta async for response in await llm.astream_chat(messages)]
+
+    assert len(asyncio.run(stream_chat())) == 8
+
+
+@pytest.mark.parametrize("distribution", list(LatencyDistribution))
+def test_latency_model_samples_around_median(distribution):
+    latency = LatencyModel(1.0, distribution)
+    rng = random.Random(0)
+
+    samples = sorted(latency.sample(rng) for _ in range(1001))
+
+    assert all(sample >= 0 for sample in samples)
+    assert samples[500] == pytest.approx(1.0, abs=0.15)
+
+
+def test_fake_embedding_matches_hashing_embedding_of_same_dimension():
+    embed_model = FakeEmbedding(LatencyModel(0.0), dim=16)
+
+    embeddings = embed_model._get_text_embeddings(["first text", "second text"])
+
+    assert len(embeddings) == 2 and len(embeddings[0]) == 16
+    assert embed_model.get_query_embedding("first text") == embeddings[0]
+
+
+def test_fake_question_generator_asks_every_tool_the_query():
+    tools = [
+        ToolMetadata(name="1", description="a"),
+        ToolMetadata(name="2", description="b"),
+    ]
+    question_gen = FakeQuestionGenerator(create_fake_llm())
+
+    sub_questions = asyncio.run(
+        question_gen.agenerate(tools, QueryBundle("What is it?"))
+    )
+
+    assert [(q.tool_name, q.sub_question) for q in sub_questions] == [
+        ("1", "What is it?"),
+        ("2", "What is it?"),
+    ]
+
+
+def test_fake_embedding_counts_tokens_without_tiktoken(monkeypatch):
+    monkeypatch.setattr(
+        GlobalsHelper, "tokenizer", property(Mock(side_effect=AssertionError))
+    )
+    embed_model = FakeEmbedding(LatencyModel(0.0), dim=16)
+
+    embed_model.get_query_embedding("What is it?")
+    embed_model.get_text_embedding("It is a test")
+
+    assert embed_model.total_tokens_used == 7
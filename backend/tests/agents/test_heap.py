@@ -0,0 +1,64 @@
+import random
+import pytest
+from perry.agents.heap import IndexedHeap
+
+
+def pop_all(heap: IndexedHeap) -> list:
+    return [heap.pop() for _ in range(len(heap))]
+
+
+def test_pop_returns_items_by_priority():
+    heap = IndexedHeap()
+    for key, priority in [("a", 3), ("b", 1), ("c", 2)]:
+        heap.push(key, priority)
+
+    assert heap.peek() == (1, "b")
+    assert pop_all(heap) == [(1, "b"), (2, "c"), (3, "a")]
+
+
+def test_push_updates_priority_of_existing_key():
+    heap = IndexedHeap()
+    for key, priority in [("a", 1), ("b", 2), ("c", 3)]:
+        heap.push(key, priority)
+
+    heap.push("a", 4)
+    heap.push("c", 0)
+
+    assert len(heap) == 3
+    assert pop_all(heap) == [(0, "c"), (2, "b"), (4, "a")]
+
+
+def test_remove_keeps_heap_order():
+    heap = IndexedHeap()
+    for key in range(10):
+        heap.push(key, key)
+
+    heap.remove(3)
+    heap.remove(0)
+    heap.remove(42)
+
+    assert 3 not in heap
+    assert [key for _, key in pop_all(heap)] == [1, 2, 4, 5, 6, 7, 8, 9]
+
+
+def test_pop_from_empty_heap_raises():
+    heap = IndexedHeap()
+    assert heap.peek() is None
+    with pytest.raises(IndexError):
+        heap.pop()
+
+
+def test_random_updates_match_sorted_order():
+    rng = random.Random(0)
+    heap = IndexedHeap()
+    priorities = {}
+    for _ in range(500):
+        key = rng.randrange(50)
+        if rng.random() < 0.2:
+            heap.remove(key)
+            priorities.pop(key, None)
+        else:
+            priorities[key] = rng.random()
+            heap.push(key, priorities[key])
+
+    assert pop_all(heap) == sorted((p, k) for k, p in priorities.items())
@@ -0,0 +1,129 @@
+import asyncio
+import sqlite3
+import threading
+from unittest.mock import Mock
+from llama_index.llms.base import ChatMessage, MessageRole
+from llama_index.llms.mock import MockLLM
+from perry.agents.llm_cache import CachedLLM, LLMResponseCache
+
+
+class CountingLLM(MockLLM):
+    def __init__(self, temperature: float = 0.0):
+        super().__init__()
+        self.temperature = temperature
+        self.calls = 0
+
+    def complete(self, prompt, **kwargs):
+        self.calls += 1
+        return super().complete(prompt, **kwargs)
+
+    def stream_complete(self, prompt, **kwargs):
+        self.calls += 1
+        return super().stream_complete(prompt, **kwargs)
+
+
+def test_identical_prompt_is_answered_from_cache():
+    llm = CountingLLM()
+    cached_llm = CachedLLM(llm, ["doc_hash"])
+
+    first = cached_llm.complete("What is it?")
+    second = cached_llm.complete("What is it?")
+
+    assert first.text == second.text == "What is it?"
+    assert llm.calls == 1
+
+
+def test_cache_is_shared_between_instances_and_persisted():
+    CachedLLM(CountingLLM(), ["doc_hash"]).complete("What is it?")
+    llm = CountingLLM()
+
+    asyncio.run(CachedLLM(llm, ["other_hash"]).acomplete("What is it?"))
+
+    assert llm.calls == 0
+    assert LLMResponseCache._store_path.exists()
+
+
+def test_different_prompt_or_temperature_misses():
+    CachedLLM(CountingLLM(), ["doc_hash"]).complete("What is it?")
+    llm = CountingLLM()
+    warm_llm = CountingLLM(temperature=0.5)
+
+    CachedLLM(llm, ["doc_hash"]).complete("What else is it?")
+    CachedLLM(warm_llm, ["doc_hash"]).complete("What is it?")
+
+    assert llm.calls == 1
+    assert warm_llm.calls == 1
+
+
+def test_chat_responses_are_cached():
+    llm = CountingLLM()
+    cached_llm = CachedLLM(llm, ["doc_hash"])
+    messages = [ChatMessage(role=MessageRole.USER, content="Hello")]
+
+    first = cached_llm.chat(messages)
+    second = asyncio.run(cached_llm.achat(messages))
+
+    assert second.message == first.message
+    assert llm.calls == 1
+
+
+def test_stream_is_cached_once_complete_and_replayed():
+    llm = CountingLLM()
+    cached_llm = CachedLLM(llm, ["doc_hash"])
+
+    streamed = "".join(response.delta for response in cached_llm.stream_complete("Hi"))
+
+    async def replay():
+        responses = await cached_llm.astream_complete("Hi")
+        return [response.delta async for response in responses]
+
+    assert asyncio.run(replay()) == [streamed]
+    assert llm.calls == 1
+
+
+def test_invalidating_a_document_drops_its_responses():
+    CachedLLM(CountingLLM(), ["doc_hash", "other_hash"]).complete("Compare them")
+    CachedLLM(CountingLLM(), ["other_hash"]).complete("Summarize it")
+
+    assert LLMResponseCache.invalidate("doc_hash") == 1
+    llm = CountingLLM()
+    CachedLLM(llm, ["other_hash"]).complete("Compare them")
+    CachedLLM(llm, ["other_hash"]).complete("Summarize it")
+    assert llm.calls == 1
+
+
+def test_cache_connection_and_schema_are_set_up_once(monkeypatch):
+    connect = Mock(wraps=sqlite3.connect)
+    monkeypatch.setattr(sqlite3, "connect", connect)
+    cached_llm = CachedLLM(CountingLLM(), ["doc_hash"])
+
+    cached_llm.complete("What is it?")
+    cached_llm.complete("What is it?")
+    LLMResponseCache.invalidate("doc_hash")
+
+    assert connect.call_count == 1
+
+
+def test_async_methods_use_the_cache_off_the_event_loop(monkeypatch):
+    threads = []
+    get, put = LLMResponseCache.get, LLMResponseCache.put
+    monkeypatch.setattr(
+        LLMResponseCache,
+        "get",
+        lambda key: threads.append(threading.get_ident()) or get(key),
+    )
+    monkeypatch.setattr(
+        LLMResponseCache,
+        "put",
+        lambda *args: threads.append(threading.get_ident()) or put(*args),
+    )
+    cached_llm = CachedLLM(CountingLLM(), ["doc_hash"])
+
+    async def query():
+        await cached_llm.acomplete("What is it?")
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(query())
+
+    assert len(threads) == 2
+    assert loop_thread not in threads
@@ -1,4 +1,7 @@
+import asyncio
 import pytest
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
 from unittest.mock import Mock
 from perry.agents.manager import AgentManager
 from perry.agents.base import AgentRegistry
@@ -12,6 +15,35 @@ def mock_time():
     return datetime(2021, 1, 1)
 
 
+class StubAgent:
+    def __init__(self, name: str, memory_footprint: int = 0):
+        self.name = name
+        self.busy_count = 0
+        self.memory_footprint = memory_footprint
+
+    @property
+    def busy(self) -> bool:
+        return self.busy_count > 0
+
+    def pin(self):
+        self.busy_count += 1
+
+    def unpin(self):
+        self.busy_count -= 1
+
+    def get_memory_footprint(self) -> int:
+        return self.memory_footprint
+
+    def close(self):
+        self.closed = True
+
+
+class SlowQueryAgent(DummyAgent):
+    async def _on_query(self, query: str) -> str:
+        await self.release.wait()
+        return "slow_response"
+
+
 @pytest.fixture
 def manager():
     yield AgentManager()
@@ -52,9 +84,194 @@ def test_id_should_be_int(test_db, manager):
         manager.load_agent(test_db, "not_an_int")
 
 
+@pytest.fixture
+def blocking_agent(test_db, monkeypatch):
+    """Make agent loads block until released and count the agents created."""
+    started, release = Event(), Event()
+    created = []
+
+    def create_agent(db, agent_id, progress_callback=None):
+        created.append(agent_id)
+        if agent_id != 0:
+            started.set()
+            release.wait(timeout=5)
+        return StubAgent(f"agent_{agent_id}")
+
+    monkeypatch.setattr(AgentManager, "_create_agent", staticmethod(create_agent))
+    return started, release, created
+
+
+def test_concurrent_loads_of_same_agent_share_one_load(
+    test_db, manager, blocking_agent
+):
+    _, release, created = blocking_agent
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(manager.load_agent, test_db, 1) for _ in range(4)]
+        release.set()
+        results = [future.result(timeout=5) for future in futures]
+
+    assert [agent.name for agent in results] == ["agent_1"] * 4
+    assert created == [1]
+    assert manager._loading == {}
+
+
+def test_slow_load_does_not_block_other_agents(test_db, manager, blocking_agent):
+    started, release, _ = blocking_agent
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        slow_load = executor.submit(manager.load_agent, test_db, 1)
+        assert started.wait(timeout=5)
+
+        assert manager.load_agent(test_db, 0).name == "agent_0"
+        assert not slow_load.done()
+
+        release.set()
+        assert slow_load.result(timeout=5).name == "agent_1"
+
+
+def test_failed_load_is_raised_to_waiters_and_can_be_retried(
+    test_db, manager, monkeypatch
+):
+    started, release = Event(), Event()
+
+    def failing_create_agent(db, agent_id, progress_callback=None):
+        started.set()
+        release.wait(timeout=5)
+        raise ValueError("load failed")
+
+    monkeypatch.setattr(
+        AgentManager, "_create_agent", staticmethod(failing_create_agent)
+    )
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        loader = executor.submit(manager.load_agent, test_db, 1)
+        started.wait(timeout=5)
+        waiter = executor.submit(manager.load_agent, test_db, 1)
+        release.set()
+        for future in [loader, waiter]:
+            with pytest.raises(ValueError, match="load failed"):
+                future.result(timeout=5)
+
+    assert 1 not in manager._loading
+    monkeypatch.setattr(
+        AgentManager,
+        "_create_agent",
+        staticmethod(lambda db, id, cb=None: StubAgent("agent")),
+    )
+    assert manager.load_agent(test_db, 1).name == "agent"
+
+
+def test_failed_footprint_releases_the_load(test_db, manager, monkeypatch):
+    agent = StubAgent("agent")
+    agent.get_memory_footprint = Mock(side_effect=RuntimeError("no footprint"))
+    monkeypatch.setattr(
+        AgentManager, "_create_agent", staticmethod(lambda db, id, cb=None: agent)
+    )
+
+    with pytest.raises(RuntimeError):
+        manager.load_agent(test_db, 1)
+
+    assert manager._loading == {}
+    assert 1 not in manager.agent_dict
+
+
+@pytest.fixture
+def stub_agents(test_db, manager, monkeypatch):
+    """Load stub agents with the given memory footprints at the given times.
+
+    The agents are unpinned after loading, as they are once a request is done.
+    """
+    agents = {}
+    monkeypatch.setattr(
+        AgentManager,
+        "_create_agent",
+        staticmethod(lambda db, agent_id, cb=None: agents[agent_id]),
+    )
+
+    def _load(agent_id: int, memory_footprint: int = 100, minute: int = 0):
+        agents.setdefault(agent_id, StubAgent(f"agent_{agent_id}", memory_footprint))
+        with freezegun.freeze_time(mock_time() + timedelta(minutes=minute)):
+            agent = manager.load_agent(test_db, agent_id)
+        agent.unpin()
+        return agent
+
+    return _load
+
+
+def test_load_agent_refreshes_recency(manager, stub_agents):
+    stub_agents(1, minute=0)
+    stub_agents(1, minute=5)
+    assert manager.agent_dict[1]["last_used"] == mock_time() + timedelta(minutes=5)
+
+
+def test_memory_usage_sums_agent_footprints(manager, stub_agents):
+    stub_agents(1, memory_footprint=100)
+    stub_agents(2, memory_footprint=50)
+    assert manager.get_memory_usage() == 150
+
+
+def test_budget_evicts_least_recently_used_agents(manager, stub_agents):
+    AgentManager._memory_budget = 250
+    stub_agents(1, minute=0)
+    evicted_agent = stub_agents(2, minute=1)
+    stub_agents(1, minute=2)
+    stub_agents(3, minute=3)
+    assert list(manager.agent_dict.keys()) == [1, 3]
+    assert evicted_agent.closed
+
+
+def test_budget_keeps_the_agent_just_loaded(manager, stub_agents):
+    AgentManager._memory_budget = 50
+    stub_agents(1, memory_footprint=100)
+    assert list(manager.agent_dict.keys()) == [1]
+    stub_agents(2, memory_footprint=100, minute=1)
+    assert list(manager.agent_dict.keys()) == [2]
+
+
+def test_budget_does_not_evict_busy_agents(manager, stub_agents):
+    AgentManager._memory_budget = 250
+    stub_agents(1, minute=0).pin()
+    stub_agents(2, minute=1)
+    stub_agents(3, minute=2)
+    assert list(manager.agent_dict.keys()) == [1, 3]
+
+
+def test_agent_in_the_middle_of_a_query_is_not_evicted(
+    test_db, add_agent_to_db, manager
+):
+    agent = SlowQueryAgent(test_db, {"name": "slow"}, add_agent_to_db())
+    entry = {"agent": agent, "memory_footprint": 100}
+    manager.agent_dict[agent.id] = entry
+    manager._touch(agent.id, entry)
+    AgentManager._memory_budget = 0
+
+    async def query_while_evicting():
+        agent.release = asyncio.Event()
+        query = asyncio.create_task(agent.query("question"))
+        await asyncio.sleep(0)
+        assert agent.busy
+        manager._enforce_memory_budget()
+        assert agent.id in manager.agent_dict
+        agent.release.set()
+        return await query
+
+    assert asyncio.run(query_while_evicting()) == "slow_response"
+    assert not agent.busy
+    manager._enforce_memory_budget()
+    assert agent.id not in manager.agent_dict
+
+
+def test_load_agent_returns_the_agent_pinned(test_db, manager, monkeypatch):
+    agent = StubAgent("agent")
+    monkeypatch.setattr(
+        AgentManager, "_create_agent", staticmethod(lambda db, id, cb=None: agent)
+    )
+
+    assert manager.load_agent(test_db, 1).busy_count == 1
+    assert manager.load_agent(test_db, 1).busy_count == 2
+
+
 def test_remove_agent_deletes_from_dict(test_db, dummy_agent, manager, monkeypatch):
     test_id = 1
-    manager.load_agent(test_db, test_id)
+    manager.load_agent(test_db, test_id).unpin()
     assert test_id in manager.agent_dict
     manager._remove_agent(test_id)
     assert test_id not in manager.agent_dict
@@ -62,47 +279,55 @@ def test_remove_agent_deletes_from_dict(test_db, dummy_agent, manager, monkeypat
 
 def test_reset_should_reset_state(test_db, dummy_agent, manager, monkeypatch):
     AgentManager.agent_dict = {1: "dummy"}
-    AgentManager.expiry_queue = "dummy"
     AgentManager.lock = "dummy"
     AgentManager._cleanup_timeout = "dummy"
 
     manager.reset()
 
     assert manager.agent_dict == {}
-    assert manager.expiry_queue.empty()
+    assert manager._loading == {}
     assert manager.lock is not None
     assert isinstance(manager._cleanup_timeout, timedelta)
 
 
+def test_load_agent_gives_agent_its_own_session(
+    test_db, dummy_agent, manager, monkeypatch
+):
+    agent_session = Mock()
+    monkeypatch.setattr(
+        "perry.db.session.DatabaseSessionManager._SessionLocal",
+        lambda: agent_session,
+    )
+
+    agent = manager.load_agent(test_db, 1)
+    assert agent._db_session is agent_session
+
+    agent.unpin()
+    manager._remove_agent(1)
+    agent_session.close.assert_called_once()
+
+
 def test_remove_agent_does_not_delete_busy_agent(
     test_db, dummy_agent, manager, monkeypatch
 ):
     test_id = 1
-    agent = manager.load_agent(test_db, test_id)
-    agent.busy = True
+    manager.load_agent(test_db, test_id)
     manager._remove_agent(test_id)
     assert test_id in manager.agent_dict
 
 
 def test_cleanup_removes_expired_agents(test_db, dummy_agent, manager, monkeypatch):
-    mock_timer = Mock()
-    monkeypatch.setattr("perry.agents.manager.Timer", mock_timer)
-
     test_id = 1
     with freezegun.freeze_time(mock_time()):
-        manager.load_agent(test_db, test_id)
+        manager.load_agent(test_db, test_id).unpin()
     with freezegun.freeze_time(
         mock_time() + manager._cleanup_timeout + timedelta(seconds=1)
     ):
         manager._cleanup()
         assert test_id not in manager.agent_dict
-        assert mock_timer.call_count == 1
 
 
 def test_cleanup_keeps_unexpired_agents(test_db, dummy_agent, manager, monkeypatch):
-    mock_timer = Mock()
-    monkeypatch.setattr("perry.agents.manager.Timer", mock_timer)
-
     test_id = 1
     with freezegun.freeze_time(mock_time()):
         manager.load_agent(test_db, test_id)
@@ -111,4 +336,70 @@ def test_cleanup_keeps_unexpired_agents(test_db, dummy_agent, manager, monkeypat
     ):
         manager._cleanup()
         assert test_id in manager.agent_dict
-        assert mock_timer.call_count == 1
+
+
+def test_cleanup_reconsiders_expired_busy_agents(
+    test_db, dummy_agent, manager, monkeypatch
+):
+    test_id = 1
+    with freezegun.freeze_time(mock_time()):
+        agent = manager.load_agent(test_db, test_id)
+    with freezegun.freeze_time(
+        mock_time() + manager._cleanup_timeout + timedelta(seconds=1)
+    ):
+        manager._cleanup()
+        assert test_id in manager.agent_dict
+        agent.unpin()
+        manager._cleanup()
+        assert test_id not in manager.agent_dict
+
+
+def test_load_agent_requests_cleanup_when_busy_agents_exceed_budget(
+    manager, stub_agents, monkeypatch
+):
+    mock_request_cleanup = Mock()
+    monkeypatch.setattr(AgentManager, "request_cleanup", mock_request_cleanup)
+    AgentManager._memory_budget = 150
+
+    stub_agents(1).pin()
+    mock_request_cleanup.assert_not_called()
+    stub_agents(2, minute=1)
+
+    assert list(manager.agent_dict.keys()) == [1, 2]
+    mock_request_cleanup.assert_called_once()
+
+
+def test_cleanup_task_runs_when_requested_from_another_thread(manager, monkeypatch):
+    mock_cleanup = Mock(return_value=True)
+    monkeypatch.setattr(AgentManager, "_cleanup", mock_cleanup)
+
+    async def request_from_thread():
+        manager.start()
+        await asyncio.sleep(0)
+        assert mock_cleanup.call_count == 1
+        await asyncio.get_running_loop().run_in_executor(None, manager.request_cleanup)
+        await asyncio.sleep(0.05)
+        assert mock_cleanup.call_count == 2
+        await manager.stop()
+
+    asyncio.run(request_from_thread())
+    assert manager._cleanup_task is None
+
+
+def test_cleanup_task_repeats_quickly_while_over_budget(manager, monkeypatch):
+    mock_cleanup = Mock(return_value=False)
+    monkeypatch.setattr(AgentManager, "_cleanup", mock_cleanup)
+    AgentManager._pressure_cleanup_interval = 0.01
+
+    async def run_under_pressure():
+        manager.start()
+        await asyncio.sleep(0.1)
+        await manager.stop()
+
+    asyncio.run(run_under_pressure())
+    assert mock_cleanup.call_count >= 3
+
+
+def test_request_cleanup_without_running_task_does_nothing(manager):
+    manager.request_cleanup()
+    assert manager._cleanup_task is None
@@ -0,0 +1,305 @@
+import asyncio
+import threading
+import time
+from contextlib import nullcontext
+from unittest.mock import Mock
+from llama_index import Document, VectorStoreIndex
+from llama_index.indices.query.base import BaseQueryEngine
+from llama_index.response.schema import Response
+from llama_index.question_gen.types import BaseQuestionGenerator, SubQuestion
+from llama_index.tools import QueryEngineTool, ToolMetadata
+from perry.agents.base import AgentEventType
+from perry.agents.query_engine import BatchedSubQuestionQueryEngine
+from perry.indexing.store import IndexStore
+from perry.indexing.vector_store import MemmapVectorStore
+from tests.agents.fixtures import create_mock_service_context
+
+
+class FixedQuestionGenerator(BaseQuestionGenerator):
+    def __init__(self, sub_questions: list[SubQuestion]):
+        self.sub_questions = sub_questions
+
+    def generate(self, tools, query):
+        return self.sub_questions
+
+    async def agenerate(self, tools, query):
+        return self.sub_questions
+
+
+def create_tool(name: str, service_context, storage_context=None) -> QueryEngineTool:
+    index = VectorStoreIndex.from_documents(
+        [Document(text=f"{name} page {i}") for i in range(5)],
+        service_context=service_context,
+        storage_context=storage_context,
+    )
+    return QueryEngineTool(
+        query_engine=index.as_query_engine(service_context=service_context),
+        metadata=ToolMetadata(name=name, description=f"{name} document"),
+    )
+
+
+def create_engine(tools, sub_questions, service_context):
+    return BatchedSubQuestionQueryEngine.from_defaults(
+        query_engine_tools=tools,
+        question_gen=FixedQuestionGenerator(sub_questions),
+        service_context=service_context,
+        verbose=False,
+    )
+
+
+def test_sub_questions_of_a_document_are_scored_in_one_batch(monkeypatch):
+    service_context = create_mock_service_context()
+    tools = [
+        create_tool(name, service_context, IndexStore.new_storage_context())
+        for name in ["first", "second"]
+    ]
+    sub_questions = [
+        SubQuestion(sub_question="What is in the first?", tool_name="first"),
+        SubQuestion(sub_question="Anything else?", tool_name="first"),
+        SubQuestion(sub_question="What is in the second?", tool_name="second"),
+    ]
+    query_batch = Mock(wraps=MemmapVectorStore.query_batch)
+    monkeypatch.setattr(
+        MemmapVectorStore,
+        "query_batch",
+        lambda self, *args, **kwargs: query_batch(self, *args, **kwargs),
+    )
+    single_query = Mock()
+    monkeypatch.setattr(MemmapVectorStore, "query", single_query)
+    engine = create_engine(tools, sub_questions, service_context)
+
+    response = asyncio.run(engine.aquery("Compare the documents"))
+
+    assert str(response)
+    assert [len(call.args[1]) for call in query_batch.call_args_list] == [2, 1]
+    single_query.assert_not_called()
+
+
+async def retrieve_batches(engine, sub_questions):
+    retrievals = await engine._aretrieve_batches(nullcontext(), sub_questions)
+    return {ind: (await retrieval)[ind] for ind, retrieval in retrievals.items()}
+
+
+def test_retrieved_nodes_match_single_query_retrieval():
+    service_context = create_mock_service_context()
+    tool = create_tool("first", service_context, IndexStore.new_storage_context())
+    sub_question = SubQuestion(sub_question="What is in it?", tool_name="first")
+    engine = create_engine([tool], [sub_question], service_context)
+
+    query_bundle, nodes = asyncio.run(retrieve_batches(engine, [sub_question]))[0]
+    expected = tool.query_engine.retrieve(query_bundle)
+
+    assert [node.node.node_id for node in nodes] == [
+        node.node.node_id for node in expected
+    ]
+
+
+def test_tools_without_memory_mapped_store_are_queried_one_by_one():
+    service_context = create_mock_service_context()
+    tool = create_tool("legacy", service_context)
+    sub_questions = [
+        SubQuestion(sub_question="First question?", tool_name="legacy"),
+        SubQuestion(sub_question="Second question?", tool_name="legacy"),
+    ]
+    engine = create_engine([tool], sub_questions, service_context)
+
+    assert asyncio.run(retrieve_batches(engine, sub_questions)) == {}
+    response = asyncio.run(engine.aquery("Ask the legacy document"))
+    assert str(response)
+
+
+def test_sub_questions_queried_one_by_one_are_embedded_off_the_loop(monkeypatch):
+    service_context = create_mock_service_context()
+    tool = create_tool("legacy", service_context)
+    sub_questions = [SubQuestion(sub_question="First question?", tool_name="legacy")]
+    embed_model = service_context.embed_model
+    embedding_threads = []
+    get_query_embedding = embed_model._get_query_embedding
+    monkeypatch.setattr(
+        embed_model,
+        "_get_query_embedding",
+        lambda query: embedding_threads.append(threading.get_ident())
+        or get_query_embedding(query),
+    )
+    engine = create_engine([tool], sub_questions, service_context)
+
+    asyncio.run(engine.aquery("Ask the legacy document"))
+
+    assert embedding_threads
+    assert threading.get_ident() not in embedding_threads
+
+
+def test_sub_questions_are_embedded_in_one_call_and_retrieved_off_the_loop(
+    monkeypatch,
+):
+    service_context = create_mock_service_context()
+    tools = [
+        create_tool(name, service_context, IndexStore.new_storage_context())
+        for name in ["first", "second"]
+    ]
+    sub_questions = [
+        SubQuestion(sub_question="What is in the first?", tool_name="first"),
+        SubQuestion(sub_question="Anything else?", tool_name="first"),
+        SubQuestion(sub_question="What is in the second?", tool_name="second"),
+    ]
+    embed_model = service_context.embed_model
+    embed_texts = Mock(wraps=embed_model._get_text_embeddings)
+    monkeypatch.setattr(embed_model, "_get_text_embeddings", embed_texts)
+    retrieval_threads = []
+    retrieve_batch = BatchedSubQuestionQueryEngine._retrieve_batch
+    monkeypatch.setattr(
+        BatchedSubQuestionQueryEngine,
+        "_retrieve_batch",
+        staticmethod(
+            lambda *args: retrieval_threads.append(threading.get_ident())
+            or retrieve_batch(*args)
+        ),
+    )
+    engine = create_engine(tools, sub_questions, service_context)
+
+    asyncio.run(engine.aquery("Compare the documents"))
+
+    assert [call.args[0] for call in embed_texts.call_args_list] == [
+        [sub_q.sub_question for sub_q in sub_questions]
+    ]
+    assert len(retrieval_threads) == 2
+    assert threading.get_ident() not in retrieval_threads
+
+
+def test_sub_questions_of_a_tool_timing_out_in_retrieval_are_dropped(monkeypatch):
+    service_context = create_mock_service_context()
+    tools = [
+        create_tool(name, service_context, IndexStore.new_storage_context())
+        for name in ["first", "second"]
+    ]
+    sub_questions = [
+        SubQuestion(sub_question="What is in the first?", tool_name="first"),
+        SubQuestion(sub_question="What is in the second?", tool_name="second"),
+    ]
+    engine = BatchedSubQuestionQueryEngine.from_defaults(
+        query_engine_tools=tools,
+        question_gen=FixedQuestionGenerator(sub_questions),
+        service_context=service_context,
+        verbose=False,
+        max_concurrency=1,
+        tool_timeout=0.1,
+    )
+    retrieve_batch = BatchedSubQuestionQueryEngine._retrieve_batch
+
+    def slow_for_second(retriever, query_bundles):
+        if query_bundles[0].query_str.endswith("second?"):
+            time.sleep(0.5)
+        return retrieve_batch(retriever, query_bundles)
+
+    monkeypatch.setattr(
+        BatchedSubQuestionQueryEngine, "_retrieve_batch", staticmethod(slow_for_second)
+    )
+
+    async def answered_sub_questions():
+        tasks = await engine._create_subq_tasks(sub_questions, {"0": "", "1": ""})
+        return [pair.sub_q.tool_name for pair in await asyncio.gather(*tasks) if pair]
+
+    assert asyncio.run(answered_sub_questions()) == ["first"]
+
+
+class SlowQueryEngine(BaseQueryEngine):
+    def __init__(self, delay: float, tracker: dict):
+        super().__init__(callback_manager=None)
+        self.delay = delay
+        self.tracker = tracker
+
+    def _query(self, query_bundle):
+        raise NotImplementedError
+
+    async def _aquery(self, query_bundle):
+        self.tracker["running"] += 1
+        self.tracker["peak"] = max(self.tracker["peak"], self.tracker["running"])
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.tracker["running"] -= 1
+        return Response(response=f"answer after {self.delay}s", source_nodes=[])
+
+
+def create_slow_tools(delays: dict[str, float], tracker: dict):
+    return [
+        QueryEngineTool(
+            query_engine=SlowQueryEngine(delay, tracker),
+            metadata=ToolMetadata(name=name, description=f"{name} document"),
+        )
+        for name, delay in delays.items()
+    ]
+
+
+def test_sub_questions_run_concurrently_up_to_the_cap():
+    tracker = {"running": 0, "peak": 0}
+    delays = {f"doc_{i}": 0.05 for i in range(6)}
+    sub_questions = [
+        SubQuestion(sub_question=f"What is in {name}?", tool_name=name)
+        for name in delays
+    ]
+    engine = BatchedSubQuestionQueryEngine.from_defaults(
+        query_engine_tools=create_slow_tools(delays, tracker),
+        question_gen=FixedQuestionGenerator(sub_questions),
+        service_context=create_mock_service_context(),
+        verbose=False,
+        max_concurrency=2,
+    )
+
+    asyncio.run(engine.aquery("Compare the documents"))
+
+    assert tracker["peak"] == 2
+
+
+def test_sub_questions_exceeding_the_timeout_are_dropped():
+    tracker = {"running": 0, "peak": 0}
+    delays = {"fast": 0.0, "slow": 10.0}
+    sub_questions = [
+        SubQuestion(sub_question=f"What is in {name}?", tool_name=name)
+        for name in delays
+    ]
+    engine = BatchedSubQuestionQueryEngine.from_defaults(
+        query_engine_tools=create_slow_tools(delays, tracker),
+        question_gen=FixedQuestionGenerator(sub_questions),
+        service_context=create_mock_service_context(),
+        verbose=False,
+        tool_timeout=0.1,
+    )
+    synthesize = Mock(wraps=engine._response_synthesizer.asynthesize)
+    engine._response_synthesizer.asynthesize = synthesize
+
+    start = time.perf_counter()
+    asyncio.run(engine.aquery("Compare the documents"))
+
+    assert time.perf_counter() - start < 5
+    nodes = synthesize.call_args.kwargs["nodes"]
+    assert [node.node.text for node in nodes] == [
+        "Sub question: What is in fast?\nResponse: answer after 0.0s"
+    ]
+
+
+def test_astream_reports_sub_questions_before_streaming_tokens():
+    service_context = create_mock_service_context()
+    tools = [
+        create_tool(name, service_context, IndexStore.new_storage_context())
+        for name in ["first", "second"]
+    ]
+    sub_questions = [
+        SubQuestion(sub_question="What is in the first?", tool_name="first"),
+        SubQuestion(sub_question="What is in the second?", tool_name="second"),
+    ]
+    engine = create_engine(tools, sub_questions, service_context)
+
+    async def collect():
+        return [event async for event in engine.astream("Compare the documents")]
+
+    events = asyncio.run(collect())
+
+    types = [event.type for event in events]
+    assert types[:3] == [AgentEventType.progress] * 3
+    assert set(types[3:]) == {AgentEventType.token}
+    assert len(types) > 4
+    assert sorted(event.content for event in events[1:3]) == [
+        "[first] What is in the first?",
+        "[second] What is in the second?",
+    ]
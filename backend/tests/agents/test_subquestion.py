@@ -1,7 +1,26 @@
+import asyncio
+from unittest.mock import Mock
 import pytest
 from pathlib import Path
 from tests.agents.fixtures import *
+from llama_index import Document
 from llama_index.query_engine import SubQuestionQueryEngine
+from perry.agents.fake_models import FakeEmbedding, FakeLLM
+from perry.agents.llm_cache import CachedLLM
+from perry.agents.query_engine import BatchedSubQuestionQueryEngine
+from perry.agents.subquestion import ModelProvider
+from perry.db.models import Document as DBDocument
+from perry.db.operations.documents import get_document
+from perry.indexing.store import IndexStore
+from perry.settings import Settings
+
+get_new_service_context = SubquestionAgent.__dict__["_get_new_service_context"]
+
+
+def update_document_hash(db_session, document_id: int, doc_hash: str):
+    document = db_session.query(DBDocument).filter_by(id=document_id).first()
+    document.hash = doc_hash
+    db_session.commit()
 
 
 def test_doc_paths_from_connected_docs_should_be_returned(
@@ -68,79 +87,146 @@ def test_should_raise_exception_for_non_pdf_file(
         agent._load_docs()
 
 
-def test_cache_exists_raises_error_if_directory_not_found(monkeypatch):
-    monkeypatch.setattr(Path, "exists", lambda x: False)
-    directory = Path("/some/random/directory")
-    assert not SubquestionAgent._cache_exists(directory)
-
+@pytest.mark.parametrize(
+    "index_exists, expected_call", [(True, "_load"), (False, "_create_index")]
+)
+def test_get_vector_indexes_should_only_create_indexes_missing_from_store(
+    monkeypatch, index_exists, expected_call, create_subquestion_agent_with_documents
+):
+    file_info = [
+        {"content": "test", "name": "first", "suffix": ".pdf"},
+        {"content": "test2", "name": "second", "suffix": ".pdf"},
+    ]
+    agent, document_ids, _ = create_subquestion_agent_with_documents(file_info)
+    for document_id in document_ids:
+        update_document_hash(agent._db_session, document_id, f"hash_{document_id}")
+
+    calls = []
+    monkeypatch.setattr(
+        SubquestionAgent,
+        "_load_docs",
+        lambda self, file_paths=None: calls.append("_load_docs")
+        or {doc_id: ["doc"] for doc_id in file_paths},
+    )
+    monkeypatch.setattr(IndexStore, "exists", lambda key: index_exists)
+    monkeypatch.setattr(IndexStore, "_persist", lambda key, index: None)
+    monkeypatch.setattr(
+        IndexStore, "load", lambda key, context: calls.append("_load") or key
+    )
+    monkeypatch.setattr(
+        SubquestionAgent,
+        "_create_index",
+        lambda self, doc_id, doc_set: calls.append("_create_index") or doc_id,
+    )
 
-def test_cache_exists_passes_when_all_files_and_directory_exist(monkeypatch):
-    monkeypatch.setattr(Path, "exists", lambda x: True)
-    directory = Path("/some/random/directory")
+    result = agent._get_vector_indexes(agent._get_doc_paths())
 
-    try:
-        SubquestionAgent._cache_exists(directory)
-    except FileNotFoundError:
-        pytest.fail("FileNotFoundError raised when it shouldn't be.")
+    assert list(result.keys()) == document_ids
+    expected_calls = [expected_call] * len(document_ids)
+    if not index_exists:
+        expected_calls = ["_load_docs"] + expected_calls
+    assert calls == expected_calls
+    for document_id in document_ids:
+        key = IndexStore.get_index_key(f"hash_{document_id}", agent._service_context)
+        assert IndexStore.get_reference_count(key) == 1
 
 
-@pytest.mark.parametrize(
-    "cache_exists, expected_call", [(True, "_load_index"), (False, "_create_index")]
-)
-def test_get_vector_indexes_should_call_appropriate_methods_based_on_cache_existence(
-    monkeypatch, cache_exists, expected_call, create_subquestion_agent
+def test_get_vector_indexes_should_share_index_of_identical_documents(
+    monkeypatch, create_subquestion_agent_with_documents
 ):
-    mock_doc_sets = {1: ["doc1"], 2: ["doc2"]}
-    mock_load_index = lambda self, doc_id: f"Loaded {doc_id}"
-    mock_create_index = lambda self, doc_id, doc_set=None: f"Created {doc_id}"
+    file_info = [
+        {"content": "test", "name": "first", "suffix": ".pdf"},
+        {"content": "test", "name": "copy", "suffix": ".pdf"},
+    ]
+    agent, document_ids, _ = create_subquestion_agent_with_documents(file_info)
+    for document_id in document_ids:
+        update_document_hash(agent._db_session, document_id, "same_hash")
+
+    created = []
+    persisted = set()
+    monkeypatch.setattr(IndexStore, "exists", lambda key: key in persisted)
+    monkeypatch.setattr(IndexStore, "_persist", lambda key, index: persisted.add(key))
+    monkeypatch.setattr(IndexStore, "load", lambda key, context: key)
+    monkeypatch.setattr(
+        SubquestionAgent,
+        "_create_index",
+        lambda self, doc_id, doc_set: created.append(doc_id) or doc_id,
+    )
 
-    monkeypatch.setattr(SubquestionAgent, "_cache_exists", lambda self, x: cache_exists)
-    monkeypatch.setattr(SubquestionAgent, "_file_hash_matches", lambda self, x: True)
-    monkeypatch.setattr(SubquestionAgent, "_load_index", mock_load_index)
-    monkeypatch.setattr(SubquestionAgent, "_create_index", mock_create_index)
+    monkeypatch.setattr(
+        SubquestionAgent,
+        "_load_docs",
+        lambda self, file_paths=None: {doc_id: ["doc"] for doc_id in file_paths},
+    )
 
-    agent = create_subquestion_agent()
-    result = agent._get_vector_indexes(mock_doc_sets)
+    agent._get_vector_indexes(agent._get_doc_paths())
 
-    assert result is not None
-    assert isinstance(result, dict)
+    key = IndexStore.get_index_key("same_hash", agent._service_context)
+    assert created == document_ids[:1]
+    assert IndexStore.get_reference_count(key) == 2
 
-    for doc_id in mock_doc_sets.keys():
-        expected_output = (
-            getattr(agent, expected_call)(doc_id, mock_doc_sets.get(doc_id))
-            if expected_call == "_create_index"
-            else getattr(agent, expected_call)(doc_id)
-        )
-        assert result[doc_id] == expected_output
 
+def test_index_document_should_skip_documents_without_hash(
+    monkeypatch, create_subquestion_agent_with_documents
+):
+    file_info = [{"content": "test", "name": "first", "suffix": ".pdf"}]
+    agent, document_ids, _ = create_subquestion_agent_with_documents(file_info)
+    update_document_hash(agent._db_session, document_ids[0], None)
+    mock_get_or_create = Mock()
+    monkeypatch.setattr(IndexStore, "get_or_create", mock_get_or_create)
 
-@pytest.mark.parametrize(
-    "missing_file",
-    ["docstore.json", "index_store.json", "graph_store.json", "vector_store.json"],
-)
-def test_cache_exists_should_return_false_when_required_file_is_missing(
-    monkeypatch, missing_file
+    SubquestionAgent.index_document(agent._db_session, document_ids[0])
+
+    mock_get_or_create.assert_not_called()
+
+
+def test_index_document_should_create_and_reference_index(
+    monkeypatch, create_subquestion_agent_with_documents
 ):
-    def mock_exists(path):
-        return not path.name == missing_file
+    file_info = [{"content": "test", "name": "first", "suffix": ".pdf"}]
+    agent, document_ids, _ = create_subquestion_agent_with_documents(file_info)
+    update_document_hash(agent._db_session, document_ids[0], "hash")
+    persisted = []
+    monkeypatch.setattr(
+        IndexStore, "_persist", lambda key, index: persisted.append(key)
+    )
+    monkeypatch.setattr(
+        SubquestionAgent, "_build_index", lambda docs, service_context: "index"
+    )
 
-    monkeypatch.setattr(Path, "exists", mock_exists)
-    directory = Path("/some/random/directory")
+    SubquestionAgent.index_document(agent._db_session, document_ids[0])
 
-    assert not SubquestionAgent._cache_exists(directory)
+    key = IndexStore.get_index_key("hash", agent._service_context)
+    assert persisted == [key]
+    assert IndexStore.get_reference_count(key) == 1
 
 
-def test_load_index_should_raise_error_if_cache_does_not_exist(
-    monkeypatch, create_subquestion_agent
+def test_index_document_should_release_reference_of_document_deleted_meanwhile(
+    monkeypatch, create_subquestion_agent_with_documents
 ):
-    monkeypatch.setattr(Path, "exists", lambda x: False)
+    file_info = [{"content": "test", "name": "first", "suffix": ".pdf"}]
+    agent, document_ids, _ = create_subquestion_agent_with_documents(file_info)
+    update_document_hash(agent._db_session, document_ids[0], "hash")
+    document = get_document(agent._db_session, document_ids[0])
+    monkeypatch.setattr(IndexStore, "_persist", lambda key, index: None)
+
+    def delete_while_indexing(docs, service_context):
+        agent._db_session.delete(document)
+        agent._db_session.commit()
+        IndexStore.remove_references(document_ids[0])
+        return "index"
+
+    monkeypatch.setattr(SubquestionAgent, "_build_index", delete_while_indexing)
+
+    SubquestionAgent.index_document(agent._db_session, document_ids[0])
+
+    key = IndexStore.get_index_key("hash", agent._service_context)
+    assert IndexStore.get_reference_count(key) == 0
 
-    with pytest.raises(
-        FileNotFoundError,
-        match=r"Vector index for document_id: .* not found in cache .*",
-    ):
-        agent = create_subquestion_agent()
-        agent._load_index(1)
+
+def test_index_document_should_raise_for_unknown_document(test_db):
+    with pytest.raises(ValueError, match="No document found"):
+        SubquestionAgent.index_document(test_db, 9999)
 
 
 def test_create_subquestion_engine_should_return_valid_SubQuestionQueryEngine(
@@ -159,3 +245,126 @@ def test_create_subquestion_engine_should_return_valid_SubQuestionQueryEngine(
     agent, _, _ = create_subquestion_agent_with_documents(file_info)
 
     assert isinstance(agent._create_engine(), MockSubQuestionQueryEngine)
+
+
+@pytest.mark.parametrize("min_nodes, expected", [(1, True), (1000, False)])
+def test_build_index_should_add_ann_index_to_large_documents(
+    monkeypatch, min_nodes, expected
+):
+    monkeypatch.setattr(
+        "perry.agents.subquestion.get_settings",
+        lambda: Settings(ann_min_nodes=min_nodes),
+    )
+
+    index = SubquestionAgent._build_index(
+        [Document(text="test")], create_mock_service_context()
+    )
+
+    assert index.storage_context.vector_store.has_ann_index == expected
+
+
+def test_configure_ann_index_should_use_probes_of_config(
+    monkeypatch, create_subquestion_agent
+):
+    agent = create_subquestion_agent()
+    agent.config.ann_probes = 3
+    index = SubquestionAgent._build_index(
+        [Document(text="test")], agent._service_context
+    )
+    monkeypatch.setattr(
+        "perry.agents.subquestion.get_settings", lambda: Settings(ann_min_nodes=1)
+    )
+
+    agent._configure_ann_index(index)
+
+    vector_store = index.storage_context.vector_store
+    assert vector_store.has_ann_index
+    assert vector_store.ann_probes == 3
+
+
+def test_answer_cache_key_follows_documents_and_model(
+    create_subquestion_agent_with_documents,
+):
+    file_info = [
+        {"content": "test", "name": "first", "suffix": ".pdf"},
+        {"content": "test2", "name": "second", "suffix": ".pdf"},
+    ]
+    agent, document_ids, _ = create_subquestion_agent_with_documents(file_info)
+    assert agent._get_answer_cache_key() is None
+
+    agent.config.use_answer_cache = True
+    key = agent._get_answer_cache_key()
+    update_document_hash(agent._db_session, document_ids[0], "changed")
+    changed_documents_key = agent._get_answer_cache_key()
+    agent.config.temperature = 0.9
+
+    assert key != changed_documents_key != agent._get_answer_cache_key()
+
+
+@pytest.mark.parametrize(
+    "field, value",
+    [
+        ("model_provider", ModelProvider.FAKE),
+        ("ann_probes", 3),
+        ("sub_question_timeout", 5.0),
+    ],
+)
+def test_answer_cache_key_follows_answer_changing_settings(
+    create_subquestion_agent_with_documents, field, value
+):
+    file_info = [{"content": "test", "name": "first", "suffix": ".pdf"}]
+    agent, _, _ = create_subquestion_agent_with_documents(file_info)
+    agent.config.use_answer_cache = True
+    key = agent._get_answer_cache_key()
+
+    setattr(agent.config, field, value)
+
+    assert agent._get_answer_cache_key() != key
+
+
+@pytest.mark.parametrize("temperature, cached", [(0.0, True), (0.3, False)])
+def test_setup_should_cache_llm_responses_only_at_zero_temperature(
+    monkeypatch, test_db, add_connected_agent_conversation_to_db, temperature, cached
+):
+    llms = []
+    monkeypatch.setattr(
+        SubquestionAgent,
+        "_get_new_service_context",
+        staticmethod(
+            lambda llm, embed_model: llms.append(llm) or create_mock_service_context()
+        ),
+    )
+    agent_id, _ = add_connected_agent_conversation_to_db()
+    config = SubquestionConfig(name="test", temperature=temperature).dict()
+
+    SubquestionAgent(test_db, config, agent_id)
+
+    assert isinstance(llms[0], CachedLLM) == cached
+
+
+def test_fake_provider_should_answer_offline(
+    monkeypatch, create_subquestion_agent_with_documents
+):
+    file_info = [{"content": "revenue grew", "name": "report", "suffix": ".pdf"}]
+    agent, _, _ = create_subquestion_agent_with_documents(file_info)
+    monkeypatch.setattr(
+        SubquestionAgent, "_get_new_service_context", get_new_service_context
+    )
+    monkeypatch.setattr(
+        "perry.agents.subquestion.BatchedSubQuestionQueryEngine",
+        BatchedSubQuestionQueryEngine,
+    )
+    config = SubquestionConfig(
+        name="test",
+        model_provider="fake",
+        fake_latency_ms=0.0,
+        fake_tokens_per_second=10_000.0,
+        fake_embedding_latency_ms=0.0,
+    ).dict()
+
+    agent = SubquestionAgent(agent._db_session, config, agent._agent_data.id)
+    answer = asyncio.run(agent._on_query("How did revenue grow?"))
+
+    assert isinstance(agent._service_context.llm, FakeLLM)
+    assert isinstance(agent._service_context.embed_model, FakeEmbedding)
+    assert answer == asyncio.run(agent._on_query("How did revenue grow?"))
@@ -1,3 +1,5 @@
+import json
+from datetime import datetime
 import pytest
 from unittest.mock import Mock, AsyncMock
 from fastapi import status
@@ -8,6 +10,8 @@ from perry.api.endpoints.conversation import (
     ConversationQuery,
     check_owned_conversation,
 )
+from perry.agents.base import AgentEvent, AgentEventType
+from perry.db.models import JobStatusEnum
 from tests.api.fixtures import *
 
 
@@ -68,8 +72,10 @@ def get_user_conversation_mock(conversation_mock, test_client, monkeypatch):
         get_mock_conversation(2, 2),
         get_mock_conversation(3, 3),
     ]
-    user = Mock(conversations=conversations)
-    monkeypatch.setattr(str_path_conv_endpoint() + ".get_user", lambda db, id: user)
+    monkeypatch.setattr(
+        str_path_conv_endpoint() + ".read_user_conversations",
+        lambda db, user_id: conversations,
+    )
     yield {
         "test_client": test_client,
         "conversations": conversations,
@@ -111,6 +117,12 @@ def create_conversation_mock(conversation_mock, test_client, monkeypatch):
     monkeypatch.setattr(
         str_path_conv_endpoint() + ".update_document", mock_update_document
     )
+    mock_create_job = Mock(return_value=1)
+    monkeypatch.setattr(str_path_conv_endpoint() + ".create_job", mock_create_job)
+    mock_submit_job = Mock()
+    monkeypatch.setattr(
+        str_path_conv_endpoint() + ".IndexingWorker.submit", mock_submit_job
+    )
 
     yield {
         "test_client": test_client,
@@ -121,6 +133,8 @@ def create_conversation_mock(conversation_mock, test_client, monkeypatch):
         "mock_update_conversation": mock_update_conversation,
         "mock_update_agent": mock_update_agent,
         "mock_update_document": mock_update_document,
+        "mock_create_job": mock_create_job,
+        "mock_submit_job": mock_submit_job,
     }
 
 
@@ -142,6 +156,7 @@ def query_conversation_agent_mock(conversation_mock, test_client, monkeypatch):
     response = "test_response"
     agent = AsyncMock()
     agent.query.return_value = response
+    agent.unpin = Mock()
     monkeypatch.setattr(
         str_path_conv_endpoint() + ".AgentManager.load_agent",
         lambda self, db, id: agent,
@@ -176,9 +191,9 @@ def test_endpoints_should_refuse_non_authenticated_users(
 def test_get_user_conversations_returns_empty_list_if_no_conversations(
     get_user_conversation_mock, test_client, monkeypatch
 ):
-    conversations = []
-    user = Mock(conversations=conversations)
-    monkeypatch.setattr(str_path_conv_endpoint() + ".get_user", lambda db, id: user)
+    monkeypatch.setattr(
+        str_path_conv_endpoint() + ".read_user_conversations", lambda db, user_id: []
+    )
     response = test_client.get(CONVERSATION_URL + "/")
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == []
@@ -246,7 +261,7 @@ def test_create_conversation_errors_with_invalid_agent_settings(
     conversation_json = create_conversation_mock["conversation_json"]
     mock_agent = create_conversation_mock["mock_agent"]
 
-    mock_agent.side_effect = KeyError("Invalid agent settings")
+    mock_agent._get_config_instance.side_effect = KeyError("Invalid agent settings")
     conversation_json["agent_settings"] = {"invalid_agent_settings": True}
 
     response = test_client.post(
@@ -292,12 +307,24 @@ def test_create_conversation_succeeds(create_conversation_mock):
     assert response.status_code == status.HTTP_201_CREATED
     assert create_conversation_mock["mock_get_user_documents"].call_count == 1
     assert create_conversation_mock["mock_agent_constructor"].call_count == 1
-    assert create_conversation_mock["mock_agent"].call_count == 1
+    assert create_conversation_mock["mock_agent"].call_count == 0
+    assert create_conversation_mock["mock_agent"]._get_config_instance.call_count == 1
     assert create_conversation_mock["mock_update_conversation"].call_count == 1
-    assert create_conversation_mock["mock_update_agent"].call_count == 1
+    assert create_conversation_mock["mock_update_agent"].call_count == 2
     assert create_conversation_mock["mock_update_document"].call_count == 3
 
 
+def test_create_conversation_queues_indexing_job(create_conversation_mock):
+    response = create_conversation_mock["test_client"].post(
+        CONVERSATION_URL + "/",
+        json=create_conversation_mock["conversation_json"],
+    )
+
+    assert response.status_code == status.HTTP_201_CREATED
+    create_conversation_mock["mock_create_job"].assert_called_once()
+    create_conversation_mock["mock_submit_job"].assert_called_once_with(1)
+
+
 def test_create_conversation_updates_document_with_conversation_id(
     create_conversation_mock,
 ):
@@ -378,6 +405,7 @@ def test_query_conversation_agent_query_failure_raises_server_error(
     )
     assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
     assert response.json() == {"detail": "Query failed."}
+    agent.unpin.assert_called_once()
 
 
 def test_query_conversation_agent_succeeds(query_conversation_agent_mock):
@@ -391,10 +419,216 @@ def test_query_conversation_agent_succeeds(query_conversation_agent_mock):
     assert response.status_code == status.HTTP_200_OK
     agent.called_once_with(query_conversation_agent_mock["query"]["query"])
     assert response.json() == query_conversation_agent_mock["response"]
+    agent.unpin.assert_called_once()
+
+
+def parse_server_sent_events(text: str) -> list[tuple[str, str]]:
+    events = []
+    for block in text.strip().split("\n\n"):
+        event_line, data_line = block.split("\n")
+        events.append(
+            (event_line.removeprefix("event: "), json.loads(data_line[len("data: ") :]))
+        )
+    return events
+
 
+def test_stream_conversation_agent_streams_events_and_saves_answer(
+    query_conversation_agent_mock, monkeypatch
+):
+    async def query_stream(query):
+        yield AgentEvent(
+            type=AgentEventType.progress, content="Generated 1 sub question."
+        )
+        yield AgentEvent(type=AgentEventType.token, content="test")
+        yield AgentEvent(type=AgentEventType.token, content="_response")
+
+    query_conversation_agent_mock["agent"].query_stream = query_stream
+    messages = []
+    monkeypatch.setattr(
+        str_path_conv_endpoint() + ".create_message",
+        lambda db, user_id, role, message: messages.append((role, message)) or 1,
+    )
 
-def test_get_conversation_info_errors_on_non_authorized_conversation(
+    response = query_conversation_agent_mock["test_client"].post(
+        CONVERSATION_URL + "/1/stream",
+        json=query_conversation_agent_mock["query"],
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert parse_server_sent_events(response.text) == [
+        ("progress", "Generated 1 sub question."),
+        ("token", "test"),
+        ("token", "_response"),
+        ("done", "test_response"),
+    ]
+    assert messages == [("user", "test_query"), ("assistant", "test_response")]
+    query_conversation_agent_mock["agent"].unpin.assert_called_once()
+
+
+def test_stream_conversation_agent_failure_sends_error_and_saves_nothing(
+    query_conversation_agent_mock, monkeypatch
+):
+    async def query_stream(query):
+        yield AgentEvent(type=AgentEventType.token, content="partial")
+        raise Exception("Query failed")
+
+    query_conversation_agent_mock["agent"].query_stream = query_stream
+    create_message = Mock(return_value=1)
+    monkeypatch.setattr(str_path_conv_endpoint() + ".create_message", create_message)
+
+    response = query_conversation_agent_mock["test_client"].post(
+        CONVERSATION_URL + "/1/stream",
+        json=query_conversation_agent_mock["query"],
+    )
+
+    assert parse_server_sent_events(response.text) == [
+        ("token", "partial"),
+        ("error", "Query failed."),
+    ]
+    create_message.assert_not_called()
+    query_conversation_agent_mock["agent"].unpin.assert_called_once()
+
+
+def test_stream_conversation_agent_refuses_until_indexed(
+    query_conversation_agent_mock, monkeypatch
+):
+    monkeypatch.setattr(
+        str_path_conv_endpoint() + ".get_conversation_job",
+        lambda db, id: Mock(status=JobStatusEnum.running),
+    )
+
+    response = query_conversation_agent_mock["test_client"].post(
+        CONVERSATION_URL + "/1/stream",
+        json=query_conversation_agent_mock["query"],
+    )
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+
+@pytest.mark.parametrize(
+    "job_status, status_code, detail",
+    [
+        (
+            JobStatusEnum.queued,
+            status.HTTP_409_CONFLICT,
+            "Conversation is still indexing.",
+        ),
+        (
+            JobStatusEnum.running,
+            status.HTTP_409_CONFLICT,
+            "Conversation is still indexing.",
+        ),
+        (
+            JobStatusEnum.failed,
+            status.HTTP_500_INTERNAL_SERVER_ERROR,
+            "Conversation indexing failed.",
+        ),
+    ],
+)
+def test_query_conversation_agent_refuses_until_indexed(
+    query_conversation_agent_mock, monkeypatch, job_status, status_code, detail
+):
+    test_client = query_conversation_agent_mock["test_client"]
+    agent = query_conversation_agent_mock["agent"]
+    monkeypatch.setattr(
+        str_path_conv_endpoint() + ".get_conversation_job",
+        lambda db, id: Mock(status=job_status),
+    )
+
+    response = test_client.post(
+        CONVERSATION_URL + "/1",
+        json=query_conversation_agent_mock["query"],
+    )
+    assert response.status_code == status_code
+    assert response.json() == {"detail": detail}
+    assert agent.query.call_count == 0
+
+
+def test_query_conversation_agent_succeeds_when_indexed(
+    query_conversation_agent_mock, monkeypatch
+):
+    monkeypatch.setattr(
+        str_path_conv_endpoint() + ".get_conversation_job",
+        lambda db, id: Mock(status=JobStatusEnum.completed),
+    )
+
+    response = query_conversation_agent_mock["test_client"].post(
+        CONVERSATION_URL + "/1",
+        json=query_conversation_agent_mock["query"],
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == query_conversation_agent_mock["response"]
+
+
+def test_get_conversation_status_returns_job_progress(
     conversation_mock, check_owned_mock, test_client, monkeypatch
+):
+    monkeypatch.setattr(
+        str_path_conv_endpoint() + ".get_conversation_job",
+        lambda db, id: Mock(status=JobStatusEnum.running, progress=0.5, error=None),
+    )
+
+    response = test_client.get(CONVERSATION_URL + "/1/status")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"status": "running", "progress": 0.5, "error": None}
+
+
+def test_get_conversation_status_without_job_is_completed(
+    conversation_mock, check_owned_mock, test_client, monkeypatch
+):
+    monkeypatch.setattr(
+        str_path_conv_endpoint() + ".get_conversation_job", lambda db, id: None
+    )
+
+    response = test_client.get(CONVERSATION_URL + "/1/status")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"status": "completed", "progress": 1.0, "error": None}
+
+
+def test_retry_conversation_indexing_queues_new_job(
+    conversation_mock, check_owned_mock, test_client, monkeypatch
+):
+    monkeypatch.setattr(
+        str_path_conv_endpoint() + ".get_conversation_job",
+        lambda db, id: Mock(status=JobStatusEnum.failed),
+    )
+    mock_create_job = Mock(return_value=2)
+    monkeypatch.setattr(str_path_conv_endpoint() + ".create_job", mock_create_job)
+    mock_submit = Mock()
+    monkeypatch.setattr(
+        str_path_conv_endpoint() + ".IndexingWorker.submit", mock_submit
+    )
+
+    response = test_client.post(CONVERSATION_URL + "/1/status")
+
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.json() == {"status": "queued", "progress": 0.0, "error": None}
+    mock_create_job.assert_called_once()
+    mock_submit.assert_called_once_with(2)
+
+
+@pytest.mark.parametrize("job", [None, Mock(status=JobStatusEnum.running)])
+def test_retry_conversation_indexing_refuses_unless_failed(
+    conversation_mock, check_owned_mock, test_client, monkeypatch, job
+):
+    monkeypatch.setattr(
+        str_path_conv_endpoint() + ".get_conversation_job", lambda db, id: job
+    )
+    mock_create_job = Mock()
+    monkeypatch.setattr(str_path_conv_endpoint() + ".create_job", mock_create_job)
+
+    response = test_client.post(CONVERSATION_URL + "/1/status")
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert response.json() == {"detail": "Conversation indexing has not failed."}
+    mock_create_job.assert_not_called()
+
+
+def test_get_conversation_info_errors_on_non_existing_conversation(
+    conversation_mock, test_client, monkeypatch
 ):
     monkeypatch.setattr(
         str_path_conv_endpoint() + ".read_conversation", lambda db, id: None
@@ -405,12 +639,11 @@ def test_get_conversation_info_errors_on_non_authorized_conversation(
     assert response.json() == {"detail": "Conversation not found."}
 
 
-def test_get_conversation_info_succeeds(
-    conversation_mock, check_owned_mock, test_client, monkeypatch
-):
+def test_get_conversation_info_succeeds(conversation_mock, test_client, monkeypatch):
     moc_conversation = get_mock_conversation()
+    mock_read_conversation = Mock(return_value=moc_conversation)
     monkeypatch.setattr(
-        str_path_conv_endpoint() + ".read_conversation", lambda db, id: moc_conversation
+        str_path_conv_endpoint() + ".read_conversation", mock_read_conversation
     )
 
     response = test_client.get(CONVERSATION_URL + "/1")
@@ -425,6 +658,42 @@ def test_get_conversation_info_succeeds(
         "doc_titles": ["", "", ""],
         "name": "test_name",
     }
+    mock_read_conversation.assert_called_once()
+
+
+def test_get_conversation_message_history_reads_requested_page(
+    conversation_mock, check_owned_mock, test_client, monkeypatch
+):
+    read_messages = Mock(
+        return_value=[
+            Mock(id=5, role="user", message="query", timestamp=datetime(2023, 1, 1)),
+            Mock(
+                id=6, role="assistant", message="answer", timestamp=datetime(2023, 1, 1)
+            ),
+        ]
+    )
+    monkeypatch.setattr(
+        str_path_conv_endpoint() + ".read_conversation_messages", read_messages
+    )
+
+    response = test_client.get(
+        CONVERSATION_URL + "/1/messages", params={"after_id": 4, "limit": 2}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [(m["id"], m["message"]) for m in response.json()] == [
+        (5, "query"),
+        (6, "answer"),
+    ]
+    assert read_messages.call_args.args[1:] == (1, None, 4, 2)
+
+
+def test_get_conversation_message_history_refuses_invalid_limit(
+    conversation_mock, check_owned_mock, test_client
+):
+    response = test_client.get(CONVERSATION_URL + "/1/messages", params={"limit": 0})
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
 
 
 def test_remove_conversation_history_calls_delete_conversation(
@@ -458,8 +727,9 @@ def test_check_owned_conversation_errors_on_not_authorized(monkeypatch):
         check_owned_conversation(Mock(), 1, 1)
 
 
-def test_check_owned_conversation_succeeds(monkeypatch):
+def test_check_owned_conversation_returns_conversation(monkeypatch):
+    conversation = Mock(user_id=1)
     monkeypatch.setattr(
-        str_path_conv_endpoint() + ".read_conversation", lambda db, id: Mock(user_id=1)
+        str_path_conv_endpoint() + ".read_conversation", lambda db, id: conversation
     )
-    check_owned_conversation(Mock(), 1, 1)
+    assert check_owned_conversation(Mock(), 1, 1) is conversation
@@ -1,6 +1,6 @@
 from io import BytesIO
 from pathlib import Path
-from unittest.mock import Mock
+from unittest.mock import AsyncMock, Mock
 from perry.api.endpoints.document import *
 from tests.conftest import get_mock_secret_key
 from tests.api.fixtures import *
@@ -28,17 +28,18 @@ def mock_get_user_id_and_return_id(test_client):
     test_client.app.dependency_overrides.pop(get_current_user_id)
 
 
-@pytest.fixture(scope="function")
-def mock_get_document(monkeypatch):
-    monkeypatch.setattr("perry.api.endpoints.document.get_document", mock_api_doc)
+def mock_document_with_ownership(monkeypatch, document, owned: bool) -> Mock:
+    mock_get_document_with_ownership = Mock(return_value=(document, owned))
+    monkeypatch.setattr(
+        "perry.api.endpoints.document.get_document_with_ownership",
+        mock_get_document_with_ownership,
+    )
+    return mock_get_document_with_ownership
 
 
 @pytest.fixture(scope="function")
-def mock_document_owned_by_user(monkeypatch):
-    monkeypatch.setattr(
-        "perry.api.endpoints.document.document_owned_by_user",
-        lambda *args, **kwargs: True,
-    )
+def mock_owned_document(monkeypatch):
+    mock_document_with_ownership(monkeypatch, mock_api_doc(), True)
 
 
 @pytest.fixture(scope="function")
@@ -51,15 +52,19 @@ def mock_get_user_documents(monkeypatch):
 
 @pytest.fixture(scope="function")
 def mock_create_doc_db_operations(monkeypatch, test_client, mock_get_user_id):
-    mock_save_file = Mock(return_value=1)
+    mock_save_file = AsyncMock(return_value=1)
     mock_update_document = Mock(side_effect=lambda db, doc_id, *args, **kwargs: doc_id)
-    mock_remove_file = Mock(return_value=None)
+    mock_remove_file = AsyncMock(return_value=None)
 
-    monkeypatch.setattr("perry.api.endpoints.document.save_file", mock_save_file)
+    monkeypatch.setattr(
+        "perry.api.endpoints.document.save_uploaded_file", mock_save_file
+    )
     monkeypatch.setattr(
         "perry.api.endpoints.document.update_document", mock_update_document
     )
-    monkeypatch.setattr("perry.api.endpoints.document.remove_file", mock_remove_file)
+    monkeypatch.setattr(
+        "perry.api.endpoints.document.remove_document_and_file", mock_remove_file
+    )
     monkeypatch.setattr(
         "perry.api.endpoints.document.check_max_documents", lambda *args, **kwargs: None
     )
@@ -73,19 +78,12 @@ def mock_create_doc_db_operations(monkeypatch, test_client, mock_get_user_id):
 def mock_retrieve_binary_file_setup(monkeypatch, mock_get_user_id):
     document_id = 1
 
-    mock_document_owned_by_user = Mock(return_value=True)
-    monkeypatch.setattr(
-        "perry.api.endpoints.document.document_owned_by_user",
-        mock_document_owned_by_user,
-    )
     db_doc_mock = Mock(spec=Document)
     db_doc_mock.title = "filename.pdf"
-    mock_get_document = Mock(return_value=db_doc_mock)
-    monkeypatch.setattr(
-        "perry.api.endpoints.document.get_document",
-        mock_get_document,
+    mock_get_document_with_ownership = mock_document_with_ownership(
+        monkeypatch, db_doc_mock, True
     )
-    return document_id, mock_document_owned_by_user, mock_get_document
+    return document_id, mock_get_document_with_ownership
 
 
 @pytest.mark.parametrize(
@@ -130,6 +128,24 @@ def test_create_doc_valid_pdf(test_client, mock_create_doc_db_operations):
     assert remove_file.call_count == 0
 
 
+def test_create_doc_queues_document_indexing_job(
+    test_client, mock_create_doc_db_operations, mock_submit_indexing_job, monkeypatch
+):
+    mock_create_job = Mock(return_value=5)
+    monkeypatch.setattr("perry.api.endpoints.document.create_job", mock_create_job)
+    file_content = mock_create_doc_db_operations[3]
+
+    response = test_client.post(
+        get_file_url() + "/",
+        files={"file": ("filename.pdf", file_content, "application/pdf")},
+    )
+
+    assert response.status_code == status.HTTP_201_CREATED
+    mock_create_job.assert_called_once()
+    assert mock_create_job.call_args[1]["document_id"] == 1
+    mock_submit_indexing_job.assert_called_once_with(5)
+
+
 def test_create_doc_invalid_file_type(test_client, mock_create_doc_db_operations):
     (
         save_file,
@@ -154,10 +170,12 @@ def test_create_doc_server_error(
 ):
     _, update_document, remove_file, file_content, _ = mock_create_doc_db_operations
 
-    def mock_save_file(*args, **kwargs):
+    async def mock_save_file(*args, **kwargs):
         raise Exception("Server Error")
 
-    monkeypatch.setattr("perry.api.endpoints.document.save_file", mock_save_file)
+    monkeypatch.setattr(
+        "perry.api.endpoints.document.save_uploaded_file", mock_save_file
+    )
     response = test_client.post(
         get_file_url() + "/",
         files={"file": ("filename.pdf", file_content, "application/pdf")},
@@ -213,6 +231,32 @@ def test_upload_file_should_call_save_file_with_binaryio_object(
     created_file_path = Path(tmpdir, "1.pdf")
     assert response.status_code == status.HTTP_201_CREATED
     assert created_file_path.exists()
+    assert [path.name for path in Path(tmpdir).iterdir()] == ["1.pdf"]
+
+
+def test_upload_file_update_error_should_remove_document_and_file(
+    test_client, test_db, monkeypatch, tmpdir, mock_get_user_id
+):
+    monkeypatch.setattr(
+        "perry.db.operations.documents.get_file_storage_path",
+        lambda *args, **kwargs: tmpdir,
+    )
+    monkeypatch.setattr(
+        "perry.api.endpoints.document.update_document",
+        Mock(side_effect=Exception("Server Error")),
+    )
+    monkeypatch.setattr(
+        "perry.api.endpoints.document.check_max_documents", lambda *args, **kwargs: None
+    )
+
+    response = test_client.post(
+        get_file_url() + "/",
+        files={"file": ("filename.pdf", b"test_bin", "application/pdf")},
+    )
+
+    assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+    assert list(Path(tmpdir).iterdir()) == []
+    assert test_db.query(Document).count() == 0
 
 
 @pytest.mark.parametrize(
@@ -231,20 +275,25 @@ def test_delete_file(
     expected_status,
     mock_get_user_id,
 ):
-    monkeypatch.setattr(
-        "perry.api.endpoints.document.document_owned_by_user",
-        lambda *args, **kwargs: ownership,
-    )
+    mock_document_with_ownership(monkeypatch, Mock(hash=None), ownership)
 
     if remove_success:
-        mock_remove_file = Mock(return_value=None)
+        mock_remove_file = AsyncMock(return_value=None)
     else:
-        mock_remove_file = Mock(side_effect=Exception("Could not delete"))
-    monkeypatch.setattr("perry.api.endpoints.document.remove_file", mock_remove_file)
+        mock_remove_file = AsyncMock(side_effect=Exception("Could not delete"))
+    monkeypatch.setattr(
+        "perry.api.endpoints.document.remove_document_and_file", mock_remove_file
+    )
+    mock_remove_references = Mock(return_value=[])
+    monkeypatch.setattr(
+        "perry.api.endpoints.document.IndexStore.remove_references",
+        mock_remove_references,
+    )
 
     response = test_client.delete(get_file_url() + "/1")
 
     assert response.status_code == expected_status
+    assert mock_remove_references.called == (ownership and remove_success)
 
     if ownership:
         assert mock_remove_file.called
@@ -253,52 +302,74 @@ def test_delete_file(
         assert not mock_remove_file.called
 
 
+@pytest.mark.parametrize("hash_in_use", [True, False])
+def test_delete_file_invalidates_llm_responses_of_last_copy(
+    test_client, monkeypatch, mock_get_user_id, hash_in_use
+):
+    mock_document_with_ownership(monkeypatch, Mock(hash="doc_hash"), True)
+    monkeypatch.setattr(
+        "perry.api.endpoints.document.remove_document_and_file", AsyncMock()
+    )
+    monkeypatch.setattr(
+        "perry.api.endpoints.document.IndexStore.remove_references", Mock()
+    )
+    monkeypatch.setattr(
+        "perry.api.endpoints.document.document_hash_in_use",
+        lambda db, doc_hash: hash_in_use,
+    )
+    mock_invalidate = Mock(return_value=0)
+    monkeypatch.setattr(
+        "perry.api.endpoints.document.LLMResponseCache.invalidate", mock_invalidate
+    )
+
+    response = test_client.delete(get_file_url() + "/1")
+
+    assert response.status_code == status.HTTP_200_OK
+    if hash_in_use:
+        mock_invalidate.assert_not_called()
+    else:
+        mock_invalidate.assert_called_once_with("doc_hash")
+
+
 def test_retrieve_file_binary_unowned_document(
     test_client, monkeypatch, mock_retrieve_binary_file_setup
 ):
-    document_id, _, mock_get_document = mock_retrieve_binary_file_setup
-
-    mock_document_owned_by_user = Mock(return_value=False)
-    monkeypatch.setattr(
-        "perry.api.endpoints.document.document_owned_by_user",
-        mock_document_owned_by_user,
+    document_id, _ = mock_retrieve_binary_file_setup
+    mock_get_document_with_ownership = mock_document_with_ownership(
+        monkeypatch, Mock(spec=Document), False
     )
 
     response = test_client.get(get_file_url() + "/" + str(document_id))
 
     assert response.status_code == status.HTTP_403_FORBIDDEN
-    mock_document_owned_by_user.assert_called_once()
+    mock_get_document_with_ownership.assert_called_once()
 
 
 def test_retrieve_file_binary_file_not_loaded(
     monkeypatch, test_client, mock_retrieve_binary_file_setup
 ):
-    (
-        document_id,
-        mock_document_owned_by_user,
-        mock_get_document,
-    ) = mock_retrieve_binary_file_setup
+    document_id, mock_get_document_with_ownership = mock_retrieve_binary_file_setup
 
     mock_load_file = Mock(side_effect=Exception("Database error"))
-    monkeypatch.setattr("perry.api.endpoints.document.load_file", mock_load_file)
+    monkeypatch.setattr(
+        "perry.api.endpoints.document.load_bytes_from_file", mock_load_file
+    )
     response = test_client.get(get_file_url() + "/" + str(document_id))
 
     assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
     mock_load_file.assert_called_once()
-    mock_document_owned_by_user.assert_called_once()
+    mock_get_document_with_ownership.assert_called_once()
 
 
 def test_retrieve_file_binary_successful(
     monkeypatch, test_client, mock_retrieve_binary_file_setup
 ):
-    (
-        document_id,
-        mock_document_owned_by_user,
-        mock_get_document,
-    ) = mock_retrieve_binary_file_setup
+    document_id, mock_get_document_with_ownership = mock_retrieve_binary_file_setup
 
     mock_load_file = Mock(return_value=b"some_file_content")
-    monkeypatch.setattr("perry.api.endpoints.document.load_file", mock_load_file)
+    monkeypatch.setattr(
+        "perry.api.endpoints.document.load_bytes_from_file", mock_load_file
+    )
 
     response = test_client.get(get_file_url() + "/" + str(document_id))
     content_dict = response.json()
@@ -307,36 +378,27 @@ def test_retrieve_file_binary_successful(
     assert content_dict["filename"] == "filename.pdf"
     assert content_dict["file"] == "some_file_content"
     mock_load_file.assert_called_once()
-    mock_document_owned_by_user.assert_called_once()
-    mock_get_document.assert_called_once()
+    mock_get_document_with_ownership.assert_called_once()
 
 
 def test_should_return_document_when_authorized(
-    test_client, mock_document_owned_by_user, mock_get_document, mock_get_user_id
+    test_client, mock_owned_document, mock_get_user_id
 ):
     response = test_client.get(get_document_url() + "/1")
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == mock_api_doc().dict()
 
 
-def test_should_raise_403_when_unauthorized(
-    test_client, monkeypatch, mock_get_document, mock_get_user_id
-):
-    monkeypatch.setattr(
-        "perry.api.endpoints.document.document_owned_by_user",
-        lambda *args, **kwargs: False,
-    )
+def test_should_raise_403_when_unauthorized(test_client, monkeypatch, mock_get_user_id):
+    mock_document_with_ownership(monkeypatch, mock_api_doc(), False)
     response = test_client.get(get_document_url() + "/1")
     assert response.status_code == status.HTTP_403_FORBIDDEN
 
 
 def test_get_doc_raises_404_when_doc_not_found(
-    test_client, monkeypatch, mock_document_owned_by_user, mock_get_user_id
+    test_client, monkeypatch, mock_get_user_id
 ):
-    monkeypatch.setattr(
-        "perry.api.endpoints.document.get_document",
-        lambda *args, **kwargs: None,
-    )
+    mock_document_with_ownership(monkeypatch, None, False)
     response = test_client.get(get_document_url() + "/1")
     assert response.status_code == status.HTTP_404_NOT_FOUND
 
@@ -352,10 +414,7 @@ def test_get_all_doc_info_returns_all_user_documents(
 def test_update_doc_description_should_return_200(
     test_client, mock_get_user_id, monkeypatch
 ):
-    monkeypatch.setattr(
-        "perry.api.endpoints.document.document_owned_by_user",
-        lambda *args, **kwargs: True,
-    )
+    mock_document_with_ownership(monkeypatch, mock_api_doc(), True)
     monkeypatch.setattr(
         "perry.api.endpoints.document.update_document",
         lambda *args, **kwargs: True,
@@ -1,23 +1,19 @@
 import jwt
 import pytest
+from unittest.mock import Mock
 import freezegun
 from fastapi.testclient import TestClient
 from datetime import datetime, timedelta
 from perry.db.operations.users import get_user
 from tests.conftest import get_mock_secret_key
 from perry.api.app import app, init_agent_registry
-from perry.api.dependencies import get_db
 from perry.api.authentication import get_current_user_id
 from perry.agents.base import AgentRegistry
 
 
 @pytest.fixture(scope="function")
 def test_client(test_db):
-    def get_mock_db():
-        yield test_db
-
     with TestClient(app) as client:
-        client.app.dependency_overrides[get_db] = get_mock_db
         client.app.dependency_overrides[init_agent_registry] = lambda: AgentRegistry()
         yield client
         AgentRegistry().reset()
@@ -59,6 +55,14 @@ def mocked_expired_token(test_db, create_user_in_db):
         return token, user_id
 
 
+@pytest.fixture(scope="function", autouse=True)
+def mock_submit_indexing_job(monkeypatch) -> Mock:
+    """Keep indexing jobs queued instead of running them in the background."""
+    mock_submit = Mock()
+    monkeypatch.setattr("perry.indexing.jobs.IndexingWorker.submit", mock_submit)
+    return mock_submit
+
+
 @pytest.fixture(scope="function", autouse=True)
 def mock_get_db_session(monkeypatch, test_db):
     """Mock get_db_session to return test_db."""
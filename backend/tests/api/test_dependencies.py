@@ -1,7 +1,12 @@
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
 from perry.api.dependencies import get_db
 
 
-def test_get_db_yields_db_session(test_db):
-    db = next(get_db())
-    assert db is test_db
+@pytest.mark.asyncio
+async def test_get_db_yields_async_db_session(test_db):
+    db_generator = get_db()
+    db = await anext(db_generator)
+    assert isinstance(db, AsyncSession)
     assert db.is_active is True
+    await db_generator.aclose()
@@ -1,24 +1,35 @@
 import os
 import tempfile
+from pathlib import Path
 import pytest
-from sqlalchemy import create_engine, MetaData
+import pytest_asyncio
+from sqlalchemy import create_engine, event, MetaData
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import NullPool
 from sqlalchemy.orm import sessionmaker, Session
+from perry.agents.cache import AnswerCache
 from perry.db.models import Base
 from perry.db.operations.agents import create_agent, update_agent
 from perry.db.operations.conversations import create_conversation
 from perry.db.operations.documents import create_document, update_document
 from perry.db.operations.users import create_user
 from perry.db.operations.messages import create_message
-from perry.db.session import DatabaseSessionManager
+from perry.db.session import DatabaseSessionManager, set_sqlite_pragmas
 
 
 @pytest.fixture(scope="session", autouse=True)
-def create_test_db() -> Session:
-    """Setup a temporary database for testing."""
+def create_test_db(tmp_path_factory) -> Session:
+    """Setup a temporary database for testing.
+
+    Its connections are closed at the end, so SQLite removes the WAL files.
+    """
     DatabaseSessionManager._db_name = "test_db"
+    DatabaseSessionManager._db_directory = tmp_path_factory.mktemp("db")
     session = DatabaseSessionManager.get_db_session()
     clear_db(session)
-    return session
+    yield session
+    session.close()
+    session.get_bind().dispose()
 
 
 @pytest.fixture(scope="function", autouse=True)
@@ -36,6 +47,66 @@ def test_db(create_test_db, monkeypatch) -> Session:
     return create_test_db
 
 
+@pytest.fixture(scope="function", autouse=True)
+def async_test_engine(create_test_db, monkeypatch):
+    """Open async sessions on the test database without pooling connections.
+
+    Every test runs its own event loop, which pooled connections cannot outlive.
+    """
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{DatabaseSessionManager._get_db_path()}",
+        poolclass=NullPool,
+    )
+    event.listen(engine.sync_engine, "connect", set_sqlite_pragmas)
+    monkeypatch.setattr(DatabaseSessionManager, "_async_engine", engine)
+    monkeypatch.setattr(DatabaseSessionManager, "_AsyncSessionLocal", None)
+    return engine
+
+
+@pytest_asyncio.fixture(scope="function")
+async def async_test_db(test_db, async_test_engine) -> AsyncSession:
+    """Return an async session on the test database."""
+    db = DatabaseSessionManager.get_async_db_session()
+    yield db
+    await db.close()
+
+
+@pytest.fixture(scope="function", autouse=True)
+def temp_index_store(monkeypatch, tmp_path) -> Path:
+    """Persist vector indexes in a temporary directory for each test."""
+    store_path = Path(tmp_path, "indexes")
+    monkeypatch.setattr("perry.indexing.store.IndexStore._store_path", store_path)
+    return store_path
+
+
+@pytest.fixture(scope="function", autouse=True)
+def temp_llm_response_cache(monkeypatch, tmp_path) -> Path:
+    """Cache LLM responses in a temporary file for each test."""
+    store_path = Path(tmp_path, "llm_responses.sqlite3")
+    monkeypatch.setattr(
+        "perry.agents.llm_cache.LLMResponseCache._store_path", store_path
+    )
+    return store_path
+
+
+@pytest.fixture(scope="function", autouse=True)
+def temp_embedding_cache(monkeypatch, tmp_path) -> Path:
+    """Cache embeddings in a temporary file for each test."""
+    store_path = Path(tmp_path, "embeddings.sqlite3")
+    monkeypatch.setattr(
+        "perry.indexing.embeddings.EmbeddingCache._store_path", store_path
+    )
+    return store_path
+
+
+@pytest.fixture(scope="function", autouse=True)
+def reset_answer_cache():
+    """Start each test without cached answers."""
+    AnswerCache.reset()
+    yield
+    AnswerCache.reset()
+
+
 @pytest.fixture(scope="function")
 def add_agent_to_db(test_db) -> int:
     """Add an agent to the database and return its ID."""
@@ -152,9 +223,10 @@ def clear_db(db_session: Session):
     metadata = MetaData()
     metadata.reflect(bind=db_session.get_bind())
 
-    # Delete records one by one from each table
+    # Delete records one by one from each table, keeping the migration revision
     for table in reversed(metadata.sorted_tables):
-        db_session.execute(table.delete())
+        if table.name != "alembic_version":
+            db_session.execute(table.delete())
     db_session.commit()
 
 
@@ -1,10 +1,16 @@
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event
+from perry.db.operations.agents import create_agent, update_agent
 from perry.db.operations.conversations import (
     create_conversation,
     read_conversation,
+    read_user_conversations,
     update_conversation,
     delete_conversation,
     add_messages_to_conversation,
 )
+from perry.db.operations.documents import create_document, update_document
 from perry.db.operations.messages import read_message
 from perry.db.models import Conversation
 
@@ -68,3 +74,55 @@ def test_add_messages_to_conversation_returns_messages(
     conv_message_ids = [message.id for message in conv.messages]
     assert conv is not None
     assert conv_message_ids == message_ids
+
+
+@contextmanager
+def count_queries(db):
+    statements = []
+    record = lambda *args: statements.append(args[2])
+    event.listen(db.get_bind(), "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", record)
+
+
+def add_user_conversations(db, user_id, count):
+    for i in range(count):
+        conv_id = create_conversation(db)
+        update_conversation(db, conv_id, user_id, name=f"conversation {i}")
+        agent_id = create_agent(db)
+        update_agent(db, agent_id, conversation_id=conv_id, agent_type="dummy")
+        for j in range(2):
+            doc_id = create_document(db)
+            update_document(
+                db, doc_id, title=f"document {j}", conversation_ids=[conv_id]
+            )
+
+
+def test_read_user_conversations_only_reads_conversations_of_user(test_db):
+    add_user_conversations(test_db, 1, 2)
+    add_user_conversations(test_db, 2, 1)
+
+    conversations = read_user_conversations(test_db, 1)
+
+    assert [conv.name for conv in conversations] == [
+        "conversation 0",
+        "conversation 1",
+    ]
+    assert [len(conv.documents) for conv in conversations] == [2, 2]
+    assert [conv.agent.type for conv in conversations] == ["dummy", "dummy"]
+
+
+@pytest.mark.parametrize("count", [1, 10])
+def test_read_user_conversations_takes_constant_queries(test_db, count):
+    add_user_conversations(test_db, 1, count)
+    test_db.expire_all()
+
+    with count_queries(test_db) as statements:
+        conversations = read_user_conversations(test_db, 1)
+        for conv in conversations:
+            conv.agent.type, [(doc.id, doc.title) for doc in conv.documents]
+
+    assert len(conversations) == count
+    assert len(statements) == 2
@@ -1,4 +1,5 @@
 import pytest
+import hashlib
 from pathlib import Path
 import io
 from unittest.mock import Mock, patch
@@ -73,6 +74,62 @@ def test_save_file_success_with_uploadfile(
         assert Path(doc.file_path).exists()
 
 
+def test_save_file_stores_sha256_hash(mock_bytes_obj, test_db, tmpdir):
+    with patch(
+        "perry.db.operations.documents.get_file_storage_path", return_value=str(tmpdir)
+    ):
+        doc_id = save_file(db_session=test_db, bytes_obj=mock_bytes_obj, suffix="txt")
+        doc = get_document(test_db, doc_id)
+        assert doc.hash == hashlib.sha256(b"Some binary data here").hexdigest()
+
+
+def test_add_file_document_does_not_commit(mock_bytes_obj, test_db, tmpdir):
+    with patch(
+        "perry.db.operations.documents.get_file_storage_path", return_value=str(tmpdir)
+    ):
+        staged_path, file_hash = stage_file(mock_bytes_obj, "txt")
+    doc_id, file_path = add_file_document(test_db, staged_path, file_hash, "txt")
+    test_db.rollback()
+
+    assert file_path == Path(tmpdir, f"{doc_id}.txt")
+    assert staged_path.read_bytes() == b"Some binary data here"
+    assert get_document(test_db, doc_id) is None
+
+
+def test_save_file_removes_staged_file_on_error(mock_bytes_obj, test_db, tmpdir):
+    with patch(
+        "perry.db.operations.documents.get_file_storage_path", return_value=str(tmpdir)
+    ), patch.object(test_db, "commit", side_effect=Exception("Database error")):
+        with pytest.raises(Exception, match="Database error"):
+            save_file(db_session=test_db, bytes_obj=mock_bytes_obj, suffix="txt")
+
+    assert list(Path(tmpdir).iterdir()) == []
+    assert test_db.query(Document).count() == 0
+
+
+def test_save_bytes_to_file_streams_in_chunks(mock_file_path, monkeypatch):
+    monkeypatch.setattr("perry.db.operations.documents.FILE_CHUNK_SIZE", 4)
+    content = b"Some binary data here"
+    bytes_obj = Mock(wraps=io.BytesIO(content))
+
+    file_hash = save_bytes_to_file(bytes_obj, mock_file_path)
+
+    assert mock_file_path.read_bytes() == content
+    assert file_hash == hashlib.sha256(content).hexdigest()
+    assert all(call.args == (4,) for call in bytes_obj.read.call_args_list)
+    assert list(mock_file_path.parent.iterdir()) == [mock_file_path]
+
+
+def test_save_bytes_to_file_removes_partial_file_on_error(mock_file_path):
+    bytes_obj = Mock()
+    bytes_obj.read.side_effect = [b"partial", IOError("Connection lost")]
+
+    with pytest.raises(IOError):
+        save_bytes_to_file(bytes_obj, mock_file_path)
+
+    assert list(mock_file_path.parent.iterdir()) == []
+
+
 def test_remove_file_success(test_db, mocked_document):
     with patch(
         "perry.db.operations.documents.get_document"
@@ -147,10 +204,19 @@ def test_get_non_existent_document_should_return_none(test_db):
 def test_delete_document(test_db, add_document_to_db):
     created_document_id = add_document_to_db()
 
-    delete_document(test_db, created_document_id)
-    retrieved_document = get_document(test_db, created_document_id)
+    file_path = get_document(test_db, created_document_id).file_path
 
-    assert retrieved_document is None
+    assert delete_document(test_db, created_document_id) == file_path
+    assert get_document(test_db, created_document_id) is None
+
+
+def test_remove_stored_files_skips_missing_files(tmpdir):
+    file_path = Path(tmpdir, "1.pdf")
+    file_path.write_bytes(b"content")
+
+    remove_stored_files(file_path, None, Path(tmpdir, "2.pdf"))
+
+    assert not file_path.exists()
 
 
 def test_remove_user_from_document(test_db, add_document_to_db, create_user_in_db):
@@ -249,6 +315,30 @@ def test_owned_non_existing_user_and_document_returns_false(test_db):
     assert not document_owned_by_user(test_db, -1, -1)
 
 
+def test_get_document_with_ownership_of_owner(
+    test_db, add_document_to_db, create_user_in_db
+):
+    doc_id = add_document_to_db()
+    user_id = create_user_in_db(username="owner", password="password")
+    other_user_id = create_user_in_db(username="other", password="password")
+    update_document(test_db, doc_id, user_ids=[user_id])
+
+    document, owned = get_document_with_ownership(test_db, doc_id, user_id)
+    other_document, other_owned = get_document_with_ownership(
+        test_db, doc_id, other_user_id
+    )
+
+    assert document.id == doc_id and owned is True
+    assert other_document.id == doc_id and other_owned is False
+
+
+def test_get_document_with_ownership_of_non_existing_document(
+    test_db, create_user_in_db
+):
+    user_id = create_user_in_db(username="owner", password="password")
+    assert get_document_with_ownership(test_db, -1, user_id) == (None, False)
+
+
 def test_get_user_documents_returns_all_documents(
     test_db, add_document_to_db, create_user_in_db
 ):
@@ -0,0 +1,62 @@
+import pytest
+from perry.db.operations.jobs import *
+from perry.db.models import IndexingJob
+
+
+def test_should_create_queued_job(test_db, add_conversation_to_db):
+    conversation_id = add_conversation_to_db()
+    job_id = create_job(test_db, conversation_id)
+    job = read_job(test_db, job_id)
+    assert isinstance(job, IndexingJob)
+    assert job.status == JobStatusEnum.queued
+    assert job.progress == 0.0
+    assert job.conversation_id == conversation_id
+
+
+def test_should_create_document_job(test_db, add_document_to_db):
+    document_id = add_document_to_db()
+    job = read_job(test_db, create_job(test_db, document_id=document_id))
+    assert job.document_id == document_id
+    assert job.conversation_id is None
+
+
+@pytest.mark.parametrize("conversation_id, document_id", [(None, None), (1, 1)])
+def test_should_require_either_conversation_or_document(
+    test_db, conversation_id, document_id
+):
+    with pytest.raises(ValueError):
+        create_job(test_db, conversation_id, document_id)
+
+
+def test_should_return_latest_conversation_job(test_db, add_conversation_to_db):
+    conversation_id = add_conversation_to_db()
+    create_job(test_db, conversation_id)
+    latest_job_id = create_job(test_db, conversation_id)
+    assert get_conversation_job(test_db, conversation_id).id == latest_job_id
+
+
+def test_should_return_none_for_conversation_without_job(
+    test_db, add_conversation_to_db
+):
+    assert get_conversation_job(test_db, add_conversation_to_db()) is None
+
+
+def test_should_update_job(test_db, add_conversation_to_db):
+    job_id = create_job(test_db, add_conversation_to_db())
+    assert update_job(test_db, job_id, status=JobStatusEnum.failed, error="boom")
+    job = read_job(test_db, job_id)
+    assert job.status == JobStatusEnum.failed
+    assert job.error == "boom"
+
+
+def test_should_return_none_when_updating_nonexistent_job(test_db):
+    assert update_job(test_db, 9999, progress=0.5) is None
+
+
+def test_should_return_only_unfinished_jobs(test_db, add_conversation_to_db):
+    conversation_id = add_conversation_to_db()
+    job_ids = [create_job(test_db, conversation_id) for _ in range(4)]
+    update_job(test_db, job_ids[1], status=JobStatusEnum.running)
+    update_job(test_db, job_ids[2], status=JobStatusEnum.completed)
+    update_job(test_db, job_ids[3], status=JobStatusEnum.failed)
+    assert [job.id for job in get_unfinished_jobs(test_db)] == job_ids[:2]
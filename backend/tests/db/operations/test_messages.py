@@ -1,6 +1,12 @@
+import pytest
+from perry.db.operations.conversations import (
+    add_messages_to_conversation,
+    create_conversation,
+)
 from perry.db.operations.messages import (
     create_message,
     get_messages_by_user,
+    read_conversation_messages,
     read_message,
     delete_message,
 )
@@ -86,3 +92,38 @@ def test_get_messages_by_user(test_db, create_user_in_db):
     assert len(messages) == 2
     for message in messages:
         assert message.user_id == user_id
+
+
+def add_conversation_messages(db, count: int) -> tuple[int, list[int]]:
+    conversation_id = create_conversation(db)
+    message_ids = [create_message(db, 1, "user", str(i)) for i in range(count)]
+    add_messages_to_conversation(db, conversation_id, message_ids)
+    return conversation_id, message_ids
+
+
+@pytest.mark.parametrize(
+    "before, after, limit, expected",
+    [
+        (None, None, None, [0, 1, 2, 3, 4]),
+        (None, None, 2, [3, 4]),
+        (3, None, 2, [1, 2]),
+        (None, 1, 2, [2, 3]),
+        (None, 4, None, []),
+        (4, 0, None, [1, 2, 3]),
+    ],
+)
+def test_read_conversation_messages_pages_by_id(
+    test_db, before, after, limit, expected
+):
+    conversation_id, message_ids = add_conversation_messages(test_db, 5)
+    add_conversation_messages(test_db, 2)
+
+    messages = read_conversation_messages(
+        test_db,
+        conversation_id,
+        before_id=None if before is None else message_ids[before],
+        after_id=None if after is None else message_ids[after],
+        limit=limit,
+    )
+
+    assert [message.id for message in messages] == [message_ids[i] for i in expected]
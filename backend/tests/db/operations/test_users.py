@@ -1,6 +1,6 @@
 import pytest
 from perry.db.operations.users import *
-from perry.db.models import pwd_context, User
+from perry.db.models import hash_password, pwd_context, User
 
 
 @pytest.fixture(scope="function")
@@ -27,6 +27,16 @@ def test_create_user(test_db):
     assert pwd_context.verify(password, created_user._password)
 
 
+def test_create_user_from_password_hash(test_db):
+    password_hash = hash_password("doe")
+
+    created_user_id = create_user(test_db, "john", password_hash=password_hash)
+    created_user = test_db.query(User).filter_by(id=created_user_id).first()
+
+    assert created_user._password == password_hash
+    assert created_user.verify_password("doe")
+
+
 def test_delete_user_with_correct_id(test_db, create_user_in_db):
     user_id = create_user_in_db("test", "test")
 
@@ -0,0 +1,70 @@
+import pytest
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, inspect, text
+from perry.db.migrations import upgrade_database
+from perry.db.models import Base
+
+
+@pytest.fixture(scope="function")
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/migrations.db")
+    yield engine
+    engine.dispose()
+
+
+def test_migrations_create_schema_of_models(engine):
+    upgrade_database(engine)
+
+    with engine.connect() as connection:
+        differences = compare_metadata(
+            MigrationContext.configure(connection), Base.metadata
+        )
+
+    assert differences == []
+
+
+def test_migrations_upgrade_database_created_before_migrations(engine):
+    legacy_tables = [
+        table
+        for table in Base.metadata.sorted_tables
+        if table.name not in ["messages", "indexing_jobs"]
+    ]
+    for table in legacy_tables:
+        table.create(engine)
+        for index in table.indexes:
+            index.drop(engine)
+
+    upgrade_database(engine)
+
+    with engine.connect() as connection:
+        differences = compare_metadata(
+            MigrationContext.configure(connection), Base.metadata
+        )
+    assert differences == []
+
+
+def test_migrations_remove_duplicate_document_associations(engine):
+    upgrade_database(engine, "0001")
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "INSERT INTO user_document_association (user_id, document_id) "
+                "VALUES (1, 1), (1, 1), (1, 2), (2, 1)"
+            )
+        )
+
+    upgrade_database(engine)
+
+    with engine.connect() as connection:
+        rows = connection.execute(
+            text("SELECT user_id, document_id FROM user_document_association")
+        ).all()
+    assert sorted(rows) == [(1, 1), (1, 2), (2, 1)]
+    assert {
+        index["name"]: index["unique"]
+        for index in inspect(engine).get_indexes("user_document_association")
+    } == {
+        "ix_user_document_association_user_id_document_id": True,
+        "ix_user_document_association_document_id": False,
+    }
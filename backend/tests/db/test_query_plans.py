@@ -0,0 +1,98 @@
+import re
+import pytest
+from sqlalchemy import event
+from perry.db.operations.conversations import (
+    read_user_conversations,
+    update_conversation,
+)
+from perry.db.operations.documents import (
+    create_document,
+    document_hash_in_use,
+    document_owned_by_user,
+    get_document,
+    get_document_with_ownership,
+    get_user_documents,
+    update_document,
+)
+from perry.db.operations.jobs import create_job, get_conversation_job
+from perry.db.operations.messages import (
+    get_messages_by_user,
+    read_conversation_messages,
+)
+
+
+def explain_queries(db, operation) -> list[str]:
+    """Run the operation and return the query plan steps of the queries it made."""
+    statements = []
+    record = lambda conn, cursor, statement, parameters, *args: statements.append(
+        (statement, parameters)
+    )
+    db.expire_all()
+    event.listen(db.get_bind(), "before_cursor_execute", record)
+    try:
+        operation(db)
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", record)
+    connection = db.connection()
+    return [
+        row[3]
+        for statement, parameters in statements
+        for row in connection.exec_driver_sql(
+            f"EXPLAIN QUERY PLAN {statement}", parameters
+        )
+    ]
+
+
+@pytest.fixture(scope="function")
+def seeded_db(
+    test_db, create_user_in_db, add_connected_agent_conversation_to_db
+) -> None:
+    """Add a user with a conversation, document and job, so every query has rows."""
+    user_id = create_user_in_db("arthur", "grail")
+    _, conversation_id = add_connected_agent_conversation_to_db()
+    update_conversation(test_db, conversation_id, user_id)
+    document_id = create_document(test_db)
+    update_document(
+        test_db, document_id, conversation_ids=[conversation_id], user_ids=[user_id]
+    )
+    create_job(test_db, conversation_id)
+
+
+@pytest.mark.parametrize(
+    "operation, index",
+    [
+        (
+            lambda db: read_conversation_messages(db, 1, before_id=10, limit=5),
+            "ix_messages_conversation_id_id",
+        ),
+        (lambda db: get_messages_by_user(db, 1), "ix_messages_user_id"),
+        (lambda db: read_user_conversations(db, 1), "ix_conversations_user_id"),
+        (
+            lambda db: read_user_conversations(db, 1),
+            "ix_conversation_document_association_conversation_id_document_id",
+        ),
+        (
+            lambda db: get_user_documents(db, 1),
+            "ix_user_document_association_user_id_document_id",
+        ),
+        (
+            lambda db: document_owned_by_user(db, 1, 1),
+            "ix_user_document_association_user_id_document_id",
+        ),
+        (
+            lambda db: get_document_with_ownership(db, 1, 1),
+            "ix_user_document_association_user_id_document_id",
+        ),
+        (
+            lambda db: get_document(db, 1).users,
+            "ix_user_document_association_document_id",
+        ),
+        (lambda db: document_hash_in_use(db, "hash"), "ix_documents_hash"),
+        (lambda db: get_conversation_job(db, 1), "ix_indexing_jobs_conversation_id"),
+    ],
+)
+def test_hot_queries_use_indexes(test_db, seeded_db, operation, index):
+    plan = explain_queries(test_db, operation)
+
+    assert any(f"INDEX {index} " in step for step in plan), plan
+    assert not [step for step in plan if re.fullmatch(r"SCAN \w+", step)], plan
@@ -1,12 +1,18 @@
+import sqlite3
 import pytest
 from unittest.mock import Mock
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import AsyncSession
 from perry.db.session import DatabaseSessionManager
+from perry.settings import Settings
 
 
 def test_singleton_behavior(monkeypatch):
-    base = Mock()
-    monkeypatch.setattr("perry.db.session.create_engine", lambda x: "fake_engine")
-    monkeypatch.setattr("perry.db.session.Base", base)
+    monkeypatch.setattr(
+        "perry.db.session.create_engine",
+        lambda url, **kwargs: create_engine("sqlite://"),
+    )
+    monkeypatch.setattr("perry.db.session.upgrade_database", Mock())
 
     engine1 = DatabaseSessionManager.get_engine()
     engine2 = DatabaseSessionManager.get_engine()
@@ -20,9 +26,11 @@ def test_singleton_behavior(monkeypatch):
 
 
 def test_lazy_initialization(monkeypatch):
-    base = Mock()
-    monkeypatch.setattr("perry.db.session.create_engine", lambda x: "fake_engine")
-    monkeypatch.setattr("perry.db.session.Base", base)
+    monkeypatch.setattr(
+        "perry.db.session.create_engine",
+        lambda url, **kwargs: create_engine("sqlite://"),
+    )
+    monkeypatch.setattr("perry.db.session.upgrade_database", Mock())
 
     DatabaseSessionManager._engine = None
     DatabaseSessionManager._SessionLocal = None
@@ -38,10 +46,88 @@ def test_lazy_initialization(monkeypatch):
 
 
 def test_session_properties(monkeypatch):
-    monkeypatch.setattr("perry.db.session.create_engine", lambda x: "fake_engine")
+    monkeypatch.setattr(
+        "perry.db.session.create_engine",
+        lambda url, **kwargs: create_engine("sqlite://"),
+    )
 
     DatabaseSessionManager._SessionLocal = None
     session_local = DatabaseSessionManager.get_session_local()
 
     assert session_local.kw["autocommit"] is False
     assert session_local.kw["autoflush"] is False
+
+
+def test_db_path_should_use_the_configured_directory(monkeypatch, tmp_path):
+    monkeypatch.setattr(DatabaseSessionManager, "_db_directory", tmp_path)
+
+    assert DatabaseSessionManager._get_db_path().parent == tmp_path
+
+
+def test_engine_should_configure_connections_from_settings(monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        "perry.db.session.get_settings",
+        lambda: Settings(db_mmap_size_mb=1, db_busy_timeout_ms=100, db_pool_size=3),
+    )
+    engine = DatabaseSessionManager._create_engine(f"sqlite:///{tmp_path}/test.db")
+
+    with engine.connect() as connection:
+        pragmas = {
+            pragma: connection.exec_driver_sql(f"PRAGMA {pragma}").scalar()
+            for pragma in ["journal_mode", "synchronous", "mmap_size", "busy_timeout"]
+        }
+
+    assert pragmas == {
+        "journal_mode": "wal",
+        "synchronous": 1,
+        "mmap_size": 1024 * 1024,
+        "busy_timeout": 100,
+    }
+    assert engine.pool.size() == 3
+
+
+@pytest.mark.parametrize("journal_mode, blocked", [("wal", False), ("delete", True)])
+def test_open_reads_should_only_block_writes_without_wal(
+    monkeypatch, tmp_path, journal_mode, blocked
+):
+    monkeypatch.setattr(
+        "perry.db.session.get_settings",
+        lambda: Settings(db_journal_mode=journal_mode, db_busy_timeout_ms=100),
+    )
+    engine = DatabaseSessionManager._create_engine(f"sqlite:///{tmp_path}/test.db")
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE messages (message TEXT)")
+    pooled_reader, pooled_writer = engine.raw_connection(), engine.raw_connection()
+    reader, writer = pooled_reader.driver_connection, pooled_writer.driver_connection
+
+    reader.execute("BEGIN")
+    reader.execute("SELECT count(*) FROM messages").fetchone()
+    writer.execute("INSERT INTO messages VALUES ('hello')")
+    if blocked:
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            writer.commit()
+    else:
+        writer.commit()
+        assert reader.execute("SELECT count(*) FROM messages").fetchone() == (0,)
+
+
+@pytest.mark.asyncio
+async def test_async_engine_should_configure_connections_from_settings(monkeypatch):
+    monkeypatch.setattr(
+        "perry.db.session.get_settings",
+        lambda: Settings(db_busy_timeout_ms=100, db_pool_size=3),
+    )
+    monkeypatch.setattr(DatabaseSessionManager, "_async_engine", None)
+    monkeypatch.setattr(DatabaseSessionManager, "_AsyncSessionLocal", None)
+
+    engine = DatabaseSessionManager.get_async_engine()
+    db = DatabaseSessionManager.get_async_db_session()
+    try:
+        busy_timeout = (await db.execute(text("PRAGMA busy_timeout"))).scalar()
+    finally:
+        await db.close()
+        await engine.dispose()
+
+    assert isinstance(db, AsyncSession)
+    assert busy_timeout == 100
+    assert engine.pool.size() == 3
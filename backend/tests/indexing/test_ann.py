@@ -0,0 +1,91 @@
+import numpy as np
+from perry.indexing.ann import IvfIndex
+from perry.indexing.vector_store import MemmapVectorStore
+from tests.indexing.test_vector_store import create_embedding_results, create_store
+
+
+def test_build_lists_every_embedding_once():
+    embeddings = np.random.default_rng(0).normal(size=(100, 8))
+
+    index = IvfIndex.build(embeddings, n_lists=7)
+
+    assert index.n_lists == 7
+    assert sorted(index.order.tolist()) == list(range(100))
+    assert index.offsets[-1] == 100
+
+
+def test_probing_all_lists_returns_all_rows():
+    embeddings = np.random.default_rng(0).normal(size=(50, 8))
+    index = IvfIndex.build(embeddings, n_lists=5)
+
+    candidates = index.get_candidates(embeddings[:3], n_probe=5)
+
+    assert all(sorted(rows.tolist()) == list(range(50)) for rows in candidates)
+
+
+def test_probing_fewer_lists_searches_fewer_rows():
+    embeddings = np.random.default_rng(0).normal(size=(200, 8))
+    index = IvfIndex.build(embeddings, n_lists=10)
+
+    candidates = index.get_candidates(embeddings[:5], n_probe=2)
+
+    assert all(len(rows) < 200 for rows in candidates)
+
+
+def test_ann_query_with_all_probes_matches_exact_query():
+    embedding_results = create_embedding_results(200)
+    store = create_store(embedding_results)
+    queries = [result.embedding for result in embedding_results[:5]]
+    expected = store.query_batch(queries, 10)
+
+    store.build_ann_index(n_lists=8)
+    store.ann_probes = 8
+    results = store.query_batch(queries, 10)
+
+    assert [result.ids for result in results] == [result.ids for result in expected]
+
+
+def test_ann_query_finds_nearest_neighbour_of_stored_embedding():
+    embedding_results = create_embedding_results(500, dim=16)
+    store = create_store(embedding_results)
+    store.build_ann_index(n_lists=20)
+    store.ann_probes = 1
+
+    results = store.query_batch([embedding_results[42].embedding], 1)
+
+    assert results[0].ids == ["node_42"]
+
+
+def test_restricted_query_ignores_ann_index():
+    store = create_store(create_embedding_results(100))
+    store.build_ann_index(n_lists=10)
+    store.ann_probes = 1
+
+    result = store.query_batch([[1.0] * 8], 5, rows=[2, 7])[0]
+
+    assert sorted(result.ids) == ["node_2", "node_7"]
+
+
+def test_adding_embeddings_drops_ann_index():
+    store = create_store(create_embedding_results(50))
+    store.build_ann_index(n_lists=5)
+
+    store.add(create_embedding_results(1, seed=1))
+
+    assert not store.has_ann_index
+
+
+def test_ann_index_is_persisted_and_removed(tmp_path):
+    persist_path = str(tmp_path / "vector_store.json")
+    store = create_store(create_embedding_results(50))
+    store.build_ann_index(n_lists=5)
+    store.persist(persist_path)
+
+    loaded = MemmapVectorStore.from_persist_path(persist_path)
+    assert loaded.has_ann_index
+    assert np.array_equal(loaded._ann_index.order, store._ann_index.order)
+
+    loaded.delete("missing")
+    loaded.add(create_embedding_results(1, seed=1))
+    loaded.persist(persist_path)
+    assert not MemmapVectorStore.from_persist_path(persist_path).has_ann_index
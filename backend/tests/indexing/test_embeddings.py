@@ -0,0 +1,153 @@
+import sqlite3
+from unittest.mock import Mock
+import numpy as np
+from llama_index import ServiceContext
+from llama_index.llms.mock import MockLLM
+from llama_index.utils import GlobalsHelper
+from perry.indexing.embeddings import (
+    CachedEmbedding,
+    EmbeddingCache,
+    HashingEmbedding,
+    create_embed_model,
+    get_query_embedding_batch,
+)
+from perry.indexing.store import IndexStore
+from perry.settings import EmbeddingBackend, Settings
+
+
+class CountingEmbedding(HashingEmbedding):
+    def __init__(self, **kwargs):
+        super().__init__(dim=16, **kwargs)
+        self.batches = []
+
+    def _get_text_embeddings(self, texts):
+        self.batches.append(list(texts))
+        return super()._get_text_embeddings(texts)
+
+
+def queue_texts(embed_model, texts):
+    for i, text in enumerate(texts):
+        embed_model.queue_text_for_embedding(f"id_{i}", text)
+    return embed_model.get_queued_text_embeddings()
+
+
+def test_hashing_embedding_is_normalized_and_deterministic():
+    model = HashingEmbedding(dim=64)
+
+    embedding = model.get_text_embedding("The quick brown fox")
+
+    assert len(embedding) == 64
+    assert np.isclose(np.linalg.norm(embedding), 1.0)
+    assert embedding == HashingEmbedding(dim=64).get_text_embedding(
+        "the QUICK brown fox"
+    )
+
+
+def test_hashing_embedding_scores_shared_words_higher():
+    model = HashingEmbedding(dim=256)
+    query = model.get_query_embedding("revenue growth in europe")
+
+    related = model.get_text_embedding("European revenue growth was strong")
+    unrelated = model.get_text_embedding("The cat sat on the mat")
+
+    assert np.dot(query, related) > np.dot(query, unrelated)
+
+
+def test_hashing_embedding_counts_tokens_without_tiktoken(monkeypatch):
+    monkeypatch.setattr(
+        GlobalsHelper, "tokenizer", property(Mock(side_effect=AssertionError))
+    )
+    model = HashingEmbedding(dim=16)
+
+    model.get_text_embedding("two words")
+
+    assert model.total_tokens_used == 2
+
+
+def test_identical_texts_are_embedded_once_in_batches():
+    inner = CountingEmbedding()
+    model = CachedEmbedding(inner, embed_batch_size=2)
+
+    ids, embeddings = queue_texts(model, ["a", "b", "a", "c", "b"])
+
+    assert ids == [f"id_{i}" for i in range(5)]
+    assert embeddings[0] == embeddings[2]
+    assert embeddings[1] == embeddings[4]
+    assert inner.batches == [["a", "b"], ["c"]]
+
+
+def test_embeddings_are_reused_from_disk_cache():
+    queue_texts(CachedEmbedding(CountingEmbedding()), ["a", "b"])
+    inner = CountingEmbedding()
+
+    _, embeddings = queue_texts(CachedEmbedding(inner), ["b", "c"])
+
+    assert inner.batches == [["c"]]
+    assert embeddings[0] == CountingEmbedding().get_text_embedding("b")
+    assert EmbeddingCache._store_path.exists()
+
+
+def test_embedding_cache_connects_once(monkeypatch):
+    connect = Mock(wraps=sqlite3.connect)
+    monkeypatch.setattr(sqlite3, "connect", connect)
+
+    queue_texts(CachedEmbedding(CountingEmbedding()), ["a"])
+    queue_texts(CachedEmbedding(CountingEmbedding()), ["a", "b"])
+
+    assert connect.call_count == 1
+
+
+def test_embeddings_of_different_models_are_not_shared():
+    queue_texts(CachedEmbedding(HashingEmbedding(dim=16)), ["a"])
+    inner = CountingEmbedding()
+    inner.dim = 32
+
+    queue_texts(CachedEmbedding(inner), ["a"])
+
+    assert inner.batches == [["a"]]
+
+
+def test_query_embedding_batch_skips_the_cache_and_batches_queries():
+    inner = CountingEmbedding(embed_batch_size=2)
+    model = CachedEmbedding(inner)
+
+    embeddings = get_query_embedding_batch(model, ["a", "b", "c"])
+
+    assert inner.batches == [["a", "b"], ["c"]]
+    assert embeddings[2] == inner.get_query_embedding("c")
+    assert EmbeddingCache.get_many(model.model_name, [model.get_text_hash("a")]) == {}
+
+
+def test_create_embed_model_uses_local_backend(monkeypatch):
+    monkeypatch.setattr(
+        "perry.indexing.embeddings.get_settings",
+        lambda: Settings(
+            embedding_backend=EmbeddingBackend.local,
+            local_embedding_dim=32,
+            embed_batch_size=7,
+        ),
+    )
+
+    model = create_embed_model()
+
+    assert isinstance(model.embed_model, HashingEmbedding)
+    assert model.embed_model.dim == 32
+    assert model._embed_batch_size == 7
+
+
+def test_cached_embedding_keeps_index_key_of_wrapped_model():
+    embed_model = HashingEmbedding(dim=16)
+    wrapped = ServiceContext.from_defaults(
+        llm=MockLLM(max_tokens=10), embed_model=CachedEmbedding(embed_model)
+    )
+    unwrapped = ServiceContext.from_defaults(
+        llm=MockLLM(max_tokens=10), embed_model=embed_model
+    )
+    other_dim = ServiceContext.from_defaults(
+        llm=MockLLM(max_tokens=10), embed_model=HashingEmbedding(dim=32)
+    )
+
+    key = IndexStore.get_index_key("hash", wrapped)
+
+    assert key == IndexStore.get_index_key("hash", unwrapped)
+    assert key != IndexStore.get_index_key("hash", other_dim)
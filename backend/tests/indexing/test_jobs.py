@@ -0,0 +1,101 @@
+import pytest
+from unittest.mock import Mock
+from perry.agents.base import AgentRegistry
+from perry.agents.manager import AgentManager
+from perry.db.models import JobStatusEnum
+from perry.db.operations.agents import update_agent
+from perry.db.operations.jobs import create_job, read_job, update_job
+from perry.indexing.jobs import IndexingWorker
+from tests.agents.fixtures import DummyAgent
+
+
+class ProgressAgent(DummyAgent):
+    def _setup(self):
+        self._report_progress(0.5)
+
+
+@pytest.fixture
+def worker():
+    AgentRegistry().register_agent(ProgressAgent)
+    yield IndexingWorker()
+    IndexingWorker().stop()
+    AgentManager.reset()
+
+
+@pytest.fixture
+def add_job_to_db(test_db, add_connected_agent_conversation_to_db):
+    def _add_job_to_db(agent_type="ProgressAgent"):
+        agent_id, conversation_id = add_connected_agent_conversation_to_db()
+        update_agent(
+            test_db, agent_id, config_data={"name": "test"}, agent_type=agent_type
+        )
+        return agent_id, create_job(test_db, conversation_id)
+
+    return _add_job_to_db
+
+
+def test_run_job_loads_agent_and_completes(test_db, worker, add_job_to_db):
+    agent_id, job_id = add_job_to_db()
+
+    worker.run_job(job_id)
+
+    job = read_job(test_db, job_id)
+    assert job.status == JobStatusEnum.completed
+    assert job.progress == 1.0
+    assert agent_id in AgentManager.agent_dict
+
+
+def test_run_job_reports_agent_progress(test_db, worker, add_job_to_db, monkeypatch):
+    _, job_id = add_job_to_db()
+    mock_update_job = Mock(wraps=update_job)
+    monkeypatch.setattr("perry.indexing.jobs.update_job", mock_update_job)
+
+    worker.run_job(job_id)
+
+    progress = [call.kwargs.get("progress") for call in mock_update_job.mock_calls]
+    assert progress == [0.0, 0.5, 1.0]
+
+
+def test_run_job_indexes_document_for_every_agent_type(
+    test_db, worker, add_document_to_db, monkeypatch
+):
+    document_id = add_document_to_db()
+    job_id = create_job(test_db, document_id=document_id)
+    mock_index_document = Mock()
+    monkeypatch.setattr(ProgressAgent, "index_document", mock_index_document)
+
+    worker.run_job(job_id)
+
+    mock_index_document.assert_called_once_with(test_db, document_id)
+    assert read_job(test_db, job_id).status == JobStatusEnum.completed
+
+
+def test_run_job_marks_failure(test_db, worker, add_job_to_db):
+    _, job_id = add_job_to_db(agent_type="UnknownAgent")
+
+    worker.run_job(job_id)
+
+    job = read_job(test_db, job_id)
+    assert job.status == JobStatusEnum.failed
+    assert job.error == "Agent type UnknownAgent not found."
+
+
+def test_start_requeues_unfinished_jobs(test_db, worker, add_job_to_db, monkeypatch):
+    job_ids = [add_job_to_db()[1] for _ in range(3)]
+    update_job(test_db, job_ids[0], status=JobStatusEnum.running)
+    update_job(test_db, job_ids[2], status=JobStatusEnum.completed)
+    mock_submit = Mock()
+    monkeypatch.setattr(IndexingWorker, "submit", mock_submit)
+
+    worker.start()
+
+    assert [call.args[0] for call in mock_submit.call_args_list] == job_ids[:2]
+
+
+def test_submit_runs_job_in_background(test_db, worker, add_job_to_db):
+    _, job_id = add_job_to_db()
+
+    worker.submit(job_id).result(timeout=10)
+
+    test_db.expire_all()
+    assert read_job(test_db, job_id).status == JobStatusEnum.completed
@@ -0,0 +1,91 @@
+import pytest
+from pathlib import Path
+from fpdf import FPDF
+from perry.indexing.parsing import PdfParser, count_pages, parse_page_range
+
+
+def create_pdf(tmp_path: Path, name: str, pages: list[str]) -> Path:
+    file_path = tmp_path / f"{name}.pdf"
+    pdf = FPDF()
+    pdf.set_font("Arial", size=12)
+    for content in pages:
+        pdf.add_page()
+        pdf.cell(200, 10, content, ln=1, align="C")
+    pdf.output(name=str(file_path), dest="F")
+    return file_path
+
+
+@pytest.fixture
+def process_pool():
+    yield
+    PdfParser.shutdown()
+
+
+def test_count_pages(tmp_path):
+    file_path = create_pdf(tmp_path, "three", ["a", "b", "c"])
+    assert count_pages(file_path) == 3
+
+
+def test_parse_page_range_returns_text_and_labels(tmp_path):
+    file_path = create_pdf(tmp_path, "three", ["first", "second", "third"])
+    pages = parse_page_range(file_path, 1, 3)
+    assert [text.strip() for text, _ in pages] == ["second", "third"]
+    assert [label for _, label in pages] == ["2", "3"]
+
+
+@pytest.mark.parametrize(
+    "num_pages, pages_per_task, expected",
+    [
+        (0, 2, []),
+        (3, 2, [(0, 2), (2, 3)]),
+        (4, 2, [(0, 2), (2, 4)]),
+        (1, 5, [(0, 1)]),
+    ],
+)
+def test_page_ranges_cover_all_pages(num_pages, pages_per_task, expected):
+    parser = PdfParser(max_workers=1, pages_per_task=pages_per_task)
+    assert parser._get_page_ranges(num_pages) == expected
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_parse_groups_pages_by_document_id_in_order(
+    tmp_path, process_pool, max_workers
+):
+    file_paths = {
+        7: create_pdf(tmp_path, "long", [f"long {i}" for i in range(5)]),
+        3: create_pdf(tmp_path, "short", ["short 0"]),
+    }
+    parser = PdfParser(max_workers=max_workers, pages_per_task=2)
+
+    docs_grouped = parser.parse(file_paths)
+
+    assert list(docs_grouped.keys()) == [7, 3]
+    assert [doc.text.strip() for doc in docs_grouped[7]] == [
+        f"long {i}" for i in range(5)
+    ]
+    assert [doc.text.strip() for doc in docs_grouped[3]] == ["short 0"]
+    assert docs_grouped[7][0].metadata == {"page_label": "1", "file_name": "long.pdf"}
+
+
+def test_parse_keeps_documents_with_same_file_name_apart(tmp_path, process_pool):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    file_paths = {
+        1: create_pdf(tmp_path / "a", "same", ["from a"]),
+        2: create_pdf(tmp_path / "b", "same", ["from b"]),
+    }
+
+    docs_grouped = PdfParser(max_workers=2).parse(file_paths)
+
+    assert docs_grouped[1][0].text.strip() == "from a"
+    assert docs_grouped[2][0].text.strip() == "from b"
+
+
+def test_executors_honour_max_workers_and_spawn_workers(process_pool):
+    small_pool = PdfParser._get_executor(1)
+    large_pool = PdfParser._get_executor(2)
+
+    assert small_pool is not large_pool
+    assert PdfParser._get_executor(2) is large_pool
+    assert large_pool._max_workers == 2
+    assert large_pool._mp_context.get_start_method() == "spawn"
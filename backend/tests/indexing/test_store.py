@@ -0,0 +1,142 @@
+import json
+import time
+import pytest
+from pathlib import Path
+from threading import Thread
+from types import SimpleNamespace
+from perry.indexing.store import IndexStore
+
+
+class FakeEmbedding:
+    text_engine = "fake-embedding"
+
+
+def create_service_context(chunk_size=1024, chunk_overlap=20):
+    return SimpleNamespace(
+        embed_model=FakeEmbedding(),
+        node_parser=SimpleNamespace(
+            _text_splitter=SimpleNamespace(
+                _chunk_size=chunk_size, _chunk_overlap=chunk_overlap
+            )
+        ),
+    )
+
+
+class FakeIndex:
+    def __init__(self):
+        self.storage_context = self
+
+    def persist(self, persist_dir):
+        Path(persist_dir).mkdir(parents=True)
+        for file_name in IndexStore._required_files:
+            Path(persist_dir, file_name).write_text("{}")
+
+
+def test_index_key_is_stable_for_equal_settings():
+    key1 = IndexStore.get_index_key("hash", create_service_context())
+    key2 = IndexStore.get_index_key("hash", create_service_context())
+    assert key1 == key2
+
+
+@pytest.mark.parametrize(
+    "doc_hash, service_context",
+    [
+        ("other_hash", create_service_context()),
+        ("hash", create_service_context(chunk_size=512)),
+        ("hash", create_service_context(chunk_overlap=0)),
+    ],
+)
+def test_index_key_changes_with_content_or_embedding_settings(
+    doc_hash, service_context
+):
+    key = IndexStore.get_index_key("hash", create_service_context())
+    assert key != IndexStore.get_index_key(doc_hash, service_context)
+
+
+def test_index_key_requires_document_hash():
+    with pytest.raises(ValueError):
+        IndexStore.get_index_key(None, create_service_context())
+
+
+@pytest.mark.parametrize("missing_file", IndexStore._required_files)
+def test_exists_should_return_false_when_required_file_is_missing(missing_file):
+    FakeIndex().persist(IndexStore.get_path("key"))
+    Path(IndexStore.get_path("key"), missing_file).unlink()
+    assert not IndexStore.exists("key")
+
+
+def test_exists_should_return_false_when_directory_is_missing():
+    assert not IndexStore.exists("key")
+
+
+def test_load_should_raise_error_if_index_does_not_exist():
+    with pytest.raises(FileNotFoundError, match=r"Vector index key not found"):
+        IndexStore.load("key", create_service_context())
+
+
+def test_get_or_create_persists_new_index(monkeypatch):
+    monkeypatch.setattr(IndexStore, "load", lambda key, context: "loaded")
+
+    index = IndexStore.get_or_create("key", create_service_context(), FakeIndex)
+
+    assert isinstance(index, FakeIndex)
+    assert IndexStore.exists("key")
+    assert IndexStore.get_or_create("key", create_service_context(), FakeIndex) == (
+        "loaded"
+    )
+
+
+def test_get_or_create_builds_index_once_for_concurrent_requests(monkeypatch):
+    monkeypatch.setattr(IndexStore, "load", lambda key, context: "loaded")
+    builds = []
+
+    def create_index():
+        builds.append(1)
+        time.sleep(0.05)
+        return FakeIndex()
+
+    threads = [
+        Thread(
+            target=IndexStore.get_or_create,
+            args=("key", create_service_context(), create_index),
+        )
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(builds) == 1
+
+
+def test_add_reference_counts_documents_once():
+    IndexStore.add_reference("key", 1)
+    IndexStore.add_reference("key", 1)
+    IndexStore.add_reference("key", 2)
+    assert IndexStore.get_reference_count("key") == 2
+
+
+def test_references_are_persisted(temp_index_store):
+    IndexStore.add_reference("key", 1)
+    with Path(temp_index_store, IndexStore._references_file_name).open() as f:
+        assert json.load(f) == {"key": [1]}
+
+
+def test_remove_references_keeps_index_while_still_referenced():
+    FakeIndex().persist(IndexStore.get_path("key"))
+    IndexStore.add_reference("key", 1)
+    IndexStore.add_reference("key", 2)
+
+    assert IndexStore.remove_references(1) == []
+    assert IndexStore.exists("key")
+    assert IndexStore.get_reference_count("key") == 1
+
+
+def test_remove_references_deletes_unreferenced_index():
+    FakeIndex().persist(IndexStore.get_path("key"))
+    IndexStore.add_reference("key", 1)
+
+    assert IndexStore.remove_references(1) == ["key"]
+    assert not IndexStore.exists("key")
+    assert IndexStore.get_reference_count("key") == 0
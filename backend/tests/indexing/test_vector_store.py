@@ -0,0 +1,163 @@
+import numpy as np
+import pytest
+from llama_index import Document, VectorStoreIndex
+from llama_index.schema import TextNode
+from llama_index.vector_stores import SimpleVectorStore
+from llama_index.vector_stores.types import (
+    NodeWithEmbedding,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+)
+from perry.indexing.store import IndexStore
+from perry.indexing.vector_store import MemmapVectorStore
+from tests.agents.fixtures import create_mock_service_context
+
+
+def create_embedding_results(count: int, dim: int = 8, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    return [
+        NodeWithEmbedding(
+            node=TextNode(text=f"node {i}", id_=f"node_{i}"),
+            embedding=rng.normal(size=dim).tolist(),
+        )
+        for i in range(count)
+    ]
+
+
+def create_store(embedding_results) -> MemmapVectorStore:
+    store = MemmapVectorStore()
+    store.add(embedding_results)
+    return store
+
+
+def test_query_matches_simple_vector_store():
+    embedding_results = create_embedding_results(20)
+    simple_store = SimpleVectorStore()
+    simple_store.add(embedding_results)
+    query = VectorStoreQuery(
+        query_embedding=embedding_results[3].embedding, similarity_top_k=5
+    )
+
+    expected = simple_store.query(query)
+    result = create_store(embedding_results).query(query)
+
+    assert result.ids == expected.ids
+    assert result.similarities == pytest.approx(expected.similarities, abs=1e-5)
+
+
+def test_query_restricts_to_node_ids():
+    store = create_store(create_embedding_results(10))
+    query = VectorStoreQuery(
+        query_embedding=[1.0] * 8, similarity_top_k=5, node_ids=["node_2", "node_7"]
+    )
+    assert sorted(store.query(query).ids) == ["node_2", "node_7"]
+
+
+def test_query_empty_store_returns_nothing():
+    result = MemmapVectorStore().query(VectorStoreQuery(query_embedding=[1.0]))
+    assert result.ids == []
+
+
+def test_query_rejects_unknown_mode():
+    store = create_store(create_embedding_results(2))
+    query = VectorStoreQuery(
+        query_embedding=[1.0] * 8, mode=VectorStoreQueryMode.HYBRID
+    )
+    with pytest.raises(ValueError):
+        store.query(query)
+
+
+def test_persisted_store_is_memory_mapped(tmp_path):
+    embedding_results = create_embedding_results(4)
+    persist_path = str(tmp_path / "vector_store.json")
+    create_store(embedding_results).persist(persist_path)
+
+    assert MemmapVectorStore.exists(str(tmp_path))
+    loaded = MemmapVectorStore.from_persist_dir(str(tmp_path))
+
+    assert loaded.is_memory_mapped
+    assert loaded._embeddings.dtype == np.float32
+    assert loaded._node_ids == [f"node_{i}" for i in range(4)]
+    np.testing.assert_allclose(
+        loaded._embeddings[2], embedding_results[2].embedding, rtol=1e-6
+    )
+
+
+def test_memory_footprint_excludes_mapped_embeddings(tmp_path):
+    store = create_store(create_embedding_results(100, dim=64))
+    store.persist(str(tmp_path / "vector_store.json"))
+    loaded = MemmapVectorStore.from_persist_dir(str(tmp_path))
+
+    assert store.get_memory_footprint() >= 100 * 64 * 4
+    assert loaded.get_memory_footprint() < 100 * 64 * 4
+
+
+def test_persist_and_load_empty_store(tmp_path):
+    MemmapVectorStore().persist(str(tmp_path / "vector_store.json"))
+    loaded = MemmapVectorStore.from_persist_dir(str(tmp_path))
+    assert loaded._embeddings is None
+    assert loaded._node_ids == []
+
+
+def test_delete_removes_nodes_of_document(tmp_path):
+    embedding_results = create_embedding_results(3)
+    store = create_store(embedding_results)
+    store._ref_doc_ids = ["doc_a", "doc_b", "doc_a"]
+    store.persist(str(tmp_path / "vector_store.json"))
+    loaded = MemmapVectorStore.from_persist_dir(str(tmp_path))
+
+    loaded.delete("doc_a")
+
+    assert loaded._node_ids == ["node_1"]
+    assert not loaded.is_memory_mapped
+    assert loaded._embeddings.shape == (1, 8)
+
+
+def test_index_store_round_trip_uses_memory_mapped_store():
+    service_context = create_mock_service_context()
+    index = VectorStoreIndex.from_documents(
+        [Document(text="first page"), Document(text="second page")],
+        service_context=service_context,
+        storage_context=IndexStore.new_storage_context(),
+    )
+    IndexStore._persist("key", index)
+
+    loaded = IndexStore.load("key", service_context)
+
+    vector_store = loaded.storage_context.vector_store
+    assert isinstance(vector_store, MemmapVectorStore)
+    assert vector_store.is_memory_mapped
+    assert len(vector_store._node_ids) == len(index.docstore.docs)
+
+
+def test_query_batch_matches_single_queries():
+    embedding_results = create_embedding_results(50)
+    store = create_store(embedding_results)
+    queries = [result.embedding for result in embedding_results[:4]]
+
+    batch = store.query_batch(queries, similarity_top_k=3)
+
+    for query_embedding, result in zip(queries, batch):
+        single = store.query(
+            VectorStoreQuery(query_embedding=query_embedding, similarity_top_k=3)
+        )
+        assert result.ids == single.ids
+        assert result.similarities == pytest.approx(single.similarities)
+
+
+def test_query_batch_restricted_to_rows():
+    embedding_results = create_embedding_results(10)
+    store = create_store(embedding_results)
+
+    result = store.query_batch(
+        [embedding_results[0].embedding], similarity_top_k=5, rows=[4, 6]
+    )[0]
+
+    assert sorted(result.ids) == ["node_4", "node_6"]
+
+
+@pytest.mark.parametrize("k", [1, 3, 10, 20])
+def test_top_k_rows_match_full_sort(k):
+    scores = np.random.default_rng(1).normal(size=10)
+    expected = np.argsort(-scores)[:k]
+    np.testing.assert_array_equal(MemmapVectorStore.get_top_k_rows(scores, k), expected)
@@ -27,16 +27,14 @@ def get_agent_settings_from_user(settings_schema):
     for key, value in settings_schema.items():
         title = value["title"]
         if value["type"] == "integer" or value["type"] == "number":
-            if "maximum" in value.keys() and "minimum" in value.keys():
-                agent_settings[key] = st.number_input(
-                    title, min_value=value["minimum"], max_value=value["maximum"]
-                )
-            elif "minimum" in value.keys():
-                agent_settings[key] = st.number_input(title, min_value=value["minimum"])
-            elif "maximum" in value.keys():
-                agent_settings[key] = st.number_input(title, max_value=value["maximum"])
-            else:
-                agent_settings[key] = st.number_input(title)
+            input_args = {
+                "minimum": "min_value",
+                "maximum": "max_value",
+                "default": "value",
+            }
+            agent_settings[key] = st.number_input(
+                title, **{input_args[k]: v for k, v in value.items() if k in input_args}
+            )
         elif value["type"] == "boolean":
             agent_settings[key] = st.checkbox(title)
         else:
@@ -1,6 +1,17 @@
+import json
 import requests
 
 
+def iter_server_sent_events(response):
+    """Yield the (event, data) pairs of a streamed Server-Sent Events response."""
+    event = None
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event: "):
+            event = line[len("event: ") :]
+        elif line.startswith("data: "):
+            yield event, json.loads(line[len("data: ") :])
+
+
 class RequestManager:
     def __init__(self, base_url):
         self.base_url = base_url
@@ -57,10 +68,23 @@ class RequestManager:
             headers=self._get_auth_header(token),
         )
 
-    def get_message_history(self, token, conversation_id):
+    def get_conversation_status(self, token, conversation_id):
+        return requests.get(
+            f"{self.base_url}/conversations/{conversation_id}/status",
+            headers=self._get_auth_header(token),
+        )
+
+    def retry_conversation_indexing(self, token, conversation_id):
+        return requests.post(
+            f"{self.base_url}/conversations/{conversation_id}/status",
+            headers=self._get_auth_header(token),
+        )
+
+    def get_message_history(self, token, conversation_id, after_id=None):
         return requests.get(
             f"{self.base_url}/conversations/{conversation_id}/messages",
             headers=self._get_auth_header(token),
+            params={"after_id": after_id} if after_id is not None else None,
         )
 
     def get_document_list(self, token):
@@ -95,5 +119,13 @@ class RequestManager:
             json={"query": query},
         )
 
+    def stream_agent_query(self, token, conversation_id, query):
+        return requests.post(
+            f"{self.base_url}/conversations/{conversation_id}/stream",
+            headers=self._get_auth_header(token),
+            json={"query": query},
+            stream=True,
+        )
+
     def _get_auth_header(self, token):
         return {"Authorization": f"Bearer {token}"}
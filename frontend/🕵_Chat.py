@@ -1,6 +1,6 @@
 import streamlit as st
 from datetime import datetime
-from perry.requests import RequestManager
+from perry.requests import RequestManager, iter_server_sent_events
 from perry.authentication import session_login_wrapper
 
 
@@ -33,6 +33,7 @@ def handle_conversation_selection(request_manager: RequestManager):
             ][0]
             if conversation:
                 display_conversation_info(conversation)
+                display_conversation_status(request_manager, conversation_id)
     else:
         st.write("Failed to retrieve conversations.")
         st.write(conversation_response.status_code)
@@ -41,6 +42,26 @@ def handle_conversation_selection(request_manager: RequestManager):
     return conversation_id
 
 
+def display_conversation_status(request_manager: RequestManager, conversation_id):
+    status_response = request_manager.get_conversation_status(
+        st.session_state["jwt_token"], conversation_id
+    )
+    if status_response.status_code != 200:
+        return
+    conversation_status = status_response.json()
+    if conversation_status["status"] in ["queued", "running"]:
+        st.sidebar.progress(
+            conversation_status["progress"], text="Indexing documents..."
+        )
+    elif conversation_status["status"] == "failed":
+        st.sidebar.error("Indexing documents failed.")
+        if st.sidebar.button("Retry indexing"):
+            request_manager.retry_conversation_indexing(
+                st.session_state["jwt_token"], conversation_id
+            )
+            st.rerun()
+
+
 def display_conversation_info(conversation_info):
     st.sidebar.write("__Agent Type:__ ", conversation_info["agent_type"])
     st.sidebar.write("__Agent Settings:__", conversation_info["agent_settings"])
@@ -51,9 +72,11 @@ def display_conversation_info(conversation_info):
         st.sidebar.write([doc_title for doc_title in conversation_info["doc_titles"]])
 
 
-def load_message_history(request_manager: RequestManager, conversation_id: int):
+def load_message_history(
+    request_manager: RequestManager, conversation_id: int, after_id: int = None
+):
     message_history = request_manager.get_message_history(
-        st.session_state["jwt_token"], conversation_id
+        st.session_state["jwt_token"], conversation_id, after_id
     )
     processed_messages = []
     if message_history.status_code == 200:
@@ -61,6 +84,7 @@ def load_message_history(request_manager: RequestManager, conversation_id: int):
             return []
         for messages in message_history.json():
             processed_message = {}
+            processed_message["id"] = messages["id"]
             processed_message["user"] = messages["role"]
             processed_message["message"] = messages["message"]
             processed_message["timestamp"] = datetime.strptime(
@@ -77,17 +101,12 @@ def load_message_history(request_manager: RequestManager, conversation_id: int):
 def show_chat(request_manager: RequestManager, conversation_id: int):
     if not conversation_id:
         st.session_state["messages"] = []
-    elif "messages" not in st.session_state:
-        st.session_state["messages"] = load_message_history(
-            request_manager, conversation_id
-        )
-    elif st.session_state["messages"] is None:
-        st.session_state["messages"] = load_message_history(
-            request_manager, conversation_id
-        )
-    elif len(st.session_state["messages"]) == 0:
-        st.session_state["messages"] = load_message_history(
-            request_manager, conversation_id
+    else:
+        # Only messages newer than the last one shown are fetched on a rerun.
+        messages = st.session_state.get("messages") or []
+        after_id = messages[-1]["id"] if messages else None
+        st.session_state["messages"] = messages + load_message_history(
+            request_manager, conversation_id, after_id
         )
 
     for message in st.session_state["messages"]:
@@ -97,30 +116,31 @@ def show_chat(request_manager: RequestManager, conversation_id: int):
     query = st.chat_input("Chat with Perry", key="query")
 
     if query:
-        user_message = {
-            "user": "user",
-            "message": query,
-            "timestamp": datetime.now(),
-        }
-        st.session_state["messages"].append(user_message)
-        with st.chat_message(user_message["user"]):
-            st.write(user_message["message"])
-
-        with st.spinner("Writing response..."):
-            agent_response = request_manager.query_agent(
+        with st.chat_message("user"):
+            st.write(query)
+
+        with st.chat_message("assistant"):
+            progress = st.empty()
+            answer = st.empty()
+            agent_response = request_manager.stream_agent_query(
                 st.session_state["jwt_token"], conversation_id, query
             )
-            if agent_response.status_code == 200:
-                agent_response = agent_response.json()
-                st.write(agent_response)
-                st.session_state["messages"].append(
-                    {
-                        "user": "assistant",
-                        "message": agent_response,
-                        "timestamp": datetime.now(),
-                    }
-                )
-            st.rerun()
+            if agent_response.status_code != 200:
+                st.warning(agent_response.json().get("detail", "Query failed."))
+                return
+            tokens = []
+            for event, data in iter_server_sent_events(agent_response):
+                if event == "progress":
+                    progress.caption(data)
+                elif event == "token":
+                    tokens.append(data)
+                    answer.write("".join(tokens))
+                elif event == "error":
+                    st.warning(data)
+                    return
+                elif event == "done":
+                    # The saved query and answer are fetched with their ids on rerun.
+                    st.rerun()
 
 
 def handle_user_display(request_manager):